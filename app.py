@@ -2,11 +2,24 @@ import json
 import os
 from dotenv import load_dotenv
 from flask import Flask, request, jsonify
-from flask_mysqldb import MySQL
+from utils.encoders import Row, Rows
 from utils.formatters import format_response, row_to_dict, rows_to_dict_list
-from utils.validators import validate_pilot_data, validate_ship_data, validate_ship_class_data, validate_weapon_class_data
+from utils.validators import (validate_pilot_data, validate_ship_data, validate_ship_class_data,
+                              validate_weapon_class_data, validate_ship_weapon_data, validate_bulk_data,
+                              validate_bulk_update_data)
 from utils.auth import token_required, generate_token, hash_password, verify_password
-from models import pilot, ship, ship_class, weapon_class, ship_weapons, user
+from utils.db_pool import PooledMySQL
+from utils.cache import entity_cache
+from utils.compression import Compression
+from utils.etag import conditional
+from utils.expand import expand_rows, parse_expand, required_fields
+from utils.fields import parse_fields, key_getter
+from utils.multiget import parse_ids, parse_keys
+from utils.pagination import parse_page_args, paginate, next_page_link
+from utils.response_cache import response_cache
+from utils.streaming import wants_stream, start_stream, stream_response
+from utils.textsearch import fulltext
+from models import pilot, ship, ship_class, weapon_class, ship_weapons, user, reference, autocomplete, summary
 
 # Load environment variables from .env file
 load_dotenv()
@@ -19,13 +32,49 @@ app.config['MYSQL_USER'] = os.getenv('MYSQL_USER', 'root')
 app.config['MYSQL_PASSWORD'] = os.getenv('MYSQL_PASSWORD', 'vondev')
 app.config['MYSQL_DB'] = os.getenv('MYSQL_DB', 'shiperd')
 
-mysql = MySQL(app)
+# Connection pool configuration
+app.config['MYSQL_POOL_MIN_SIZE'] = int(os.getenv('MYSQL_POOL_MIN_SIZE', 2))
+app.config['MYSQL_POOL_MAX_SIZE'] = int(os.getenv('MYSQL_POOL_MAX_SIZE', 10))
+app.config['MYSQL_POOL_TIMEOUT'] = float(os.getenv('MYSQL_POOL_TIMEOUT', 5))
+app.config['MYSQL_POOL_IDLE_TIMEOUT'] = float(os.getenv('MYSQL_POOL_IDLE_TIMEOUT', 300))
+app.config['MYSQL_POOL_PING_INTERVAL'] = float(os.getenv('MYSQL_POOL_PING_INTERVAL', 5))
+app.config['MYSQL_STATEMENT_CACHE_SIZE'] = int(os.getenv('MYSQL_STATEMENT_CACHE_SIZE', 64))
+
+mysql = PooledMySQL(app)
+
+# Load the ship_class/weapon_class snapshot up front; if the database is
+# down it is loaded on first use instead
+with app.app_context():
+    try:
+        reference.load(mysql)
+    except Exception as e:
+        app.logger.warning('Reference snapshot not loaded at startup: %s', e)
+    # Which FULLTEXT indexes exist and which words they hold (retried by
+    # later searches if the database is down)
+    fulltext.ensure_loaded(mysql)
+
+# Keyset pagination defaults for list endpoints
+app.config['API_DEFAULT_PAGE_SIZE'] = int(os.getenv('API_DEFAULT_PAGE_SIZE', 100))
+app.config['API_MAX_PAGE_SIZE'] = int(os.getenv('API_MAX_PAGE_SIZE', 1000))
+
+# Upper bound on ids= / keys= in one multi-get request
+app.config['API_MAX_IDS'] = int(os.getenv('API_MAX_IDS', 100))
+
+# Upper bound on items in one bulk create request
+app.config['API_MAX_BULK_ITEMS'] = int(os.getenv('API_MAX_BULK_ITEMS', 10000))
+
+# Response compression (gzip, plus br/zstd when installed) for bodies of at
+# least COMPRESS_MIN_SIZE bytes; compressed bodies of ETag'd GETs are cached
+app.config['COMPRESS_MIN_SIZE'] = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+app.config['COMPRESS_CACHE_BYTES'] = int(os.getenv('COMPRESS_CACHE_BYTES', 64 * 1024 * 1024))
+
+compression = Compression(app)
 
 # Teardown handler for MySQL connections
 @app.teardown_appcontext
 def close_db(error):
-    # Close database connection after each request
-    pass
+    # Return the request's pooled connection after each request
+    mysql.release(error)
 
 # Column definitions
 PILOT_COLUMNS = ['id', 'name', 'flight_years', 'rank', 'mission_success']
@@ -35,6 +84,10 @@ WEAPON_CLASS_COLUMNS = ['id', 'class', 'damage', 'reload_speed', 'spread', 'rang
 SHIP_WEAPONS_COLUMNS = ['ship_id', 'ship_name', 'ship_class_id', 'ship_class_name', 'weapon_class_id', 'weapon_class_name', 'name']
 USER_COLUMNS = ['id', 'username', 'email', 'created_at']
 
+# Autocomplete suggestions per request
+AUTOCOMPLETE_DEFAULT_LIMIT = 10
+AUTOCOMPLETE_MAX_LIMIT = 50
+
 @app.route('/')
 def home():
     return "Hello, Flask!"
@@ -52,7 +105,14 @@ def test_db():
             return jsonify({
                 'status': 'success',
                 'message': 'Database connection successful',
-                'result': result[0]
+                'result': result[0],
+                'pool': mysql.stats(),
+                'statements': mysql.statement_stats(),
+                'cache': entity_cache.stats(),
+                'reference': reference.stats(),
+                'autocomplete': autocomplete.stats(),
+                'compression': compression.stats(),
+                'responses': response_cache.stats()
             }), 200
         else:
             return jsonify({
@@ -62,7 +122,8 @@ def test_db():
     except Exception as e:
         return jsonify({
             'status': 'error',
-            'message': f'Database connection failed: {str(e)}'
+            'message': f'Database connection failed: {str(e)}',
+            'pool': mysql.stats()
         }), 500
 
 # Authentication Endpoints
@@ -111,15 +172,15 @@ def register():
                 'message': 'Password must be at least 6 characters long'
             }, 400)
         
-        # Check if username already exists
-        if user.username_exists(mysql, username):
+        # Check if username or email already exists (one query for both)
+        username_taken, email_taken = user.find_taken(mysql, username, email)
+        if username_taken:
             return format_response({
                 'status': 'error',
                 'message': 'Username already exists'
             }, 409)
         
-        # Check if email already exists
-        if user.email_exists(mysql, email):
+        if email_taken:
             return format_response({
                 'status': 'error',
                 'message': 'Email already exists'
@@ -141,13 +202,13 @@ def register():
         
         # Get created user
         created_user = user.get_by_id(mysql, user_id)
-        user_dict = row_to_dict(created_user, USER_COLUMNS)
+        user_record = Row(created_user, USER_COLUMNS)
         
         return format_response({
             'status': 'success',
             'message': 'User registered successfully',
             'token': token,
-            'user': user_dict
+            'user': user_record
         }, 201)
     except Exception as e:
         return format_response({
@@ -225,48 +286,79 @@ def login():
 
 # Pilot Endpoints
 @app.route('/api/pilots', methods=['GET'])
+@conditional('pilot')
 def get_pilots():
-    # Get all pilots or search with criteria
+    # Get all pilots optionally filtered and sorted
     try:
-        # Check for search parameters
-        criteria = {}
-        
-        # Name search (string)
-        if request.args.get('name'):
-            criteria['name'] = request.args.get('name')
-        
-        # Rank search (string)
-        if request.args.get('rank'):
-            criteria['rank'] = request.args.get('rank')
-        
-        # Minimum flight years (numeric)
-        if request.args.get('min_flight_years'):
-            try:
-                criteria['min_flight_years'] = int(request.args.get('min_flight_years'))
-            except ValueError:
-                return format_response({
-                    'status': 'error',
-                    'message': 'min_flight_years must be a valid integer'
-                }, 400)
+        # Filters and sort order (name=..., rank=..., min_flight_years=...,
+        # sort=-mission_success,name); a name= search ranks by relevance by default
+        try:
+            query = pilot.FILTERS.parse(request.args)
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
+        
+        # Sparse fieldset (fields=id,name); key and sort columns are always included
+        try:
+            fields = parse_fields(PILOT_COLUMNS, required=query.columns)
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
         
-        # Minimum mission success (numeric)
-        if request.args.get('min_mission_success'):
-            try:
-                criteria['min_mission_success'] = int(request.args.get('min_mission_success'))
-            except ValueError:
+        # Multi-get (ids=1,2,3): every requested record in one query
+        try:
+            ids = parse_ids()
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
+        
+        if ids is not None:
+            if query.criteria:
                 return format_response({
                     'status': 'error',
-                    'message': 'min_mission_success must be a valid integer'
+                    'message': 'ids cannot be combined with search filters'
                 }, 400)
+            pilots_data = pilot.get_many(mysql, ids, fields)
+            found_ids = {row[0] for row in pilots_data}
+            return format_response({
+                'pilots': Rows(pilots_data, fields or PILOT_COLUMNS),
+                'not_found': [pilot_id for pilot_id in ids if pilot_id not in found_ids]
+            }, 200)
+        
+        # Streaming mode: the full result, read from a server-side cursor
+        if wants_stream():
+            rows = start_stream(pilot.stream(mysql, query, fields))
+            return stream_response('pilots', rows, fields or PILOT_COLUMNS)
+        
+        # Keyset pagination (limit + opaque after cursor)
+        try:
+            limit, after = parse_page_args(types=query.cursor_types())
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
         
-        # Use search if criteria provided, otherwise get all
-        if criteria:
-            pilots_data = pilot.search(mysql, criteria)
+        # Plain id order without filters is a primary key range scan; anything
+        # else goes through the filter spec (one extra row is fetched to tell
+        # whether another page exists)
+        if query.criteria or not query.is_default_sort:
+            pilots_data = pilot.search(mysql, query, limit + 1, after, fields)
         else:
-            pilots_data = pilot.get_all(mysql)
+            pilots_data = pilot.get_all(mysql, limit + 1, after[0] if after else None, fields)
         
-        pilots_list = rows_to_dict_list(pilots_data, PILOT_COLUMNS)
-        return format_response({'pilots': pilots_list}, 200)
+        pilots_data, next_cursor = paginate(pilots_data, limit, query.cursor_key(fields or PILOT_COLUMNS))
+        pilots_list = Rows(pilots_data, fields or PILOT_COLUMNS)
+        return format_response({
+            'pilots': pilots_list,
+            'next': next_page_link(next_cursor)
+        }, 200)
     except Exception as e:
         return format_response({
             'status': 'error',
@@ -274,24 +366,56 @@ def get_pilots():
         }, 500)
 
 @app.route('/api/pilots/<int:pilot_id>', methods=['GET'])
+@conditional('pilot')
 def get_pilot(pilot_id):
     # Get a single pilot by ID
     try:
-        pilot_data = pilot.get_by_id(mysql, pilot_id)
+        # Sparse fieldset (fields=id,name); key columns are always included
+        try:
+            fields = parse_fields(PILOT_COLUMNS)
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
+        
+        pilot_data = pilot.get_by_id(mysql, pilot_id, fields=fields)
         if pilot_data is None:
             return format_response({
                 'status': 'error',
                 'message': f'Pilot with ID {pilot_id} not found'
             }, 404)
         
-        pilot_dict = row_to_dict(pilot_data, PILOT_COLUMNS)
-        return format_response({'pilot': pilot_dict}, 200)
+        pilot_record = Row(pilot_data, fields or PILOT_COLUMNS)
+        return format_response({'pilot': pilot_record}, 200)
     except Exception as e:
         return format_response({
             'status': 'error',
             'message': f'Failed to retrieve pilot: {str(e)}'
         }, 500)
 
+@app.route('/api/pilots/<int:pilot_id>/summary', methods=['GET'])
+@conditional('pilot', 'ship')
+def get_pilot_summary(pilot_id):
+    # Number of ships and their total capacity and shield for one pilot,
+    # read from the incrementally maintained summary table
+    try:
+        if pilot.get_by_id(mysql, pilot_id) is None:
+            return format_response({
+                'status': 'error',
+                'message': f'Pilot with ID {pilot_id} not found'
+            }, 404)
+        
+        totals = summary.get(mysql, 'pilot', pilot_id)
+        return format_response({
+            'summary': Row((pilot_id,) + totals, ['pilot_id', *summary.TOTALS])
+        }, 200)
+    except Exception as e:
+        return format_response({
+            'status': 'error',
+            'message': f'Failed to retrieve pilot summary: {str(e)}'
+        }, 500)
+
 @app.route('/api/pilots', methods=['POST'])
 @token_required
 def create_pilot(current_user):
@@ -316,14 +440,14 @@ def create_pilot(current_user):
         # Create pilot
         pilot_id = pilot.create(mysql, data)
         
-        # Retrieve and return the created pilot
-        created_pilot = pilot.get_by_id(mysql, pilot_id)
-        pilot_dict = row_to_dict(created_pilot, PILOT_COLUMNS)
+        # The response is built from the input and the new id (no re-read)
+        created_pilot = (pilot_id, data['name'], data['flight_years'], data['rank'], data['mission_success'])
+        pilot_record = Row(created_pilot, PILOT_COLUMNS)
         
         return format_response({
             'status': 'success',
             'message': 'Pilot created successfully',
-            'pilot': pilot_dict
+            'pilot': pilot_record
         }, 201)
     except Exception as e:
         return format_response({
@@ -331,6 +455,79 @@ def create_pilot(current_user):
             'message': f'Failed to create pilot: {str(e)}'
         }, 500)
 
+@app.route('/api/pilots/bulk', methods=['POST'])
+@token_required
+def create_pilots_bulk(current_user):
+    # Create many pilots in one transaction
+    try:
+        items = request.get_json()
+        
+        # Validate every item before anything is written
+        is_valid, error_message, item_errors = validate_bulk_data(
+            items, validate_pilot_data, app.config['API_MAX_BULK_ITEMS'])
+        if not is_valid:
+            return format_response({
+                'status': 'error',
+                'message': error_message,
+                'errors': item_errors
+            }, 400)
+        
+        pilot_ids = pilot.create_many(mysql, items)
+        
+        # The response is built from the input and the generated ids (no re-read)
+        pilots_data = [(pilot_id, item['name'], item['flight_years'], item['rank'], item['mission_success'])
+                       for pilot_id, item in zip(pilot_ids, items)]
+        return format_response({
+            'status': 'success',
+            'message': f'{len(pilot_ids)} pilots created successfully',
+            'pilots': Rows(pilots_data, PILOT_COLUMNS)
+        }, 201)
+    except Exception as e:
+        return format_response({
+            'status': 'error',
+            'message': f'Failed to create pilots: {str(e)}'
+        }, 500)
+
+@app.route('/api/pilots/bulk', methods=['PATCH'])
+@token_required
+def update_pilots_bulk(current_user):
+    # Update many pilots in one transaction, by id or by filter
+    try:
+        data = request.get_json()
+        
+        # Validate every item before anything is written
+        is_valid, error_message, item_errors = validate_bulk_update_data(
+            data, validate_pilot_data, pilot.UPDATE_COLUMNS, pilot.FILTERS.param_types,
+            app.config['API_MAX_BULK_ITEMS'])
+        if not is_valid:
+            return format_response({
+                'status': 'error',
+                'message': error_message,
+                'errors': item_errors
+            }, 400)
+        
+        # Rows sharing a change set are updated together; only counts are returned
+        if isinstance(data, list):
+            updated = pilot.update_many(mysql, [(item['id'], item['changes']) for item in data])
+            return format_response({
+                'status': 'success',
+                'message': f'{updated} of {len(data)} pilots updated successfully',
+                'updated': updated,
+                'not_found': len(data) - updated
+            }, 200)
+        
+        updated = pilot.update_where(mysql, pilot.FILTERS.from_criteria(data['filter']), data['changes'])
+        return format_response({
+            'status': 'success',
+            'message': f'{updated} pilots updated successfully',
+            'updated': updated
+        }, 200)
+    except Exception as e:
+        return format_response({
+            'status': 'error',
+            'message': f'Failed to update pilots: {str(e)}'
+        }, 500)
+
 @app.route('/api/pilots/<int:pilot_id>', methods=['PUT'])
 @token_required
 def update_pilot(current_user, pilot_id):
@@ -352,25 +549,19 @@ def update_pilot(current_user, pilot_id):
                 'message': error_message
             }, 400)
         
-        # Check if pilot exists
-        existing_pilot = pilot.get_by_id(mysql, pilot_id)
-        if existing_pilot is None:
+        # Update pilot; existence comes from the UPDATE itself
+        updated_pilot = pilot.update(mysql, pilot_id, data)
+        if updated_pilot is None:
             return format_response({
                 'status': 'error',
                 'message': f'Pilot with ID {pilot_id} not found'
             }, 404)
-        
-        # Update pilot
-        pilot.update(mysql, pilot_id, data)
-        
-        # Retrieve and return updated pilot
-        updated_pilot = pilot.get_by_id(mysql, pilot_id)
-        pilot_dict = row_to_dict(updated_pilot, PILOT_COLUMNS)
+        pilot_record = Row(updated_pilot, PILOT_COLUMNS)
         
         return format_response({
             'status': 'success',
             'message': 'Pilot updated successfully',
-            'pilot': pilot_dict
+            'pilot': pilot_record
         }, 200)
     except Exception as e:
         return format_response({
@@ -383,17 +574,13 @@ def update_pilot(current_user, pilot_id):
 def delete_pilot(current_user, pilot_id):
     # Delete a pilot
     try:
-        # Check if pilot exists
-        existing_pilot = pilot.get_by_id(mysql, pilot_id)
-        if existing_pilot is None:
+        # Delete pilot; existence comes from the DELETE itself
+        if pilot.delete(mysql, pilot_id) == 0:
             return format_response({
                 'status': 'error',
                 'message': f'Pilot with ID {pilot_id} not found'
             }, 404)
         
-        # Delete pilot
-        pilot.delete(mysql, pilot_id)
-        
         return format_response({
             'status': 'success',
             'message': f'Pilot with ID {pilot_id} deleted successfully'
@@ -406,98 +593,104 @@ def delete_pilot(current_user, pilot_id):
 
 # Ship Endpoints
 @app.route('/api/ships', methods=['GET'])
+@conditional('ship', 'pilot', 'ship_class', 'ship_weapons', 'weapon_class')
 def get_ships():
-    # Get all ships or search with criteria
+    # Get all ships optionally filtered and sorted
     try:
-        # Check for search parameters
-        criteria = {}
-        
-        # Name search (string)
-        if request.args.get('name'):
-            criteria['name'] = request.args.get('name')
-        
-        # Ship class ID (numeric)
-        if request.args.get('ship_class_id'):
-            try:
-                criteria['ship_class_id'] = int(request.args.get('ship_class_id'))
-            except ValueError:
-                return format_response({
-                    'status': 'error',
-                    'message': 'ship_class_id must be a valid integer'
-                }, 400)
+        # Filters and sort order (name=..., pilot_id=..., min_speed=...,
+        # sort=-speed,name); a name= search ranks by relevance by default
+        try:
+            query = ship.FILTERS.parse(request.args)
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
         
-        # Pilot ID (numeric)
-        if request.args.get('pilot_id'):
-            try:
-                criteria['pilot_id'] = int(request.args.get('pilot_id'))
-            except ValueError:
-                return format_response({
-                    'status': 'error',
-                    'message': 'pilot_id must be a valid integer'
-                }, 400)
+        # Related records (expand=pilot,weapons.weapon_class), loaded per page
+        try:
+            expand = parse_expand(ship.RELATIONS)
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
         
-        # Capacity range (numeric)
-        if request.args.get('min_capacity'):
-            try:
-                criteria['min_capacity'] = int(request.args.get('min_capacity'))
-            except ValueError:
-                return format_response({
-                    'status': 'error',
-                    'message': 'min_capacity must be a valid integer'
-                }, 400)
-        if request.args.get('max_capacity'):
-            try:
-                criteria['max_capacity'] = int(request.args.get('max_capacity'))
-            except ValueError:
-                return format_response({
-                    'status': 'error',
-                    'message': 'max_capacity must be a valid integer'
-                }, 400)
+        # Sparse fieldset (fields=id,name); key and sort columns, and the ids
+        # expanded relations are looked up by, are always included
+        try:
+            fields = parse_fields(SHIP_COLUMNS,
+                                  required=query.columns + required_fields(ship.RELATIONS, expand))
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
         
-        # Speed range (numeric)
-        if request.args.get('min_speed'):
-            try:
-                criteria['min_speed'] = int(request.args.get('min_speed'))
-            except ValueError:
-                return format_response({
-                    'status': 'error',
-                    'message': 'min_speed must be a valid integer'
-                }, 400)
-        if request.args.get('max_speed'):
-            try:
-                criteria['max_speed'] = int(request.args.get('max_speed'))
-            except ValueError:
-                return format_response({
-                    'status': 'error',
-                    'message': 'max_speed must be a valid integer'
-                }, 400)
+        # Multi-get (ids=1,2,3): every requested record in one query
+        try:
+            ids = parse_ids()
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
         
-        # Shield range (numeric)
-        if request.args.get('min_shield'):
-            try:
-                criteria['min_shield'] = int(request.args.get('min_shield'))
-            except ValueError:
+        if ids is not None:
+            if query.criteria:
                 return format_response({
                     'status': 'error',
-                    'message': 'min_shield must be a valid integer'
+                    'message': 'ids cannot be combined with search filters'
                 }, 400)
-        if request.args.get('max_shield'):
-            try:
-                criteria['max_shield'] = int(request.args.get('max_shield'))
-            except ValueError:
+            ships_data = ship.get_many(mysql, ids, fields)
+            found_ids = {row[0] for row in ships_data}
+            if expand:
+                ships_list = expand_rows(mysql, rows_to_dict_list(ships_data, fields or SHIP_COLUMNS),
+                                         ship.RELATIONS, expand)
+            else:
+                ships_list = Rows(ships_data, fields or SHIP_COLUMNS)
+            return format_response({
+                'ships': ships_list,
+                'not_found': [ship_id for ship_id in ids if ship_id not in found_ids]
+            }, 200)
+        
+        # Streaming mode: the full result, read from a server-side cursor
+        if wants_stream():
+            if expand:
                 return format_response({
                     'status': 'error',
-                    'message': 'max_shield must be a valid integer'
+                    'message': 'expand cannot be combined with stream'
                 }, 400)
+            rows = start_stream(ship.stream(mysql, query, fields))
+            return stream_response('ships', rows, fields or SHIP_COLUMNS)
         
-        # Use search if criteria provided, otherwise get all
-        if criteria:
-            ships_data = ship.search(mysql, criteria)
+        # Keyset pagination (limit + opaque after cursor)
+        try:
+            limit, after = parse_page_args(types=query.cursor_types())
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
+        
+        # Plain id order without filters is a primary key range scan; anything
+        # else goes through the filter spec (one extra row is fetched to tell
+        # whether another page exists)
+        if query.criteria or not query.is_default_sort:
+            ships_data = ship.search(mysql, query, limit + 1, after, fields)
         else:
-            ships_data = ship.get_all(mysql)
+            ships_data = ship.get_all(mysql, limit + 1, after[0] if after else None, fields)
         
-        ships_list = rows_to_dict_list(ships_data, SHIP_COLUMNS)
-        return format_response({'ships': ships_list}, 200)
+        ships_data, next_cursor = paginate(ships_data, limit, query.cursor_key(fields or SHIP_COLUMNS))
+        if expand:
+            ships_list = expand_rows(mysql, rows_to_dict_list(ships_data, fields or SHIP_COLUMNS),
+                                     ship.RELATIONS, expand)
+        else:
+            ships_list = Rows(ships_data, fields or SHIP_COLUMNS)
+        return format_response({
+            'ships': ships_list,
+            'next': next_page_link(next_cursor)
+        }, 200)
     except Exception as e:
         return format_response({
             'status': 'error',
@@ -505,18 +698,42 @@ def get_ships():
         }, 500)
 
 @app.route('/api/ships/<int:ship_id>', methods=['GET'])
+@conditional('ship', 'pilot', 'ship_class', 'ship_weapons', 'weapon_class')
 def get_ship(ship_id):
     # Get a single ship by ID
     try:
-        ship_data = ship.get_by_id(mysql, ship_id)
+        # Related records (expand=pilot,weapons.weapon_class)
+        try:
+            expand = parse_expand(ship.RELATIONS)
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
+        
+        # Sparse fieldset (fields=id,name); key columns, and the ids expanded
+        # relations are looked up by, are always included
+        try:
+            fields = parse_fields(SHIP_COLUMNS, required=('id',) + required_fields(ship.RELATIONS, expand))
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
+        
+        ship_data = ship.get_by_id(mysql, ship_id, fields=fields)
         if ship_data is None:
             return format_response({
                 'status': 'error',
                 'message': f'Ship with ID {ship_id} not found'
             }, 404)
         
-        ship_dict = row_to_dict(ship_data, SHIP_COLUMNS)
-        return format_response({'ship': ship_dict}, 200)
+        if expand:
+            ship_record = expand_rows(mysql, [row_to_dict(ship_data, fields or SHIP_COLUMNS)],
+                                      ship.RELATIONS, expand)[0]
+        else:
+            ship_record = Row(ship_data, fields or SHIP_COLUMNS)
+        return format_response({'ship': ship_record}, 200)
     except Exception as e:
         return format_response({
             'status': 'error',
@@ -544,17 +761,35 @@ def create_ship(current_user):
                 'message': error_message
             }, 400)
         
+        # Referenced records must exist; the pilot lookup (entity cache) also
+        # supplies pilot_name for the response
+        if 'ship_class_id' in data and data['ship_class_id'] not in reference.snapshot(mysql).ship_class_by_id:
+            return format_response({
+                'status': 'error',
+                'message': f"Ship class with ID {data['ship_class_id']} not found"
+            }, 400)
+        pilot_row = None
+        if 'pilot_id' in data:
+            pilot_row = pilot.get_by_id(mysql, data['pilot_id'], ('id', 'name'))
+            if pilot_row is None:
+                return format_response({
+                    'status': 'error',
+                    'message': f"Pilot with ID {data['pilot_id']} not found"
+                }, 400)
+        
         # Create ship
         ship_id = ship.create(mysql, data)
         
-        # Retrieve and return the created ship
-        created_ship = ship.get_by_id(mysql, ship_id)
-        ship_dict = row_to_dict(created_ship, SHIP_COLUMNS)
+        # The response is built from the input, the new id and the looked-up names
+        created_ship = ship.full_row(mysql, (ship_id, data['name'], data['capacity'], data['speed'],
+                                             data['shield'], data['ship_class_id'], data['pilot_id']),
+                                     pilot_row[1])
+        ship_record = Row(created_ship, SHIP_COLUMNS)
         
         return format_response({
             'status': 'success',
             'message': 'Ship created successfully',
-            'ship': ship_dict
+            'ship': ship_record
         }, 201)
     except Exception as e:
         return format_response({
@@ -562,6 +797,122 @@ def create_ship(current_user):
             'message': f'Failed to create ship: {str(e)}'
         }, 500)
 
+@app.route('/api/ships/bulk', methods=['POST'])
+@token_required
+def create_ships_bulk(current_user):
+    # Create many ships in one transaction
+    try:
+        items = request.get_json()
+        
+        # Validate every item before anything is written
+        is_valid, error_message, item_errors = validate_bulk_data(
+            items, validate_ship_data, app.config['API_MAX_BULK_ITEMS'])
+        if not is_valid:
+            return format_response({
+                'status': 'error',
+                'message': error_message,
+                'errors': item_errors
+            }, 400)
+        
+        # Referenced ship classes come from the reference snapshot, pilots from one query
+        snapshot = reference.snapshot(mysql)
+        pilot_ids = sorted({item['pilot_id'] for item in items})
+        pilot_names = {row[0]: row[1] for row in pilot.get_many(mysql, pilot_ids, ('id', 'name'))}
+        item_errors = []
+        for index, item in enumerate(items):
+            if item['ship_class_id'] not in snapshot.ship_class_by_id:
+                item_errors.append({'index': index, 'message': f"Ship class with ID {item['ship_class_id']} not found"})
+            elif item['pilot_id'] not in pilot_names:
+                item_errors.append({'index': index, 'message': f"Pilot with ID {item['pilot_id']} not found"})
+        if item_errors:
+            return format_response({
+                'status': 'error',
+                'message': f'{len(item_errors)} of {len(items)} items reference missing records',
+                'errors': item_errors
+            }, 400)
+        
+        ship_ids = ship.create_many(mysql, items)
+        
+        # The response is built from the input, the generated ids and the looked-up names
+        ships_data = [(ship_id, item['name'], item['capacity'], item['speed'], item['shield'],
+                       item['ship_class_id'], snapshot.ship_class_name(item['ship_class_id']),
+                       item['pilot_id'], pilot_names[item['pilot_id']])
+                      for ship_id, item in zip(ship_ids, items)]
+        return format_response({
+            'status': 'success',
+            'message': f'{len(ship_ids)} ships created successfully',
+            'ships': Rows(ships_data, SHIP_COLUMNS)
+        }, 201)
+    except Exception as e:
+        return format_response({
+            'status': 'error',
+            'message': f'Failed to create ships: {str(e)}'
+        }, 500)
+
+@app.route('/api/ships/bulk', methods=['PATCH'])
+@token_required
+def update_ships_bulk(current_user):
+    # Update many ships in one transaction, by id or by filter
+    try:
+        data = request.get_json()
+        
+        # Validate every item before anything is written
+        is_valid, error_message, item_errors = validate_bulk_update_data(
+            data, validate_ship_data, ship.UPDATE_COLUMNS, ship.FILTERS.param_types,
+            app.config['API_MAX_BULK_ITEMS'])
+        if not is_valid:
+            return format_response({
+                'status': 'error',
+                'message': error_message,
+                'errors': item_errors
+            }, 400)
+        
+        # Referenced ship classes come from the reference snapshot, pilots from one query
+        change_sets = [item['changes'] for item in data] if isinstance(data, list) else [data['changes']]
+        snapshot = reference.snapshot(mysql)
+        pilot_ids = sorted({changes['pilot_id'] for changes in change_sets if 'pilot_id' in changes})
+        found_pilots = {row[0] for row in pilot.get_many(mysql, pilot_ids, ('id',))}
+        item_errors = []
+        for index, changes in enumerate(change_sets):
+            if 'ship_class_id' in changes and changes['ship_class_id'] not in snapshot.ship_class_by_id:
+                item_errors.append({'index': index, 'message': f"Ship class with ID {changes['ship_class_id']} not found"})
+            elif 'pilot_id' in changes and changes['pilot_id'] not in found_pilots:
+                item_errors.append({'index': index, 'message': f"Pilot with ID {changes['pilot_id']} not found"})
+        if item_errors:
+            if not isinstance(data, list):
+                return format_response({
+                    'status': 'error',
+                    'message': item_errors[0]['message'],
+                    'errors': []
+                }, 400)
+            return format_response({
+                'status': 'error',
+                'message': f'{len(item_errors)} of {len(data)} items reference missing records',
+                'errors': item_errors
+            }, 400)
+        
+        # Rows sharing a change set are updated together; only counts are returned
+        if isinstance(data, list):
+            updated = ship.update_many(mysql, [(item['id'], item['changes']) for item in data])
+            return format_response({
+                'status': 'success',
+                'message': f'{updated} of {len(data)} ships updated successfully',
+                'updated': updated,
+                'not_found': len(data) - updated
+            }, 200)
+        
+        updated = ship.update_where(mysql, ship.FILTERS.from_criteria(data['filter']), data['changes'])
+        return format_response({
+            'status': 'success',
+            'message': f'{updated} ships updated successfully',
+            'updated': updated
+        }, 200)
+    except Exception as e:
+        return format_response({
+            'status': 'error',
+            'message': f'Failed to update ships: {str(e)}'
+        }, 500)
+
 @app.route('/api/ships/<int:ship_id>', methods=['PUT'])
 @token_required
 def update_ship(current_user, ship_id):
@@ -583,25 +934,40 @@ def update_ship(current_user, ship_id):
                 'message': error_message
             }, 400)
         
-        # Check if ship exists
-        existing_ship = ship.get_by_id(mysql, ship_id)
-        if existing_ship is None:
+        # Referenced records must exist; the pilot lookup (entity cache) also
+        # supplies pilot_name for the response
+        if 'ship_class_id' in data and data['ship_class_id'] not in reference.snapshot(mysql).ship_class_by_id:
+            return format_response({
+                'status': 'error',
+                'message': f"Ship class with ID {data['ship_class_id']} not found"
+            }, 400)
+        pilot_row = None
+        if 'pilot_id' in data:
+            pilot_row = pilot.get_by_id(mysql, data['pilot_id'], ('id', 'name'))
+            if pilot_row is None:
+                return format_response({
+                    'status': 'error',
+                    'message': f"Pilot with ID {data['pilot_id']} not found"
+                }, 400)
+        
+        # Update ship; existence comes from the UPDATE itself
+        updated_ship = ship.update(mysql, ship_id, data)
+        if updated_ship is None:
             return format_response({
                 'status': 'error',
                 'message': f'Ship with ID {ship_id} not found'
             }, 404)
         
-        # Update ship
-        ship.update(mysql, ship_id, data)
-        
-        # Retrieve and return updated ship
-        updated_ship = ship.get_by_id(mysql, ship_id)
-        ship_dict = row_to_dict(updated_ship, SHIP_COLUMNS)
+        # An unchanged pilot's name comes from the entity cache
+        if pilot_row is None:
+            pilot_row = pilot.get_by_id(mysql, updated_ship[6], ('id', 'name'))
+        ship_record = Row(ship.full_row(mysql, updated_ship, pilot_row[1] if pilot_row else None),
+                         SHIP_COLUMNS)
         
         return format_response({
             'status': 'success',
             'message': 'Ship updated successfully',
-            'ship': ship_dict
+            'ship': ship_record
         }, 200)
     except Exception as e:
         return format_response({
@@ -614,17 +980,13 @@ def update_ship(current_user, ship_id):
 def delete_ship(current_user, ship_id):
     # Delete a ship
     try:
-        # Check if ship exists
-        existing_ship = ship.get_by_id(mysql, ship_id)
-        if existing_ship is None:
+        # Delete ship and its ship_weapons entries; existence comes from the DELETE itself
+        if ship.delete(mysql, ship_id) == 0:
             return format_response({
                 'status': 'error',
                 'message': f'Ship with ID {ship_id} not found'
             }, 404)
         
-        # Delete ship (also deletes ship_weapons entries)
-        ship.delete(mysql, ship_id)
-        
         return format_response({
             'status': 'success',
             'message': f'Ship with ID {ship_id} deleted successfully'
@@ -637,28 +999,74 @@ def delete_ship(current_user, ship_id):
 
 # ShipClass Endpoints
 @app.route('/api/ship-classes', methods=['GET'])
+@conditional('ship_class')
 def get_ship_classes():
-    # Get all ship classes or search with criteria
+    # Get all ship classes optionally filtered and sorted
     try:
-        # Check for search parameters
-        criteria = {}
+        # Filters and sort order (name=..., description=..., sort=-name);
+        # a name= or description= search ranks by relevance by default
+        try:
+            query = ship_class.FILTERS.parse(request.args)
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
         
-        # Name search (string)
-        if request.args.get('name'):
-            criteria['name'] = request.args.get('name')
+        # Sparse fieldset (fields=id,name); key and sort columns are always included
+        try:
+            fields = parse_fields(SHIP_CLASS_COLUMNS, required=query.columns)
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
         
-        # Description search (string)
-        if request.args.get('description'):
-            criteria['description'] = request.args.get('description')
+        # Multi-get (ids=1,2,3): every requested record in one query
+        try:
+            ids = parse_ids()
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
         
-        # Use search if criteria provided, otherwise get all
-        if criteria:
-            ship_classes_data = ship_class.search(mysql, criteria)
+        if ids is not None:
+            if query.criteria:
+                return format_response({
+                    'status': 'error',
+                    'message': 'ids cannot be combined with search filters'
+                }, 400)
+            ship_classes_data = ship_class.get_many(mysql, ids, fields)
+            found_ids = {row[0] for row in ship_classes_data}
+            return format_response({
+                'ship_classes': Rows(ship_classes_data, fields or SHIP_CLASS_COLUMNS),
+                'not_found': [class_id for class_id in ids if class_id not in found_ids]
+            }, 200)
+        
+        # Keyset pagination (limit + opaque after cursor)
+        try:
+            limit, after = parse_page_args(types=query.cursor_types())
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
+        
+        # Plain id order without filters is a primary key range scan; anything
+        # else goes through the filter spec (one extra row is fetched to tell
+        # whether another page exists)
+        if query.criteria or not query.is_default_sort:
+            ship_classes_data = ship_class.search(mysql, query, limit + 1, after, fields)
         else:
-            ship_classes_data = ship_class.get_all(mysql)
+            ship_classes_data = ship_class.get_all(mysql, limit + 1, after[0] if after else None, fields)
         
-        ship_classes_list = rows_to_dict_list(ship_classes_data, SHIP_CLASS_COLUMNS)
-        return format_response({'ship_classes': ship_classes_list}, 200)
+        ship_classes_data, next_cursor = paginate(ship_classes_data, limit, query.cursor_key(fields or SHIP_CLASS_COLUMNS))
+        ship_classes_list = Rows(ship_classes_data, fields or SHIP_CLASS_COLUMNS)
+        return format_response({
+            'ship_classes': ship_classes_list,
+            'next': next_page_link(next_cursor)
+        }, 200)
     except Exception as e:
         return format_response({
             'status': 'error',
@@ -666,24 +1074,56 @@ def get_ship_classes():
         }, 500)
 
 @app.route('/api/ship-classes/<int:class_id>', methods=['GET'])
+@conditional('ship_class')
 def get_ship_class(class_id):
     # Get a single ship class by ID
     try:
-        ship_class_data = ship_class.get_by_id(mysql, class_id)
+        # Sparse fieldset (fields=id,name); key columns are always included
+        try:
+            fields = parse_fields(SHIP_CLASS_COLUMNS)
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
+        
+        ship_class_data = ship_class.get_by_id(mysql, class_id, fields=fields)
         if ship_class_data is None:
             return format_response({
                 'status': 'error',
                 'message': f'Ship class with ID {class_id} not found'
             }, 404)
         
-        ship_class_dict = row_to_dict(ship_class_data, SHIP_CLASS_COLUMNS)
-        return format_response({'ship_class': ship_class_dict}, 200)
+        ship_class_record = Row(ship_class_data, fields or SHIP_CLASS_COLUMNS)
+        return format_response({'ship_class': ship_class_record}, 200)
     except Exception as e:
         return format_response({
             'status': 'error',
             'message': f'Failed to retrieve ship class: {str(e)}'
         }, 500)
 
+@app.route('/api/ship-classes/<int:class_id>/summary', methods=['GET'])
+@conditional('ship_class', 'ship')
+def get_ship_class_summary(class_id):
+    # Number of ships and their total capacity and shield for one ship class,
+    # read from the incrementally maintained summary table
+    try:
+        if ship_class.get_by_id(mysql, class_id) is None:
+            return format_response({
+                'status': 'error',
+                'message': f'Ship class with ID {class_id} not found'
+            }, 404)
+        
+        totals = summary.get(mysql, 'ship_class', class_id)
+        return format_response({
+            'summary': Row((class_id,) + totals, ['ship_class_id', *summary.TOTALS])
+        }, 200)
+    except Exception as e:
+        return format_response({
+            'status': 'error',
+            'message': f'Failed to retrieve ship class summary: {str(e)}'
+        }, 500)
+
 @app.route('/api/ship-classes', methods=['POST'])
 @token_required
 def create_ship_class(current_user):
@@ -708,14 +1148,14 @@ def create_ship_class(current_user):
         # Create ship class
         class_id = ship_class.create(mysql, data)
         
-        # Retrieve and return the created ship class
-        created_ship_class = ship_class.get_by_id(mysql, class_id)
-        ship_class_dict = row_to_dict(created_ship_class, SHIP_CLASS_COLUMNS)
+        # The response is built from the input and the new id (no re-read)
+        created_ship_class = (class_id, data['name'], data.get('description'))
+        ship_class_record = Row(created_ship_class, SHIP_CLASS_COLUMNS)
         
         return format_response({
             'status': 'success',
             'message': 'Ship class created successfully',
-            'ship_class': ship_class_dict
+            'ship_class': ship_class_record
         }, 201)
     except Exception as e:
         return format_response({
@@ -744,25 +1184,19 @@ def update_ship_class(current_user, class_id):
                 'message': error_message
             }, 400)
         
-        # Check if ship class exists
-        existing_ship_class = ship_class.get_by_id(mysql, class_id)
-        if existing_ship_class is None:
+        # Update ship class; existence comes from the UPDATE itself
+        updated_ship_class = ship_class.update(mysql, class_id, data)
+        if updated_ship_class is None:
             return format_response({
                 'status': 'error',
                 'message': f'Ship class with ID {class_id} not found'
             }, 404)
-        
-        # Update ship class
-        ship_class.update(mysql, class_id, data)
-        
-        # Retrieve and return updated ship class
-        updated_ship_class = ship_class.get_by_id(mysql, class_id)
-        ship_class_dict = row_to_dict(updated_ship_class, SHIP_CLASS_COLUMNS)
+        ship_class_record = Row(updated_ship_class, SHIP_CLASS_COLUMNS)
         
         return format_response({
             'status': 'success',
             'message': 'Ship class updated successfully',
-            'ship_class': ship_class_dict
+            'ship_class': ship_class_record
         }, 200)
     except Exception as e:
         return format_response({
@@ -775,17 +1209,13 @@ def update_ship_class(current_user, class_id):
 def delete_ship_class(current_user, class_id):
     # Delete a ship class
     try:
-        # Check if ship class exists
-        existing_ship_class = ship_class.get_by_id(mysql, class_id)
-        if existing_ship_class is None:
+        # Delete ship class; existence comes from the DELETE itself
+        if ship_class.delete(mysql, class_id) == 0:
             return format_response({
                 'status': 'error',
                 'message': f'Ship class with ID {class_id} not found'
             }, 404)
         
-        # Delete ship class
-        ship_class.delete(mysql, class_id)
-        
         return format_response({
             'status': 'success',
             'message': f'Ship class with ID {class_id} deleted successfully'
@@ -798,96 +1228,79 @@ def delete_ship_class(current_user, class_id):
 
 # WeaponClass Endpoints
 @app.route('/api/weapon-classes', methods=['GET'])
+@conditional('weapon_class')
 def get_weapon_classes():
-    # Get all weapon classes or search with criteria
+    # Get all weapon classes optionally filtered and sorted
     try:
-        # Check for search parameters
-        criteria = {}
-        
-        # Class name search (string)
-        if request.args.get('class'):
-            criteria['class'] = request.args.get('class')
-        
-        # Damage range (numeric)
-        if request.args.get('min_damage'):
-            try:
-                criteria['min_damage'] = int(request.args.get('min_damage'))
-            except ValueError:
-                return format_response({
-                    'status': 'error',
-                    'message': 'min_damage must be a valid integer'
-                }, 400)
-        if request.args.get('max_damage'):
-            try:
-                criteria['max_damage'] = int(request.args.get('max_damage'))
-            except ValueError:
-                return format_response({
-                    'status': 'error',
-                    'message': 'max_damage must be a valid integer'
-                }, 400)
+        # Filters and sort order (class=..., min_damage=..., max_range=...,
+        # sort=-damage,class); a class= search ranks by relevance by default
+        try:
+            query = weapon_class.FILTERS.parse(request.args)
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
         
-        # Reload speed range (numeric)
-        if request.args.get('min_reload_speed'):
-            try:
-                criteria['min_reload_speed'] = int(request.args.get('min_reload_speed'))
-            except ValueError:
-                return format_response({
-                    'status': 'error',
-                    'message': 'min_reload_speed must be a valid integer'
-                }, 400)
-        if request.args.get('max_reload_speed'):
-            try:
-                criteria['max_reload_speed'] = int(request.args.get('max_reload_speed'))
-            except ValueError:
-                return format_response({
-                    'status': 'error',
-                    'message': 'max_reload_speed must be a valid integer'
-                }, 400)
+        # Sparse fieldset (fields=id,name); key and sort columns are always included
+        try:
+            fields = parse_fields(WEAPON_CLASS_COLUMNS, required=query.columns)
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
         
-        # Spread range (numeric)
-        if request.args.get('min_spread'):
-            try:
-                criteria['min_spread'] = int(request.args.get('min_spread'))
-            except ValueError:
-                return format_response({
-                    'status': 'error',
-                    'message': 'min_spread must be a valid integer'
-                }, 400)
-        if request.args.get('max_spread'):
-            try:
-                criteria['max_spread'] = int(request.args.get('max_spread'))
-            except ValueError:
-                return format_response({
-                    'status': 'error',
-                    'message': 'max_spread must be a valid integer'
-                }, 400)
+        # Multi-get (ids=1,2,3): every requested record in one query
+        try:
+            ids = parse_ids()
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
         
-        # Range range (numeric)
-        if request.args.get('min_range'):
-            try:
-                criteria['min_range'] = int(request.args.get('min_range'))
-            except ValueError:
+        if ids is not None:
+            if query.criteria:
                 return format_response({
                     'status': 'error',
-                    'message': 'min_range must be a valid integer'
-                }, 400)
-        if request.args.get('max_range'):
-            try:
-                criteria['max_range'] = int(request.args.get('max_range'))
-            except ValueError:
-                return format_response({
-                    'status': 'error',
-                    'message': 'max_range must be a valid integer'
+                    'message': 'ids cannot be combined with search filters'
                 }, 400)
+            weapon_classes_data = weapon_class.get_many(mysql, ids, fields)
+            found_ids = {row[0] for row in weapon_classes_data}
+            return format_response({
+                'weapon_classes': Rows(weapon_classes_data, fields or WEAPON_CLASS_COLUMNS),
+                'not_found': [weapon_id for weapon_id in ids if weapon_id not in found_ids]
+            }, 200)
+        
+        # Streaming mode: the full result, read from a server-side cursor
+        if wants_stream():
+            rows = start_stream(weapon_class.stream(mysql, query, fields))
+            return stream_response('weapon_classes', rows, fields or WEAPON_CLASS_COLUMNS)
+        
+        # Keyset pagination (limit + opaque after cursor)
+        try:
+            limit, after = parse_page_args(types=query.cursor_types())
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
         
-        # Use search if criteria provided, otherwise get all
-        if criteria:
-            weapon_classes_data = weapon_class.search(mysql, criteria)
+        # Plain id order without filters is a primary key range scan; anything
+        # else goes through the filter spec (one extra row is fetched to tell
+        # whether another page exists)
+        if query.criteria or not query.is_default_sort:
+            weapon_classes_data = weapon_class.search(mysql, query, limit + 1, after, fields)
         else:
-            weapon_classes_data = weapon_class.get_all(mysql)
+            weapon_classes_data = weapon_class.get_all(mysql, limit + 1, after[0] if after else None, fields)
         
-        weapon_classes_list = rows_to_dict_list(weapon_classes_data, WEAPON_CLASS_COLUMNS)
-        return format_response({'weapon_classes': weapon_classes_list}, 200)
+        weapon_classes_data, next_cursor = paginate(weapon_classes_data, limit, query.cursor_key(fields or WEAPON_CLASS_COLUMNS))
+        weapon_classes_list = Rows(weapon_classes_data, fields or WEAPON_CLASS_COLUMNS)
+        return format_response({
+            'weapon_classes': weapon_classes_list,
+            'next': next_page_link(next_cursor)
+        }, 200)
     except Exception as e:
         return format_response({
             'status': 'error',
@@ -895,18 +1308,28 @@ def get_weapon_classes():
         }, 500)
 
 @app.route('/api/weapon-classes/<int:weapon_id>', methods=['GET'])
+@conditional('weapon_class')
 def get_weapon_class(weapon_id):
     # Get a single weapon class by ID
     try:
-        weapon_class_data = weapon_class.get_by_id(mysql, weapon_id)
+        # Sparse fieldset (fields=id,name); key columns are always included
+        try:
+            fields = parse_fields(WEAPON_CLASS_COLUMNS)
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
+        
+        weapon_class_data = weapon_class.get_by_id(mysql, weapon_id, fields=fields)
         if weapon_class_data is None:
             return format_response({
                 'status': 'error',
                 'message': f'Weapon class with ID {weapon_id} not found'
             }, 404)
         
-        weapon_class_dict = row_to_dict(weapon_class_data, WEAPON_CLASS_COLUMNS)
-        return format_response({'weapon_class': weapon_class_dict}, 200)
+        weapon_class_record = Row(weapon_class_data, fields or WEAPON_CLASS_COLUMNS)
+        return format_response({'weapon_class': weapon_class_record}, 200)
     except Exception as e:
         return format_response({
             'status': 'error',
@@ -937,14 +1360,15 @@ def create_weapon_class(current_user):
         # Create weapon class
         weapon_id = weapon_class.create(mysql, data)
         
-        # Retrieve and return the created weapon class
-        created_weapon_class = weapon_class.get_by_id(mysql, weapon_id)
-        weapon_class_dict = row_to_dict(created_weapon_class, WEAPON_CLASS_COLUMNS)
+        # The response is built from the input and the new id (no re-read)
+        created_weapon_class = (weapon_id, data['class'], data['damage'], data['reload_speed'],
+                                data['spread'], data['range'])
+        weapon_class_record = Row(created_weapon_class, WEAPON_CLASS_COLUMNS)
         
         return format_response({
             'status': 'success',
             'message': 'Weapon class created successfully',
-            'weapon_class': weapon_class_dict
+            'weapon_class': weapon_class_record
         }, 201)
     except Exception as e:
         return format_response({
@@ -952,6 +1376,80 @@ def create_weapon_class(current_user):
             'message': f'Failed to create weapon class: {str(e)}'
         }, 500)
 
+@app.route('/api/weapon-classes/bulk', methods=['POST'])
+@token_required
+def create_weapon_classes_bulk(current_user):
+    # Create many weapon classes in one transaction
+    try:
+        items = request.get_json()
+        
+        # Validate every item before anything is written
+        is_valid, error_message, item_errors = validate_bulk_data(
+            items, validate_weapon_class_data, app.config['API_MAX_BULK_ITEMS'])
+        if not is_valid:
+            return format_response({
+                'status': 'error',
+                'message': error_message,
+                'errors': item_errors
+            }, 400)
+        
+        weapon_ids = weapon_class.create_many(mysql, items)
+        
+        # The response is built from the input and the generated ids (no re-read)
+        weapon_classes_data = [(weapon_id, item['class'], item['damage'], item['reload_speed'],
+                                item['spread'], item['range'])
+                               for weapon_id, item in zip(weapon_ids, items)]
+        return format_response({
+            'status': 'success',
+            'message': f'{len(weapon_ids)} weapon classes created successfully',
+            'weapon_classes': Rows(weapon_classes_data, WEAPON_CLASS_COLUMNS)
+        }, 201)
+    except Exception as e:
+        return format_response({
+            'status': 'error',
+            'message': f'Failed to create weapon classes: {str(e)}'
+        }, 500)
+
+@app.route('/api/weapon-classes/bulk', methods=['PATCH'])
+@token_required
+def update_weapon_classes_bulk(current_user):
+    # Update many weapon classes in one transaction, by id or by filter
+    try:
+        data = request.get_json()
+        
+        # Validate every item before anything is written
+        is_valid, error_message, item_errors = validate_bulk_update_data(
+            data, validate_weapon_class_data, weapon_class.UPDATE_COLUMNS, weapon_class.FILTERS.param_types,
+            app.config['API_MAX_BULK_ITEMS'])
+        if not is_valid:
+            return format_response({
+                'status': 'error',
+                'message': error_message,
+                'errors': item_errors
+            }, 400)
+        
+        # Rows sharing a change set are updated together; only counts are returned
+        if isinstance(data, list):
+            updated = weapon_class.update_many(mysql, [(item['id'], item['changes']) for item in data])
+            return format_response({
+                'status': 'success',
+                'message': f'{updated} of {len(data)} weapon classes updated successfully',
+                'updated': updated,
+                'not_found': len(data) - updated
+            }, 200)
+        
+        updated = weapon_class.update_where(mysql, weapon_class.FILTERS.from_criteria(data['filter']), data['changes'])
+        return format_response({
+            'status': 'success',
+            'message': f'{updated} weapon classes updated successfully',
+            'updated': updated
+        }, 200)
+    except Exception as e:
+        return format_response({
+            'status': 'error',
+            'message': f'Failed to update weapon classes: {str(e)}'
+        }, 500)
+
 @app.route('/api/weapon-classes/<int:weapon_id>', methods=['PUT'])
 @token_required
 def update_weapon_class(current_user, weapon_id):
@@ -973,25 +1471,19 @@ def update_weapon_class(current_user, weapon_id):
                 'message': error_message
             }, 400)
         
-        # Check if weapon class exists
-        existing_weapon_class = weapon_class.get_by_id(mysql, weapon_id)
-        if existing_weapon_class is None:
+        # Update weapon class; existence comes from the UPDATE itself
+        updated_weapon_class = weapon_class.update(mysql, weapon_id, data)
+        if updated_weapon_class is None:
             return format_response({
                 'status': 'error',
                 'message': f'Weapon class with ID {weapon_id} not found'
             }, 404)
-        
-        # Update weapon class
-        weapon_class.update(mysql, weapon_id, data)
-        
-        # Retrieve and return updated weapon class
-        updated_weapon_class = weapon_class.get_by_id(mysql, weapon_id)
-        weapon_class_dict = row_to_dict(updated_weapon_class, WEAPON_CLASS_COLUMNS)
+        weapon_class_record = Row(updated_weapon_class, WEAPON_CLASS_COLUMNS)
         
         return format_response({
             'status': 'success',
             'message': 'Weapon class updated successfully',
-            'weapon_class': weapon_class_dict
+            'weapon_class': weapon_class_record
         }, 200)
     except Exception as e:
         return format_response({
@@ -1004,17 +1496,13 @@ def update_weapon_class(current_user, weapon_id):
 def delete_weapon_class(current_user, weapon_id):
     # Delete a weapon class
     try:
-        # Check if weapon class exists
-        existing_weapon_class = weapon_class.get_by_id(mysql, weapon_id)
-        if existing_weapon_class is None:
+        # Delete weapon class; existence comes from the DELETE itself
+        if weapon_class.delete(mysql, weapon_id) == 0:
             return format_response({
                 'status': 'error',
                 'message': f'Weapon class with ID {weapon_id} not found'
             }, 404)
         
-        # Delete weapon class
-        weapon_class.delete(mysql, weapon_id)
-        
         return format_response({
             'status': 'success',
             'message': f'Weapon class with ID {weapon_id} deleted successfully'
@@ -1027,12 +1515,63 @@ def delete_weapon_class(current_user, weapon_id):
 
 # ShipWeapons Endpoints
 @app.route('/api/ship-weapons', methods=['GET'])
+@conditional('ship_weapons', 'ship', 'ship_class', 'weapon_class')
 def get_ship_weapons():
     # Get all ship weapon assignments
     try:
-        ship_weapons_data = ship_weapons.get_all(mysql)
-        ship_weapons_list = rows_to_dict_list(ship_weapons_data, SHIP_WEAPONS_COLUMNS)
-        return format_response({'ship_weapons': ship_weapons_list}, 200)
+        # Sparse fieldset (fields=id,name); key columns are always included
+        try:
+            fields = parse_fields(SHIP_WEAPONS_COLUMNS, required=('ship_id', 'ship_class_id', 'weapon_class_id'))
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
+        
+        # Multi-get (keys=1-2-3,1-2-4): every requested assignment in one query
+        try:
+            keys = parse_keys(key_size=3)
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
+        
+        if keys is not None:
+            columns = fields or SHIP_WEAPONS_COLUMNS
+            ship_weapons_data = ship_weapons.get_many(mysql, keys, fields)
+            key_func = key_getter(columns, ('ship_id', 'ship_class_id', 'weapon_class_id'))
+            found_keys = {key_func(row) for row in ship_weapons_data}
+            return format_response({
+                'ship_weapons': Rows(ship_weapons_data, columns),
+                'not_found': [dict(zip(('ship_id', 'ship_class_id', 'weapon_class_id'), key))
+                              for key in keys if key not in found_keys]
+            }, 200)
+        
+        # Streaming mode: the full result, read from a server-side cursor
+        if wants_stream():
+            rows = start_stream(ship_weapons.stream(mysql, fields))
+            return stream_response('ship_weapons', rows, fields or SHIP_WEAPONS_COLUMNS)
+        
+        # Keyset pagination (limit + opaque after cursor)
+        try:
+            limit, after = parse_page_args(key_size=3)
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
+        
+        # The cursor is the composite (ship_id, ship_class_id, weapon_class_id) key
+        ship_weapons_data = ship_weapons.get_all(mysql, limit + 1, after, fields)
+        columns = fields or SHIP_WEAPONS_COLUMNS
+        ship_weapons_data, next_cursor = paginate(ship_weapons_data, limit,
+                                                  key_getter(columns, ('ship_id', 'ship_class_id', 'weapon_class_id')))
+        ship_weapons_list = Rows(ship_weapons_data, columns)
+        return format_response({
+            'ship_weapons': ship_weapons_list,
+            'next': next_page_link(next_cursor)
+        }, 200)
     except Exception as e:
         return format_response({
             'status': 'error',
@@ -1040,11 +1579,21 @@ def get_ship_weapons():
         }, 500)
 
 @app.route('/api/ship-weapons/ship/<int:ship_id>', methods=['GET'])
+@conditional('ship_weapons', 'ship', 'ship_class', 'weapon_class')
 def get_ship_weapons_by_ship(ship_id):
     # Get all weapons for a specific ship
     try:
-        ship_weapons_data = ship_weapons.get_by_ship_id(mysql, ship_id)
-        ship_weapons_list = rows_to_dict_list(ship_weapons_data, SHIP_WEAPONS_COLUMNS)
+        # Sparse fieldset (fields=id,name); key columns are always included
+        try:
+            fields = parse_fields(SHIP_WEAPONS_COLUMNS, required=('ship_id', 'ship_class_id', 'weapon_class_id'))
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
+        
+        ship_weapons_data = ship_weapons.get_by_ship_id(mysql, ship_id, fields)
+        ship_weapons_list = Rows(ship_weapons_data, fields or SHIP_WEAPONS_COLUMNS)
         return format_response({'ship_weapons': ship_weapons_list}, 200)
     except Exception as e:
         return format_response({
@@ -1053,18 +1602,28 @@ def get_ship_weapons_by_ship(ship_id):
         }, 500)
 
 @app.route('/api/ship-weapons/<int:ship_id>/<int:ship_class_id>/<int:weapon_class_id>', methods=['GET'])
+@conditional('ship_weapons', 'ship', 'ship_class', 'weapon_class')
 def get_ship_weapon(ship_id, ship_class_id, weapon_class_id):
     # Get a specific ship weapon assignment
     try:
-        ship_weapon_data = ship_weapons.get_by_id(mysql, ship_id, ship_class_id, weapon_class_id)
+        # Sparse fieldset (fields=id,name); key columns are always included
+        try:
+            fields = parse_fields(SHIP_WEAPONS_COLUMNS, required=('ship_id', 'ship_class_id', 'weapon_class_id'))
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
+        
+        ship_weapon_data = ship_weapons.get_by_id(mysql, ship_id, ship_class_id, weapon_class_id, fields=fields)
         if ship_weapon_data is None:
             return format_response({
                 'status': 'error',
                 'message': f'Ship weapon assignment not found'
             }, 404)
         
-        ship_weapon_dict = row_to_dict(ship_weapon_data, SHIP_WEAPONS_COLUMNS)
-        return format_response({'ship_weapon': ship_weapon_dict}, 200)
+        ship_weapon_record = Row(ship_weapon_data, fields or SHIP_WEAPONS_COLUMNS)
+        return format_response({'ship_weapon': ship_weapon_record}, 200)
     except Exception as e:
         return format_response({
             'status': 'error',
@@ -1084,53 +1643,48 @@ def create_ship_weapon(current_user):
                 'message': 'No data provided'
             }, 400)
         
-        # Validate required fields
-        required_fields = ['ship_id', 'ship_class_id', 'weapon_class_id', 'name']
-        for field in required_fields:
-            if field not in data:
-                return format_response({
-                    'status': 'error',
-                    'message': f'Missing required field: {field}'
-                }, 400)
-        
-        # Validate data types
-        if not isinstance(data['ship_id'], int) or data['ship_id'] < 1:
+        # Validate input
+        is_valid, error_message = validate_ship_weapon_data(data)
+        if not is_valid:
             return format_response({
                 'status': 'error',
-                'message': 'Field ship_id must be a positive integer'
+                'message': error_message
             }, 400)
         
-        if not isinstance(data['ship_class_id'], int) or data['ship_class_id'] < 1:
+        # Referenced records must exist; the ship lookup (entity cache) also
+        # supplies ship_name for the response
+        ship_row = ship.get_by_id(mysql, data['ship_id'], ('id', 'name'))
+        if ship_row is None:
             return format_response({
                 'status': 'error',
-                'message': 'Field ship_class_id must be a positive integer'
+                'message': f"Ship with ID {data['ship_id']} not found"
             }, 400)
-        
-        if not isinstance(data['weapon_class_id'], int) or data['weapon_class_id'] < 1:
+        snapshot = reference.snapshot(mysql)
+        if data['ship_class_id'] not in snapshot.ship_class_by_id:
             return format_response({
                 'status': 'error',
-                'message': 'Field weapon_class_id must be a positive integer'
+                'message': f"Ship class with ID {data['ship_class_id']} not found"
             }, 400)
-        
-        if not isinstance(data['name'], str) or len(data['name'].strip()) == 0:
+        if data['weapon_class_id'] not in snapshot.weapon_class_by_id:
             return format_response({
                 'status': 'error',
-                'message': 'Field name must be a non-empty string'
+                'message': f"Weapon class with ID {data['weapon_class_id']} not found"
             }, 400)
         
         # Create ship weapon assignment
         ship_weapons.create(mysql, data)
         
-        # Retrieve and return the created assignment
-        created_ship_weapon = ship_weapons.get_by_id(mysql, data['ship_id'], 
-                                                     data['ship_class_id'], 
-                                                     data['weapon_class_id'])
-        ship_weapon_dict = row_to_dict(created_ship_weapon, SHIP_WEAPONS_COLUMNS)
+        # The response is built from the input and the looked-up names (no re-read)
+        created_ship_weapon = (data['ship_id'], ship_row[1],
+                               data['ship_class_id'], snapshot.ship_class_name(data['ship_class_id']),
+                               data['weapon_class_id'], snapshot.weapon_class_name(data['weapon_class_id']),
+                               data['name'])
+        ship_weapon_record = Row(created_ship_weapon, SHIP_WEAPONS_COLUMNS)
         
         return format_response({
             'status': 'success',
             'message': 'Ship weapon assignment created successfully',
-            'ship_weapon': ship_weapon_dict
+            'ship_weapon': ship_weapon_record
         }, 201)
     except Exception as e:
         return format_response({
@@ -1138,22 +1692,73 @@ def create_ship_weapon(current_user):
             'message': f'Failed to create ship weapon assignment: {str(e)}'
         }, 500)
 
+@app.route('/api/ship-weapons/bulk', methods=['POST'])
+@token_required
+def create_ship_weapons_bulk(current_user):
+    # Create many ship weapon assignments in one transaction
+    try:
+        items = request.get_json()
+        
+        # Validate every item before anything is written
+        is_valid, error_message, item_errors = validate_bulk_data(
+            items, validate_ship_weapon_data, app.config['API_MAX_BULK_ITEMS'])
+        if not is_valid:
+            return format_response({
+                'status': 'error',
+                'message': error_message,
+                'errors': item_errors
+            }, 400)
+        
+        # Referenced classes come from the reference snapshot, ships from one query
+        snapshot = reference.snapshot(mysql)
+        ship_ids = sorted({item['ship_id'] for item in items})
+        ship_names = {row[0]: row[1] for row in ship.get_many(mysql, ship_ids, ('id', 'name'))}
+        item_errors = []
+        for index, item in enumerate(items):
+            if item['ship_id'] not in ship_names:
+                item_errors.append({'index': index, 'message': f"Ship with ID {item['ship_id']} not found"})
+            elif item['ship_class_id'] not in snapshot.ship_class_by_id:
+                item_errors.append({'index': index, 'message': f"Ship class with ID {item['ship_class_id']} not found"})
+            elif item['weapon_class_id'] not in snapshot.weapon_class_by_id:
+                item_errors.append({'index': index, 'message': f"Weapon class with ID {item['weapon_class_id']} not found"})
+        if item_errors:
+            return format_response({
+                'status': 'error',
+                'message': f'{len(item_errors)} of {len(items)} items reference missing records',
+                'errors': item_errors
+            }, 400)
+        
+        ship_weapons.create_many(mysql, items)
+        
+        # The response is built from the input and the looked-up names (no re-read)
+        ship_weapons_data = [(item['ship_id'], ship_names[item['ship_id']],
+                              item['ship_class_id'], snapshot.ship_class_name(item['ship_class_id']),
+                              item['weapon_class_id'], snapshot.weapon_class_name(item['weapon_class_id']),
+                              item['name'])
+                             for item in items]
+        return format_response({
+            'status': 'success',
+            'message': f'{len(items)} ship weapon assignments created successfully',
+            'ship_weapons': Rows(ship_weapons_data, SHIP_WEAPONS_COLUMNS)
+        }, 201)
+    except Exception as e:
+        return format_response({
+            'status': 'error',
+            'message': f'Failed to create ship weapon assignments: {str(e)}'
+        }, 500)
+
 @app.route('/api/ship-weapons/<int:ship_id>/<int:ship_class_id>/<int:weapon_class_id>', methods=['DELETE'])
 @token_required
 def delete_ship_weapon(current_user, ship_id, ship_class_id, weapon_class_id):
     # Delete a ship weapon assignment
     try:
-        # Check if assignment exists
-        existing_ship_weapon = ship_weapons.get_by_id(mysql, ship_id, ship_class_id, weapon_class_id)
-        if existing_ship_weapon is None:
+        # Delete ship weapon assignment; existence comes from the DELETE itself
+        if ship_weapons.delete(mysql, ship_id, ship_class_id, weapon_class_id) == 0:
             return format_response({
                 'status': 'error',
                 'message': f'Ship weapon assignment not found'
             }, 404)
         
-        # Delete ship weapon assignment
-        ship_weapons.delete(mysql, ship_id, ship_class_id, weapon_class_id)
-        
         return format_response({
             'status': 'success',
             'message': f'Ship weapon assignment deleted successfully'
@@ -1164,6 +1769,97 @@ def delete_ship_weapon(current_user, ship_id, ship_class_id, weapon_class_id):
             'message': f'Failed to delete ship weapon assignment: {str(e)}'
         }, 500)
 
+# Statistics Endpoints
+@app.route('/api/stats/ships', methods=['GET'])
+@conditional('ship')
+def get_ship_stats():
+    # Count, sum, min, max, mean and stddev of ship metrics, overall or per
+    # group (group_by=ship_class_id|pilot_id); takes the same filters as the list endpoint
+    try:
+        try:
+            query = ship.FILTERS.parse(request.args)
+            group = ship.STATS.parse_group(request.args)
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
+        
+        return format_response({
+            'group_by': group,
+            'groups': ship.stats(mysql, query, group)
+        }, 200)
+    except Exception as e:
+        return format_response({
+            'status': 'error',
+            'message': f'Failed to compute ship statistics: {str(e)}'
+        }, 500)
+
+@app.route('/api/stats/weapon-classes', methods=['GET'])
+@conditional('weapon_class')
+def get_weapon_class_stats():
+    # Count, sum, min, max, mean and stddev of weapon class metrics, overall or per
+    # group (group_by=class); takes the same filters as the list endpoint
+    try:
+        try:
+            query = weapon_class.FILTERS.parse(request.args)
+            group = weapon_class.STATS.parse_group(request.args)
+        except ValueError as e:
+            return format_response({
+                'status': 'error',
+                'message': str(e)
+            }, 400)
+        
+        return format_response({
+            'group_by': group,
+            'groups': weapon_class.stats(mysql, query, group)
+        }, 200)
+    except Exception as e:
+        return format_response({
+            'status': 'error',
+            'message': f'Failed to compute weapon class statistics: {str(e)}'
+        }, 500)
+
+@app.route('/api/autocomplete', methods=['GET'])
+@conditional('pilot', 'ship')
+def get_autocomplete():
+    # Suggest pilot or ship names for typed text (entity=ships&q=star&limit=10),
+    # served from an in-memory index kept current by the write endpoints
+    try:
+        entity = request.args.get('entity', '')
+        if entity not in autocomplete.ENTITIES:
+            return format_response({
+                'status': 'error',
+                'message': f"entity must be one of: {', '.join(autocomplete.ENTITIES)}"
+            }, 400)
+        
+        text = request.args.get('q', '')
+        if not text.strip():
+            return format_response({
+                'status': 'error',
+                'message': 'q is required'
+            }, 400)
+        
+        try:
+            limit = int(request.args.get('limit', AUTOCOMPLETE_DEFAULT_LIMIT))
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= AUTOCOMPLETE_MAX_LIMIT:
+            return format_response({
+                'status': 'error',
+                'message': f'limit must be an integer between 1 and {AUTOCOMPLETE_MAX_LIMIT}'
+            }, 400)
+        
+        suggestions = autocomplete.suggest(mysql, entity, text, limit)
+        return format_response({
+            'suggestions': Rows(suggestions, ['id', 'name'])
+        }, 200)
+    except Exception as e:
+        return format_response({
+            'status': 'error',
+            'message': f'Failed to retrieve suggestions: {str(e)}'
+        }, 500)
+
 # Error Handlers
 @app.errorhandler(404)
 def not_found(error):
@@ -0,0 +1,33 @@
+-- Secondary indexes for the search filters and sort orders declared in the
+-- models' FILTERS specs, and for the login/registration lookups. Fields
+-- backed by one of these are marked indexed=True in their spec, and
+-- `python run_migration.py --check` EXPLAINs each of them.
+--
+-- InnoDB secondary indexes end with the primary key, so an equality filter
+-- on (`rank`) or (ship_class_id, speed) also returns rows in id order and a
+-- keyset page needs no sort.
+
+-- pilot: rank= (alone or with min_mission_success=), min_mission_success=,
+-- min_flight_years=, sort=name
+ALTER TABLE `pilot`
+  ADD KEY `idx_pilot_rank_mission_success` (`rank`, `mission_success`),
+  ADD KEY `idx_pilot_mission_success` (`mission_success`),
+  ADD KEY `idx_pilot_flight_years` (`flight_years`),
+  ADD KEY `idx_pilot_name` (`name`);
+
+-- ship: ship_class_id= (alone or with a speed range) replaces the foreign key
+-- index, which is its leftmost prefix; min_/max_ speed, capacity and shield;
+-- sort=name
+ALTER TABLE `ship`
+  ADD KEY `idx_ship_class_speed` (`ship_class_id`, `speed`),
+  ADD KEY `idx_ship_speed` (`speed`),
+  ADD KEY `idx_ship_capacity` (`capacity`),
+  ADD KEY `idx_ship_shield` (`shield`),
+  ADD KEY `idx_ship_name` (`name`);
+
+ALTER TABLE `ship` DROP KEY `fk_ship_ship_class1_idx`;
+
+-- users: login by username, registration checks on username and email
+ALTER TABLE `users`
+  ADD UNIQUE KEY `uq_users_username` (`username`),
+  ADD UNIQUE KEY `uq_users_email` (`email`);
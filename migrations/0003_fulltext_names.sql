@@ -0,0 +1,11 @@
+-- FULLTEXT indexes behind name= on pilots and ships, which is a token and
+-- prefix search (MATCH ... AGAINST in boolean mode) rather than a
+-- LIKE '%term%' scan. Ship and weapon class names are searched in memory.
+--
+-- Words shorter than innodb_ft_min_token_size (default 3) and InnoDB
+-- stopwords are not indexed; set innodb_ft_min_token_size = 1 and
+-- innodb_ft_enable_stopword = OFF before running this to search them too.
+-- The first FULLTEXT index on a table rebuilds it to add FTS_DOC_ID.
+ALTER TABLE `pilot` ADD FULLTEXT KEY `ft_pilot_name` (`name`);
+
+ALTER TABLE `ship` ADD FULLTEXT KEY `ft_ship_name` (`name`);
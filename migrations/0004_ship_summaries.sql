@@ -0,0 +1,39 @@
+-- Ship totals per pilot and per ship class (number of ships, total capacity,
+-- total shield), served by /api/pilots/<id>/summary and
+-- /api/ship-classes/<id>/summary. The ship write functions apply deltas to
+-- these rows in the same transaction as the write; `python
+-- repair_summaries.py` rebuilds them from ship.
+--
+-- A pilot or class without ships may have no row, which reads as zeros. The
+-- rows go away with their pilot or class.
+--
+-- The deltas are upserts using INSERT ... AS delta ON DUPLICATE KEY UPDATE,
+-- which needs MySQL 8.0.19 or later.
+CREATE TABLE IF NOT EXISTS `pilot_ship_summary` (
+  `pilot_id` int NOT NULL,
+  `ship_count` int NOT NULL DEFAULT 0,
+  `total_capacity` bigint NOT NULL DEFAULT 0,
+  `total_shield` bigint NOT NULL DEFAULT 0,
+  PRIMARY KEY (`pilot_id`),
+  CONSTRAINT `fk_pilot_ship_summary_pilot` FOREIGN KEY (`pilot_id`) REFERENCES `pilot` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb3;
+
+CREATE TABLE IF NOT EXISTS `ship_class_ship_summary` (
+  `ship_class_id` int NOT NULL,
+  `ship_count` int NOT NULL DEFAULT 0,
+  `total_capacity` bigint NOT NULL DEFAULT 0,
+  `total_shield` bigint NOT NULL DEFAULT 0,
+  PRIMARY KEY (`ship_class_id`),
+  CONSTRAINT `fk_ship_class_ship_summary_class` FOREIGN KEY (`ship_class_id`) REFERENCES `ship_class` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb3;
+
+-- Initial totals (the same statements repair_summaries.py runs)
+DELETE FROM `pilot_ship_summary`;
+
+INSERT INTO `pilot_ship_summary` (pilot_id, ship_count, total_capacity, total_shield)
+SELECT pilot_id, COUNT(*), SUM(capacity), SUM(shield) FROM ship GROUP BY pilot_id;
+
+DELETE FROM `ship_class_ship_summary`;
+
+INSERT INTO `ship_class_ship_summary` (ship_class_id, ship_count, total_capacity, total_shield)
+SELECT ship_class_id, COUNT(*), SUM(capacity), SUM(shield) FROM ship GROUP BY ship_class_id;
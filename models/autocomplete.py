@@ -0,0 +1,132 @@
+"""
+Name suggestions for pilots and ships, served from in-memory NameIndexes.
+
+Each index is loaded from the database on first use and then kept current
+by the pilot and ship write functions, which report every created, renamed
+and deleted name here. Writes made by other processes are picked up by
+reloading an index once it is older than REFRESH_INTERVAL.
+
+Writes reported while an index is loading are queued and replayed onto it
+once the load finishes, since the load's SELECT may have read the rows
+before or after the write.
+"""
+import logging
+import os
+import threading
+import time
+
+from utils.autocomplete import NameIndex
+
+logger = logging.getLogger(__name__)
+
+# Seconds an index is served before it is reloaded from the database
+REFRESH_INTERVAL = float(os.getenv('AUTOCOMPLETE_REFRESH_INTERVAL', 300))
+
+# Rows fetched per round trip while loading
+LOAD_BATCH_SIZE = 5000
+
+# Entity -> query for its (id, name) pairs
+ENTITIES = {
+    'pilots': 'SELECT id, name FROM pilot',
+    'ships': 'SELECT id, name FROM ship',
+}
+
+
+class _State:
+    def __init__(self):
+        self.index = None
+        self.loaded_at = 0.0
+        self.loading = False
+        # (id, name or None) writes reported during a load
+        self.pending = []
+        self.lock = threading.Lock()
+
+
+_states = {entity: _State() for entity in ENTITIES}
+
+
+def _load(mysql, entity):
+    state = _states[entity]
+    with state.lock:
+        if state.loading:
+            return
+        state.loading = True
+        state.pending = []
+    try:
+        rows = []
+        with mysql.server_side_cursor() as cursor:
+            cursor.execute(ENTITIES[entity])
+            while True:
+                batch = cursor.fetchmany(LOAD_BATCH_SIZE)
+                if not batch:
+                    break
+                rows.extend(batch)
+        index = NameIndex(rows)
+    except Exception:
+        with state.lock:
+            state.loading = False
+        raise
+    with state.lock:
+        for row_id, name in state.pending:
+            index.add(row_id, name) if name is not None else index.remove(row_id)
+        state.index = index
+        state.loaded_at = time.monotonic()
+        state.loading = False
+        state.pending = []
+    logger.info('Loaded %s names for %s autocomplete', len(index), entity)
+
+
+def suggest(mysql, entity, text, limit=10):
+    """
+    Return up to limit (id, name) suggestions for typed text.
+
+    Loads the index on first use. Once an index is older than
+    REFRESH_INTERVAL it is reloaded. If that reload fails, the old index
+    is still served.
+    """
+    state = _states[entity]
+    if state.index is None:
+        _load(mysql, entity)
+    elif time.monotonic() - state.loaded_at > REFRESH_INTERVAL:
+        try:
+            _load(mysql, entity)
+        except Exception as e:
+            logger.warning('%s autocomplete reload failed: %s', entity, e)
+    with state.lock:
+        if state.index is None:
+            # Another request's first load is still running
+            return []
+        return state.index.suggest(text, limit)
+
+
+def record(entity, row_id, name):
+    """Report a committed create or rename (name=None for a delete)."""
+    state = _states[entity]
+    with state.lock:
+        if state.loading:
+            state.pending.append((row_id, name))
+        if state.index is not None:
+            if name is None:
+                state.index.remove(row_id)
+            else:
+                state.index.add(row_id, name)
+
+
+def invalidate(entity):
+    """Mark an index stale after changes not known row by row; the next use reloads it."""
+    state = _states[entity]
+    with state.lock:
+        state.loaded_at = 0.0
+
+
+def stats():
+    """Return index sizes and ages for diagnostics endpoints."""
+    now = time.monotonic()
+    return {
+        entity: {
+            'names': len(state.index) if state.index is not None else 0,
+            'age': now - state.loaded_at if state.index is not None else None,
+            'refresh_interval': REFRESH_INTERVAL,
+        }
+        for entity, state in _states.items()
+    }
@@ -1,18 +1,64 @@
-def get_all(mysql):
-    # Get all pilots from the database
+from models import autocomplete
+from utils.cache import entity_cache
+from utils.bulk import insert_many, set_clause, update_grouped
+from utils.fields import Projection, select_fields
+from utils.filters import Field, FilterSpec
+from utils.textsearch import fulltext
+from utils.versions import table_versions
+
+# Rows fetched per round trip when streaming from a server-side cursor
+STREAM_BATCH_SIZE = 500
+
+# API column -> SELECT expression (also the column order of a full row)
+SELECT_EXPRESSIONS = {
+    'id': 'id',
+    'name': 'name',
+    'flight_years': 'flight_years',
+    'rank': '`rank`',
+    'mission_success': 'mission_success',
+}
+COLUMNS = tuple(SELECT_EXPRESSIONS)
+
+# Updatable field -> column, for single and bulk updates
+UPDATE_COLUMNS = {
+    'name': 'name',
+    'flight_years': 'flight_years',
+    'rank': '`rank`',
+    'mission_success': 'mission_success',
+}
+
+# Filterable and sortable fields: name=, rank=, min_flight_years=,
+# min_mission_success= and sort= on any of the columns
+FILTERS = FilterSpec({
+    'id': Field(ops=(), sortable=True, indexed=True),
+    'name': Field(type=str, ops=('match',), sortable=True, indexed=True),
+    'rank': Field(column='`rank`', type=str, sortable=True, indexed=True),
+    'flight_years': Field(ops=('min',), sortable=True, indexed=True),
+    'mission_success': Field(ops=('min',), sortable=True, indexed=True),
+}, table='pilot')
+
+
+def get_all(mysql, limit=None, after=None, fields=None):
+    # Get all pilots from the database (one keyset page when limit is given,
+    # only the given columns when fields is given)
+    projection = Projection(fields or COLUMNS, SELECT_EXPRESSIONS)
     cursor = mysql.connection.cursor()
-    cursor.execute('''
-        SELECT id, name, flight_years, `rank`, mission_success 
-        FROM pilot
-        ORDER BY id
-    ''')
+    query = f'SELECT {projection.select} FROM pilot'
+    values = []
+    if after is not None:
+        query += ' WHERE id > %s'
+        values.append(after)
+    query += ' ORDER BY id'
+    if limit is not None:
+        query += ' LIMIT %s'
+        values.append(limit)
+    cursor.execute(query, values)
     pilots = cursor.fetchall()
     cursor.close()
-    return pilots
+    return projection.build(pilots)
 
 
-def get_by_id(mysql, pilot_id):
-    # Get a specific pilot by ID
+def _fetch_by_id(mysql, pilot_id):
     cursor = mysql.connection.cursor()
     cursor.execute('''
         SELECT id, name, flight_years, `rank`, mission_success 
@@ -24,6 +70,36 @@ def get_by_id(mysql, pilot_id):
     return pilot
 
 
+def get_by_id(mysql, pilot_id, fields=None):
+    # Get a specific pilot by ID (read through the entity cache)
+    pilot = entity_cache.get_or_load(('pilot', pilot_id),
+                                     lambda: _fetch_by_id(mysql, pilot_id))
+    return select_fields(pilot, COLUMNS, fields)
+
+
+def _fetch_many(mysql, pilot_ids):
+    # One IN (...) query for several pilots, as {id: row}
+    cursor = mysql.connection.cursor()
+    placeholders = ', '.join(['%s'] * len(pilot_ids))
+    cursor.execute(f'''
+        SELECT id, name, flight_years, `rank`, mission_success 
+        FROM pilot 
+        WHERE id IN ({placeholders})
+    ''', pilot_ids)
+    pilots = cursor.fetchall()
+    cursor.close()
+    return {pilot[0]: pilot for pilot in pilots}
+
+
+def get_many(mysql, pilot_ids, fields=None):
+    # Get several pilots by ID in the order given, skipping ids that don't exist
+    # (read through the entity cache; all misses are loaded with one query)
+    found = entity_cache.get_many_or_load('pilot', pilot_ids,
+                                          lambda ids: _fetch_many(mysql, ids))
+    return [select_fields(found[pilot_id], COLUMNS, fields)
+            for pilot_id in pilot_ids if pilot_id in found]
+
+
 def create(mysql, data):
     # Create a new pilot
     cursor = mysql.connection.cursor()
@@ -34,91 +110,162 @@ def create(mysql, data):
     mysql.connection.commit()
     pilot_id = cursor.lastrowid
     cursor.close()
+    autocomplete.record('pilots', pilot_id, data['name'])
+    table_versions.bump('pilot')
     return pilot_id
 
 
+def create_many(mysql, items):
+    # Create many pilots with batched multi-row INSERTs in one transaction
+    # (items are validated); returns the new ids in item order
+    cursor = mysql.connection.cursor()
+    try:
+        pilot_ids = insert_many(
+            cursor, 'pilot', ['name', 'flight_years', '`rank`', 'mission_success'],
+            [(item['name'], item['flight_years'], item['rank'], item['mission_success']) for item in items])
+        mysql.connection.commit()
+    except Exception:
+        mysql.connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    for pilot_id, item in zip(pilot_ids, items):
+        autocomplete.record('pilots', pilot_id, item['name'])
+    table_versions.bump('pilot')
+    return pilot_ids
+
+
 def update(mysql, pilot_id, data):
-    # Update an existing pilot
-    update_fields = []
-    values = []
-    
-    if 'name' in data:
-        update_fields.append('name = %s')
-        values.append(data['name'])
+    # Update an existing pilot in one transaction; returns the updated row,
+    # or None if the pilot does not exist (existence comes from the UPDATE)
+    set_sql, values = set_clause(UPDATE_COLUMNS, data)
     
-    if 'flight_years' in data:
-        update_fields.append('flight_years = %s')
-        values.append(data['flight_years'])
-    
-    if 'rank' in data:
-        update_fields.append('`rank` = %s')
-        values.append(data['rank'])
+    cursor = mysql.connection.cursor()
+    try:
+        cursor.execute(f'UPDATE pilot SET {set_sql} WHERE id = %s', values + [pilot_id])
+        if cursor.rowcount == 0:
+            updated_pilot = None
+        elif all(field in data for field in UPDATE_COLUMNS):
+            # Every column was just written, so there is nothing to read back
+            updated_pilot = (pilot_id,) + tuple(data[field] for field in UPDATE_COLUMNS)
+        else:
+            # Read back inside the transaction, which still holds the row lock
+            updated_pilot = _fetch_by_id(mysql, pilot_id)
+        mysql.connection.commit()
+    except Exception:
+        mysql.connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    if updated_pilot is None:
+        return None
     
-    if 'mission_success' in data:
-        update_fields.append('mission_success = %s')
-        values.append(data['mission_success'])
+    # Cached ships embed pilot_name, so a rename invalidates them too
+    entity_cache.invalidate(('pilot', pilot_id))
+    if 'name' in data:
+        entity_cache.invalidate_tag(('pilot', pilot_id))
+        autocomplete.record('pilots', pilot_id, data['name'])
+    table_versions.bump('pilot')
+    return updated_pilot
+
+
+def update_many(mysql, updates):
+    # Apply (id, changes) pairs in one transaction, one UPDATE per distinct
+    # change set; returns the number of pilots matched
+    cursor = mysql.connection.cursor()
+    try:
+        matched = update_grouped(cursor, 'pilot', UPDATE_COLUMNS, updates)
+        mysql.connection.commit()
+    except Exception:
+        mysql.connection.rollback()
+        raise
+    finally:
+        cursor.close()
     
-    values.append(pilot_id)
+    entity_cache.invalidate(*[('pilot', pilot_id) for pilot_id, _ in updates])
+    renamed = [('pilot', pilot_id) for pilot_id, changes in updates if 'name' in changes]
+    if renamed:
+        entity_cache.invalidate_tag(*renamed)
+        if matched < len(updates):
+            # Some ids did not exist, so which renames happened is unknown
+            autocomplete.invalidate('pilots')
+        else:
+            for pilot_id, changes in updates:
+                if 'name' in changes:
+                    autocomplete.record('pilots', pilot_id, changes['name'])
+    table_versions.bump('pilot')
+    return matched
+
+
+def update_where(mysql, query, changes):
+    # Apply one change set to every pilot matching a filter Query with a
+    # single UPDATE; returns the number of pilots matched
+    fulltext.ensure_loaded(mysql)
+    where_clauses, where_values = FILTERS.where(query)
+    set_sql, set_values = set_clause(UPDATE_COLUMNS, changes)
     
     cursor = mysql.connection.cursor()
-    query = f"UPDATE pilot SET {', '.join(update_fields)} WHERE id = %s"
-    cursor.execute(query, values)
-    mysql.connection.commit()
-    rows_affected = cursor.rowcount
-    cursor.close()
-    return rows_affected
+    try:
+        cursor.execute(f"UPDATE pilot SET {set_sql} WHERE {' AND '.join(where_clauses)}",
+                       set_values + where_values)
+        matched = cursor.rowcount
+        mysql.connection.commit()
+    except Exception:
+        mysql.connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    
+    # Which pilots matched is unknown, so every cached pilot (and on a
+    # rename every cached ship) is dropped
+    entity_cache.invalidate_table('pilot')
+    if 'name' in changes:
+        entity_cache.invalidate_table('ship')
+        autocomplete.invalidate('pilots')
+    table_versions.bump('pilot')
+    return matched
 
 
 def delete(mysql, pilot_id):
-    # Delete a pilot
+    # Delete a pilot; returns the number of rows deleted (0 if it did not exist)
     cursor = mysql.connection.cursor()
     cursor.execute('DELETE FROM pilot WHERE id = %s', (pilot_id,))
     mysql.connection.commit()
     rows_affected = cursor.rowcount
     cursor.close()
+    if rows_affected == 0:
+        return 0
+    
+    entity_cache.invalidate(('pilot', pilot_id))
+    entity_cache.invalidate_tag(('pilot', pilot_id))
+    autocomplete.record('pilots', pilot_id, None)
+    table_versions.bump('pilot')
     return rows_affected
 
 
-def search(mysql, criteria):
-    # Search pilots based on criteria
-    cursor = mysql.connection.cursor()
-    
-    # Build dynamic WHERE clause
-    where_clauses = []
-    values = []
-    
-    # Name search (LIKE - partial match)
-    if 'name' in criteria and criteria['name']:
-        where_clauses.append('name LIKE %s')
-        values.append(f"%{criteria['name']}%")
-    
-    # Rank search (exact match)
-    if 'rank' in criteria and criteria['rank']:
-        where_clauses.append('`rank` = %s')
-        values.append(criteria['rank'])
-    
-    # Minimum flight years
-    if 'min_flight_years' in criteria and criteria['min_flight_years'] is not None:
-        where_clauses.append('flight_years >= %s')
-        values.append(criteria['min_flight_years'])
-    
-    # Minimum mission success
-    if 'min_mission_success' in criteria and criteria['min_mission_success'] is not None:
-        where_clauses.append('mission_success >= %s')
-        values.append(criteria['min_mission_success'])
-    
-    # Build query
-    query = 'SELECT id, name, flight_years, `rank`, mission_success FROM pilot'
-    if where_clauses:
-        query += ' WHERE ' + ' AND '.join(where_clauses)
-    query += ' ORDER BY id'
-    
-    # Execute with or without values
-    if values:
-        cursor.execute(query, values)
-    else:
-        cursor.execute(query)
+def search(mysql, query, limit=None, after=None, fields=None):
+    # Search pilots with a filter Query (one keyset page when limit is given,
+    # only the given columns when fields is given)
+    projection = Projection(fields or COLUMNS, SELECT_EXPRESSIONS)
+    fulltext.ensure_loaded(mysql)
+    sql, values = FILTERS.sql(projection.select, 'pilot', query, limit, after)
     
+    cursor = mysql.connection.cursor()
+    cursor.execute(sql, values)
     pilots = cursor.fetchall()
     cursor.close()
-    return pilots
+    return projection.build(pilots)
+
+
+def stream(mysql, query=None, fields=None):
+    # Yield pilots matching a filter Query row by row from an unbuffered server-side cursor
+    projection = Projection(fields or COLUMNS, SELECT_EXPRESSIONS)
+    fulltext.ensure_loaded(mysql)
+    sql, values = FILTERS.sql(projection.select, 'pilot', query or FILTERS.unfiltered())
+    with mysql.server_side_cursor() as cursor:
+        cursor.execute(sql, values)
+        while True:
+            rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            yield from projection.build(rows)
\ No newline at end of file
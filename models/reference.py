@@ -0,0 +1,228 @@
+"""
+In-memory snapshot of the ship_class and weapon_class reference tables.
+
+Both tables are small and rarely written, so instead of joining them into
+every ship and ship weapon query each is held in memory in full. A snapshot
+is never modified: writes load a new one and swap it in with a single
+assignment, so a reader always sees one consistent version of both tables.
+Snapshots older than REFRESH_INTERVAL are reloaded on the next read to pick
+up writes made by other processes. Reloads read on a pooled connection of
+their own, and a reload that overlapped a write in this process is read
+again rather than swapped in over it.
+"""
+import logging
+import os
+import threading
+import time
+
+from utils.textsearch import InvertedIndex
+from utils.versions import table_versions
+
+logger = logging.getLogger(__name__)
+
+# Seconds a snapshot is served before it is reloaded from the database
+REFRESH_INTERVAL = float(os.getenv('REFERENCE_REFRESH_INTERVAL', 30))
+
+SHIP_CLASS_QUERY = 'SELECT id, name, description FROM ship_class ORDER BY id'
+WEAPON_CLASS_QUERY = ('SELECT id, class, damage, reload_speed, spread, `range` '
+                      'FROM weapon_class ORDER BY id')
+
+
+class Snapshot:
+    """One read-only copy of both reference tables, rows ordered by id."""
+
+    def __init__(self, version, ship_classes, weapon_classes, loaded_at=None):
+        self.version = version
+        self.loaded_at = time.monotonic() if loaded_at is None else loaded_at
+        self.ship_classes = tuple(ship_classes)
+        self.weapon_classes = tuple(weapon_classes)
+        self.ship_class_by_id = {row[0]: row for row in self.ship_classes}
+        self.weapon_class_by_id = {row[0]: row for row in self.weapon_classes}
+        self._text_indexes = {}
+
+    def ship_class_name(self, class_id):
+        row = self.ship_class_by_id.get(class_id)
+        return row[1] if row else None
+
+    def weapon_class_name(self, weapon_id):
+        row = self.weapon_class_by_id.get(weapon_id)
+        return row[1] if row else None
+
+    def text_index(self, table, column):
+        # InvertedIndex over one text column of a table, built on first use.
+        # Every write swaps in a new snapshot, so the index never goes stale.
+        index = self._text_indexes.get((table, column))
+        if index is None:
+            rows = self.ship_classes if table == 'ship_class' else self.weapon_classes
+            index = InvertedIndex((row[0], row[column]) for row in rows)
+            self._text_indexes[(table, column)] = index
+        return index
+
+
+_snapshot = None
+_version = 0
+_stale = False
+# Incremented by every write this process applies or reports, so a load can
+# tell whether its read may predate one
+_generation = 0
+# Guards the globals above; held only to swap or patch, never during a read
+_lock = threading.Lock()
+# Serializes loads, so concurrent readers of a stale snapshot share one
+_load_lock = threading.Lock()
+_stats = {
+    'loads': 0,
+    'load_failures': 0,
+    'discarded_loads': 0,
+}
+
+# Reads discarded for a concurrent write before a load gives up
+LOAD_ATTEMPTS = 3
+
+
+def _read(mysql):
+    # Both tables in one fresh transaction on a connection of their own: the
+    # request's connection may be inside a REPEATABLE READ transaction whose
+    # view predates a write this process has already applied
+    with mysql.server_side_cursor() as cursor:
+        cursor.execute(SHIP_CLASS_QUERY)
+        ship_classes = cursor.fetchall()
+        cursor.execute(WEAPON_CLASS_QUERY)
+        weapon_classes = cursor.fetchall()
+    return ship_classes, weapon_classes
+
+
+def _load_locked(mysql):
+    # Read both tables and swap them in (caller holds _load_lock). A read that
+    # overlapped a write may not include it, so it is discarded and retried
+    # rather than swapped in over the write.
+    global _snapshot, _version, _stale
+    for _ in range(LOAD_ATTEMPTS):
+        with _lock:
+            generation = _generation
+        ship_classes, weapon_classes = _read(mysql)
+        with _lock:
+            if _generation != generation:
+                _stats['discarded_loads'] += 1
+                continue
+            previous = _snapshot
+            _version += 1
+            loaded = _snapshot = Snapshot(_version, ship_classes, weapon_classes)
+            _stale = False
+            _stats['loads'] += 1
+        # A periodic reload may pick up writes made by other processes, which
+        # never bumped this process's counters
+        if previous is not None and previous.ship_classes != loaded.ship_classes:
+            table_versions.bump('ship_class')
+        if previous is not None and previous.weapon_classes != loaded.weapon_classes:
+            table_versions.bump('weapon_class')
+        return loaded
+    raise RuntimeError(f'Reference tables changed during each of {LOAD_ATTEMPTS} reads')
+
+
+def load(mysql):
+    """Read both tables and swap in a new snapshot."""
+    with _load_lock:
+        return _load_locked(mysql)
+
+
+def refresh_after_write(mysql):
+    """
+    Swap in a snapshot that includes a just-committed write.
+
+    The write has already succeeded, so a failed reload is logged rather than
+    raised; the snapshot is marked stale and the next read retries the load.
+    """
+    global _stale, _generation
+    with _lock:
+        _stale = True
+        _generation += 1
+    with _load_lock:
+        try:
+            _load_locked(mysql)
+        except Exception as e:
+            _stats['load_failures'] += 1
+            logger.warning('Reference snapshot reload failed: %s', e)
+
+
+def apply_write(table, row_id, row=None):
+    """
+    Swap in a snapshot with one just-committed write applied in memory.
+
+    Used instead of refresh_after_write when the writer knows the row as
+    stored, which saves reloading both tables. The patched snapshot keeps its
+    load time, so the periodic reload still picks up other processes' writes.
+
+    Args:
+        table: 'ship_class' or 'weapon_class'
+        row_id: Id of the written row
+        row: The full row as now stored, or None if it was deleted
+    """
+    global _snapshot, _version, _generation
+    with _lock:
+        _generation += 1
+        current = _snapshot
+        if current is None or _stale:
+            # Nothing consistent to patch; the next read reloads
+            return
+        ship_classes = current.ship_classes
+        weapon_classes = current.weapon_classes
+        by_id = current.ship_class_by_id if table == 'ship_class' else current.weapon_class_by_id
+        if row is None and row_id not in by_id:
+            return
+        rows = [r for r in (ship_classes if table == 'ship_class' else weapon_classes) if r[0] != row_id]
+        if row is not None:
+            rows.append(tuple(row))
+            rows.sort(key=lambda r: r[0])
+        if table == 'ship_class':
+            ship_classes = rows
+        else:
+            weapon_classes = rows
+        _version += 1
+        _snapshot = Snapshot(_version, ship_classes, weapon_classes, current.loaded_at)
+
+
+def snapshot(mysql):
+    """Return the current snapshot, loading it first if missing or stale."""
+    current = _snapshot
+    if current is not None and not _stale and time.monotonic() - current.loaded_at <= REFRESH_INTERVAL:
+        return current
+    with _load_lock:
+        # Another thread may have reloaded while this one waited
+        if _snapshot is not current and not _stale:
+            return _snapshot
+        try:
+            return _load_locked(mysql)
+        except Exception as e:
+            _stats['load_failures'] += 1
+            if current is None:
+                raise
+            # A stale snapshot beats failing every read while the database is down
+            logger.warning('Reference snapshot refresh failed, serving version %s: %s',
+                           current.version, e)
+            return current
+
+
+def page(rows, limit=None, after=None):
+    # Keyset page over id-ordered snapshot rows
+    result = []
+    for row in rows:
+        if after is not None and row[0] <= after:
+            continue
+        result.append(row)
+        if limit is not None and len(result) >= limit:
+            break
+    return result
+
+
+def stats():
+    """Return snapshot counters for diagnostics endpoints."""
+    current = _snapshot
+    result = dict(_stats)
+    result.update({
+        'version': current.version if current else None,
+        'ship_classes': len(current.ship_classes) if current else 0,
+        'weapon_classes': len(current.weapon_classes) if current else 0,
+        'age': time.monotonic() - current.loaded_at if current else None,
+        'refresh_interval': REFRESH_INTERVAL,
+    })
+    return result
@@ -1,29 +1,138 @@
-def get_all(mysql):
-    # Get all ships with JOINs to pilot and ship_class
+from models import autocomplete, pilot, reference, ship_class, ship_weapons, summary, weapon_class
+from utils.cache import entity_cache
+from utils.bulk import insert_many, set_clause, update_grouped
+from utils.expand import Relation
+from utils.fields import Projection, select_fields
+from utils.filters import Field, FilterSpec
+from utils.stats import StatsSpec
+from utils.textsearch import fulltext
+from utils.versions import table_versions
+
+# Rows fetched per round trip when streaming from a server-side cursor
+STREAM_BATCH_SIZE = 500
+
+# Column order of a full ship row
+COLUMNS = ('id', 'name', 'capacity', 'speed', 'shield',
+           'ship_class_id', 'ship_class_name', 'pilot_id', 'pilot_name')
+
+# API column -> SELECT expression. pilot_name needs the pilot join;
+# ship_class_name is filled in from the reference snapshot instead.
+SELECT_EXPRESSIONS = {
+    'id': 's.id',
+    'name': 's.name',
+    'capacity': 's.capacity',
+    'speed': 's.speed',
+    'shield': 's.shield',
+    'ship_class_id': 's.ship_class_id',
+    'pilot_id': 's.pilot_id',
+    'pilot_name': 'p.name as pilot_name',
+}
+
+# Updatable field -> column, for single and bulk updates
+UPDATE_COLUMNS = {
+    'name': 'name',
+    'capacity': 'capacity',
+    'speed': 'speed',
+    'shield': 'shield',
+    'ship_class_id': 'ship_class_id',
+    'pilot_id': 'pilot_id',
+}
+
+# Filterable and sortable fields: name=, ship_class_id=, pilot_id=,
+# min_/max_ capacity, speed and shield, and sort= on any stored column
+FILTERS = FilterSpec({
+    'id': Field(column='s.id', ops=(), sortable=True, indexed=True),
+    'name': Field(column='s.name', type=str, ops=('match',), sortable=True, indexed=True),
+    'ship_class_id': Field(column='s.ship_class_id', sortable=True, indexed=True),
+    'pilot_id': Field(column='s.pilot_id', sortable=True, indexed=True),
+    'capacity': Field(column='s.capacity', ops=('min', 'max'), sortable=True, indexed=True),
+    'speed': Field(column='s.speed', ops=('min', 'max'), sortable=True, indexed=True),
+    'shield': Field(column='s.shield', ops=('min', 'max'), sortable=True, indexed=True),
+}, table='ship')
+
+
+# Metrics summarized by /api/stats/ships, per class or per pilot
+STATS = StatsSpec(FILTERS, metrics=('capacity', 'speed', 'shield'), group_by=('ship_class_id', 'pilot_id'))
+
+
+# Columns of a weapon embedded by expand=weapons (ship_id groups them by ship)
+WEAPON_FIELDS = ('ship_id', 'ship_class_id', 'weapon_class_id', 'weapon_class_name', 'name')
+
+
+def _load_pilots(mysql, pilot_ids):
+    # Pilots by id, read through the entity cache (misses in one IN query)
+    return {row[0]: dict(zip(pilot.COLUMNS, row)) for row in pilot.get_many(mysql, pilot_ids)}
+
+
+def _load_ship_classes(mysql, class_ids):
+    # Ship classes by id, from the reference snapshot
+    return {row[0]: dict(zip(ship_class.COLUMNS, row)) for row in ship_class.get_many(mysql, class_ids)}
+
+
+def _load_weapon_classes(mysql, weapon_ids):
+    # Weapon classes by id, from the reference snapshot
+    return {row[0]: dict(zip(weapon_class.COLUMNS, row)) for row in weapon_class.get_many(mysql, weapon_ids)}
+
+
+def _load_weapons(mysql, ship_ids):
+    # Weapon lists by ship id, in one IN query
+    weapons = {}
+    for row in ship_weapons.get_by_ship_ids(mysql, ship_ids, WEAPON_FIELDS):
+        weapons.setdefault(row[0], []).append(dict(zip(WEAPON_FIELDS, row)))
+    return weapons
+
+
+# Relations embeddable with expand= (pilot, ship_class, weapons, weapons.weapon_class)
+RELATIONS = {
+    'pilot': Relation('pilot_id', _load_pilots),
+    'ship_class': Relation('ship_class_id', _load_ship_classes),
+    'weapons': Relation('id', _load_weapons, many=True, nested={
+        'weapon_class': Relation('weapon_class_id', _load_weapon_classes),
+    }),
+}
+
+def _projection(mysql, fields=None):
+    # Projection for fields (every column by default)
+    fields = fields or COLUMNS
+    derived = {}
+    if 'ship_class_name' in fields:
+        derived['ship_class_name'] = ('ship_class_id', reference.snapshot(mysql).ship_class_name)
+    return Projection(fields, SELECT_EXPRESSIONS, derived)
+
+
+def _from_clause(projection):
+    # The pilot join is only needed when pilot_name is selected
+    if projection.uses('pilot_name'):
+        return 'ship s LEFT JOIN pilot p ON s.pilot_id = p.id'
+    return 'ship s'
+
+
+def get_all(mysql, limit=None, after=None, fields=None):
+    # Get all ships (one keyset page when limit is given, only the given
+    # columns when fields is given)
+    projection = _projection(mysql, fields)
     cursor = mysql.connection.cursor()
-    cursor.execute('''
-        SELECT s.id, s.name, s.capacity, s.speed, s.shield, 
-               s.ship_class_id, sc.name as ship_class_name,
-               s.pilot_id, p.name as pilot_name
-        FROM ship s
-        LEFT JOIN ship_class sc ON s.ship_class_id = sc.id
-        LEFT JOIN pilot p ON s.pilot_id = p.id
-        ORDER BY s.id
-    ''')
+    query = f'SELECT {projection.select} FROM {_from_clause(projection)}'
+    values = []
+    if after is not None:
+        query += ' WHERE s.id > %s'
+        values.append(after)
+    query += ' ORDER BY s.id'
+    if limit is not None:
+        query += ' LIMIT %s'
+        values.append(limit)
+    cursor.execute(query, values)
     ships = cursor.fetchall()
     cursor.close()
-    return ships
+    return projection.build(ships)
 
 
-def get_by_id(mysql, ship_id):
-    # Get a specific ship by ID with JOINs
+def _fetch_by_id(mysql, ship_id):
     cursor = mysql.connection.cursor()
     cursor.execute('''
         SELECT s.id, s.name, s.capacity, s.speed, s.shield, 
-               s.ship_class_id, sc.name as ship_class_name,
-               s.pilot_id, p.name as pilot_name
+               s.ship_class_id, s.pilot_id, p.name as pilot_name
         FROM ship s
-        LEFT JOIN ship_class sc ON s.ship_class_id = sc.id
         LEFT JOIN pilot p ON s.pilot_id = p.id
         WHERE s.id = %s
     ''', (ship_id,))
@@ -32,138 +141,300 @@ def get_by_id(mysql, ship_id):
     return ship
 
 
-def create(mysql, data):
-    # Create a new ship
+def get_by_id(mysql, ship_id, fields=None):
+    # Get a specific ship by ID (read through the entity cache).
+    # The cached row embeds pilot_name, so it is tagged with the pilot; the
+    # class name is added from the reference snapshot on every read.
+    ship = entity_cache.get_or_load(('ship', ship_id),
+                                    lambda: _fetch_by_id(mysql, ship_id),
+                                    tags=lambda row: [('pilot', row[6])])
+    if ship is None:
+        return None
+    ship = _projection(mysql).build([ship])[0]
+    return select_fields(ship, COLUMNS, fields)
+
+
+def _fetch_many(mysql, ship_ids):
+    # One IN (...) query for several ships, as {id: row}
     cursor = mysql.connection.cursor()
-    cursor.execute('''
-        INSERT INTO ship (name, capacity, speed, shield, ship_class_id, pilot_id)
-        VALUES (%s, %s, %s, %s, %s, %s)
-    ''', (data['name'], data['capacity'], data['speed'], 
-          data['shield'], data['ship_class_id'], data['pilot_id']))
-    mysql.connection.commit()
-    ship_id = cursor.lastrowid
+    placeholders = ', '.join(['%s'] * len(ship_ids))
+    cursor.execute(f'''
+        SELECT s.id, s.name, s.capacity, s.speed, s.shield, 
+               s.ship_class_id, s.pilot_id, p.name as pilot_name
+        FROM ship s
+        LEFT JOIN pilot p ON s.pilot_id = p.id
+        WHERE s.id IN ({placeholders})
+    ''', ship_ids)
+    ships = cursor.fetchall()
     cursor.close()
+    return {ship[0]: ship for ship in ships}
+
+
+def get_many(mysql, ship_ids, fields=None):
+    # Get several ships by ID in the order given, skipping ids that don't exist
+    # (read through the entity cache; all misses are loaded with one query)
+    found = entity_cache.get_many_or_load('ship', ship_ids,
+                                          lambda ids: _fetch_many(mysql, ids),
+                                          tags=lambda row: [('pilot', row[6])])
+    ships = _projection(mysql).build(found[ship_id] for ship_id in ship_ids if ship_id in found)
+    return [select_fields(ship, COLUMNS, fields) for ship in ships]
+
+
+def _summary_source(values):
+    # (pilot_id, ship_class_id, capacity, shield) of a ship's field values
+    return tuple(values[field] for field in summary.SOURCE_FIELDS)
+
+
+def _lock_rows(cursor, where_clauses, where_values):
+    # Read and lock the stored columns of the ships matching a WHERE, keyed
+    # by id, before they are updated (their old totals leave their groups)
+    cursor.execute(f"SELECT s.id, {', '.join('s.' + column for column in UPDATE_COLUMNS.values())} "
+                   f"FROM ship s WHERE {' AND '.join(where_clauses)} FOR UPDATE", where_values)
+    return {row[0]: dict(zip(UPDATE_COLUMNS, row[1:])) for row in cursor.fetchall()}
+
+
+def create(mysql, data):
+    # Create a new ship and add it to its pilot's and class's totals in one
+    # transaction
+    cursor = mysql.connection.cursor()
+    try:
+        cursor.execute('''
+            INSERT INTO ship (name, capacity, speed, shield, ship_class_id, pilot_id)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        ''', (data['name'], data['capacity'], data['speed'], 
+              data['shield'], data['ship_class_id'], data['pilot_id']))
+        ship_id = cursor.lastrowid
+        summary.apply(cursor, summary.deltas(added=[_summary_source(data)]))
+        mysql.connection.commit()
+    except Exception:
+        mysql.connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    autocomplete.record('ships', ship_id, data['name'])
+    table_versions.bump('ship')
     return ship_id
 
 
+def full_row(mysql, ship_row, pilot_name):
+    # Lay out (id, name, capacity, speed, shield, ship_class_id, pilot_id) as
+    # COLUMNS, with the class name taken from the reference snapshot
+    class_name = reference.snapshot(mysql).ship_class_name(ship_row[5])
+    return tuple(ship_row[:6]) + (class_name, ship_row[6], pilot_name)
+
+
+def create_many(mysql, items):
+    # Create many ships with batched multi-row INSERTs in one transaction
+    # (items are validated); returns the new ids in item order
+    cursor = mysql.connection.cursor()
+    try:
+        ship_ids = insert_many(
+            cursor, 'ship', ['name', 'capacity', 'speed', 'shield', 'ship_class_id', 'pilot_id'],
+            [(item['name'], item['capacity'], item['speed'], item['shield'],
+              item['ship_class_id'], item['pilot_id'])
+             for item in items])
+        summary.apply(cursor, summary.deltas(added=[_summary_source(item) for item in items]))
+        mysql.connection.commit()
+    except Exception:
+        mysql.connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    for ship_id, item in zip(ship_ids, items):
+        autocomplete.record('ships', ship_id, item['name'])
+    table_versions.bump('ship')
+    return ship_ids
+
+
 def update(mysql, ship_id, data):
-    # Update an existing ship
-    update_fields = []
-    values = []
-    
-    if 'name' in data:
-        update_fields.append('name = %s')
-        values.append(data['name'])
+    # Update an existing ship in one transaction; returns the updated ship
+    # columns (id, name, capacity, speed, shield, ship_class_id, pilot_id),
+    # or None if the ship does not exist (existence comes from the UPDATE,
+    # or from the locked read when the change moves the ship's totals)
+    set_sql, values = set_clause(UPDATE_COLUMNS, data)
     
-    if 'capacity' in data:
-        update_fields.append('capacity = %s')
-        values.append(data['capacity'])
-    
-    if 'speed' in data:
-        update_fields.append('speed = %s')
-        values.append(data['speed'])
-    
-    if 'shield' in data:
-        update_fields.append('shield = %s')
-        values.append(data['shield'])
+    cursor = mysql.connection.cursor()
+    try:
+        if any(field in data for field in summary.SOURCE_FIELDS):
+            # The old row's totals leave its groups and the new row's join
+            # theirs; the new row is the old one with data applied
+            old = _lock_rows(cursor, ['s.id = %s'], [ship_id]).get(ship_id)
+            if old is None:
+                updated_ship = None
+            else:
+                cursor.execute(f'UPDATE ship SET {set_sql} WHERE id = %s', values + [ship_id])
+                new = dict(old, **{field: data[field] for field in UPDATE_COLUMNS if field in data})
+                summary.apply(cursor, summary.deltas([_summary_source(old)], [_summary_source(new)]))
+                updated_ship = (ship_id,) + tuple(new[field] for field in UPDATE_COLUMNS)
+        else:
+            cursor.execute(f'UPDATE ship SET {set_sql} WHERE id = %s', values + [ship_id])
+            if cursor.rowcount == 0:
+                updated_ship = None
+            elif all(field in data for field in UPDATE_COLUMNS):
+                # Every column was just written, so there is nothing to read back
+                updated_ship = (ship_id,) + tuple(data[field] for field in UPDATE_COLUMNS)
+            else:
+                # Read back inside the transaction, which still holds the row lock
+                cursor.execute(f"SELECT id, {', '.join(UPDATE_COLUMNS.values())} FROM ship WHERE id = %s",
+                               (ship_id,))
+                updated_ship = cursor.fetchone()
+        mysql.connection.commit()
+    except Exception:
+        mysql.connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    if updated_ship is None:
+        return None
     
-    if 'ship_class_id' in data:
-        update_fields.append('ship_class_id = %s')
-        values.append(data['ship_class_id'])
+    # Cached ship weapon assignments embed ship_name, so a rename invalidates them too
+    entity_cache.invalidate(('ship', ship_id))
+    if 'name' in data:
+        entity_cache.invalidate_tag(('ship', ship_id))
+        autocomplete.record('ships', ship_id, data['name'])
+    table_versions.bump('ship')
+    return updated_ship
+
+
+def update_many(mysql, updates):
+    # Apply (id, changes) pairs in one transaction, one UPDATE per distinct
+    # change set; returns the number of ships matched
+    moved = [ship_id for ship_id, changes in updates
+             if any(field in changes for field in summary.SOURCE_FIELDS)]
+    cursor = mysql.connection.cursor()
+    try:
+        if moved:
+            old = _lock_rows(cursor, [f"s.id IN ({', '.join(['%s'] * len(moved))})"], moved)
+        matched = update_grouped(cursor, 'ship', UPDATE_COLUMNS, updates)
+        if moved:
+            new = {ship_id: dict(row) for ship_id, row in old.items()}
+            for ship_id, changes in updates:
+                if ship_id in new:
+                    new[ship_id].update(changes)
+            summary.apply(cursor, summary.deltas([_summary_source(row) for row in old.values()],
+                                                 [_summary_source(row) for row in new.values()]))
+        mysql.connection.commit()
+    except Exception:
+        mysql.connection.rollback()
+        raise
+    finally:
+        cursor.close()
     
-    if 'pilot_id' in data:
-        update_fields.append('pilot_id = %s')
-        values.append(data['pilot_id'])
+    entity_cache.invalidate(*[('ship', ship_id) for ship_id, _ in updates])
+    renamed = [('ship', ship_id) for ship_id, changes in updates if 'name' in changes]
+    if renamed:
+        entity_cache.invalidate_tag(*renamed)
+        if matched < len(updates):
+            # Some ids did not exist, so which renames happened is unknown
+            autocomplete.invalidate('ships')
+        else:
+            for ship_id, changes in updates:
+                if 'name' in changes:
+                    autocomplete.record('ships', ship_id, changes['name'])
+    table_versions.bump('ship')
+    return matched
+
+
+def update_where(mysql, query, changes):
+    # Apply one change set to every ship matching a filter Query with a
+    # single UPDATE; returns the number of ships matched
+    fulltext.ensure_loaded(mysql)
+    where_clauses, where_values = FILTERS.where(query)
+    set_sql, set_values = set_clause(UPDATE_COLUMNS, changes)
     
-    values.append(ship_id)
+    moves_totals = any(field in changes for field in summary.SOURCE_FIELDS)
     
     cursor = mysql.connection.cursor()
-    query = f"UPDATE ship SET {', '.join(update_fields)} WHERE id = %s"
-    cursor.execute(query, values)
-    mysql.connection.commit()
-    rows_affected = cursor.rowcount
-    cursor.close()
-    return rows_affected
+    try:
+        if moves_totals:
+            old = _lock_rows(cursor, where_clauses, where_values)
+        cursor.execute(f"UPDATE ship s SET {set_sql} WHERE {' AND '.join(where_clauses)}",
+                       set_values + where_values)
+        matched = cursor.rowcount
+        if moves_totals:
+            summary.apply(cursor, summary.deltas([_summary_source(row) for row in old.values()],
+                                                 [_summary_source(dict(row, **changes)) for row in old.values()]))
+        mysql.connection.commit()
+    except Exception:
+        mysql.connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    
+    # Which ships matched is unknown, so every cached ship (and on a rename
+    # every cached ship weapon assignment) is dropped
+    entity_cache.invalidate_table('ship')
+    if 'name' in changes:
+        entity_cache.invalidate_table('ship_weapons')
+        autocomplete.invalidate('ships')
+    table_versions.bump('ship')
+    return matched
 
 
 def delete(mysql, ship_id):
-    # Delete a ship (must delete ship_weapons entries first)
+    # Delete a ship and its ship_weapons entries in one transaction, taking
+    # the ship out of its pilot's and class's totals; returns the number of
+    # ships deleted (0 if it did not exist)
     cursor = mysql.connection.cursor()
+    try:
+        cursor.execute(summary.SUBTRACT_SHIP, (ship_id,))
+        subtracted = cursor.rowcount
+        # ship_weapons references ship, so its entries go first
+        cursor.execute('DELETE FROM ship_weapons WHERE ship_id = %s', (ship_id,))
+        cursor.execute('DELETE FROM ship WHERE id = %s', (ship_id,))
+        rows_affected = cursor.rowcount
+        mysql.connection.commit()
+    except Exception:
+        mysql.connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    if rows_affected == 0:
+        return 0
+    summary.check_subtracted(ship_id, subtracted)
     
-    # First delete related ship_weapons entries
-    cursor.execute('DELETE FROM ship_weapons WHERE ship_id = %s', (ship_id,))
-    
-    # Then delete the ship
-    cursor.execute('DELETE FROM ship WHERE id = %s', (ship_id,))
-    
-    mysql.connection.commit()
-    rows_affected = cursor.rowcount
-    cursor.close()
+    entity_cache.invalidate(('ship', ship_id))
+    entity_cache.invalidate_tag(('ship', ship_id))
+    autocomplete.record('ships', ship_id, None)
+    table_versions.bump('ship', 'ship_weapons')
     return rows_affected
 
 
-def search(mysql, criteria):
-    # Search ships based on criteria
-    cursor = mysql.connection.cursor()
-    
-    # Build dynamic WHERE clause
-    where_clauses = []
-    values = []
-    
-    # Name search (LIKE - partial match)
-    if 'name' in criteria and criteria['name']:
-        where_clauses.append('s.name LIKE %s')
-        values.append(f"%{criteria['name']}%")
-    
-    # Ship class ID (exact match)
-    if 'ship_class_id' in criteria and criteria['ship_class_id'] is not None:
-        where_clauses.append('s.ship_class_id = %s')
-        values.append(criteria['ship_class_id'])
-    
-    # Pilot ID (exact match)
-    if 'pilot_id' in criteria and criteria['pilot_id'] is not None:
-        where_clauses.append('s.pilot_id = %s')
-        values.append(criteria['pilot_id'])
-    
-    # Capacity range
-    if 'min_capacity' in criteria and criteria['min_capacity'] is not None:
-        where_clauses.append('s.capacity >= %s')
-        values.append(criteria['min_capacity'])
-    if 'max_capacity' in criteria and criteria['max_capacity'] is not None:
-        where_clauses.append('s.capacity <= %s')
-        values.append(criteria['max_capacity'])
-    
-    # Speed range
-    if 'min_speed' in criteria and criteria['min_speed'] is not None:
-        where_clauses.append('s.speed >= %s')
-        values.append(criteria['min_speed'])
-    if 'max_speed' in criteria and criteria['max_speed'] is not None:
-        where_clauses.append('s.speed <= %s')
-        values.append(criteria['max_speed'])
-    
-    # Shield range
-    if 'min_shield' in criteria and criteria['min_shield'] is not None:
-        where_clauses.append('s.shield >= %s')
-        values.append(criteria['min_shield'])
-    if 'max_shield' in criteria and criteria['max_shield'] is not None:
-        where_clauses.append('s.shield <= %s')
-        values.append(criteria['max_shield'])
-    
-    # Build query
-    query = '''
-        SELECT s.id, s.name, s.capacity, s.speed, s.shield, 
-               s.ship_class_id, sc.name as ship_class_name,
-               s.pilot_id, p.name as pilot_name
-        FROM ship s
-        LEFT JOIN ship_class sc ON s.ship_class_id = sc.id
-        LEFT JOIN pilot p ON s.pilot_id = p.id
-    '''
-    
-    if where_clauses:
-        query += ' WHERE ' + ' AND '.join(where_clauses)
-    query += ' ORDER BY s.id'
+def search(mysql, query, limit=None, after=None, fields=None):
+    # Search ships with a filter Query (one keyset page when limit is given,
+    # only the given columns when fields is given)
+    projection = _projection(mysql, fields)
+    fulltext.ensure_loaded(mysql)
+    sql, values = FILTERS.sql(projection.select, _from_clause(projection), query, limit, after)
     
-    cursor.execute(query, values)
+    cursor = mysql.connection.cursor()
+    cursor.execute(sql, values)
     ships = cursor.fetchall()
     cursor.close()
-    return ships
+    return projection.build(ships)
+
+
+def stream(mysql, query=None, fields=None):
+    # Yield ships matching a filter Query row by row from an unbuffered server-side cursor
+    projection = _projection(mysql, fields)
+    fulltext.ensure_loaded(mysql)
+    sql, values = FILTERS.sql(projection.select, _from_clause(projection), query or FILTERS.unfiltered())
+    with mysql.server_side_cursor() as cursor:
+        cursor.execute(sql, values)
+        while True:
+            rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            yield from projection.build(rows)
+
+
+def stats(mysql, query, group=None):
+    # Summarize ships matching a filter Query (per group when group is given)
+    # with one aggregated query
+    fulltext.ensure_loaded(mysql)
+    sql, values = STATS.sql('ship s', query, group)
+    cursor = mysql.connection.cursor()
+    cursor.execute(sql, values)
+    rows = cursor.fetchall()
+    cursor.close()
+    return STATS.from_sql_rows(rows, group)
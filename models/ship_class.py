@@ -1,27 +1,43 @@
-def get_all(mysql):
-    # Get all ship classes from the database
-    cursor = mysql.connection.cursor()
-    cursor.execute('''
-        SELECT id, name, description
-        FROM ship_class
-        ORDER BY id
-    ''')
-    ship_classes = cursor.fetchall()
-    cursor.close()
-    return ship_classes
+from models import reference
+from utils.bulk import set_clause
+from utils.fields import select_fields
+from utils.filters import Field, FilterSpec
+from utils.versions import table_versions
 
+# Column order of a full row
+COLUMNS = ('id', 'name', 'description')
+
+# Updatable field -> column
+UPDATE_COLUMNS = {
+    'name': 'name',
+    'description': 'description',
+}
+
+# Filterable and sortable fields: name= and description=, evaluated over the
+# reference snapshot (index is the column's position in a row)
+FILTERS = FilterSpec({
+    'id': Field(ops=(), sortable=True, indexed=True, index=0),
+    'name': Field(type=str, ops=('match',), sortable=True, index=1),
+    'description': Field(type=str, ops=('match',), index=2),
+})
 
-def get_by_id(mysql, class_id):
-    # Get a specific ship class by ID
-    cursor = mysql.connection.cursor()
-    cursor.execute('''
-        SELECT id, name, description
-        FROM ship_class
-        WHERE id = %s
-    ''', (class_id,))
-    ship_class = cursor.fetchone()
-    cursor.close()
-    return ship_class
+
+def get_all(mysql, limit=None, after=None, fields=None):
+    # Get all ship classes from the reference snapshot (one keyset page when limit is given)
+    rows = reference.page(reference.snapshot(mysql).ship_classes, limit, after)
+    return [select_fields(row, COLUMNS, fields) for row in rows]
+
+
+def get_by_id(mysql, class_id, fields=None):
+    # Get a specific ship class by ID from the reference snapshot
+    row = reference.snapshot(mysql).ship_class_by_id.get(class_id)
+    return select_fields(row, COLUMNS, fields)
+
+
+def get_many(mysql, class_ids, fields=None):
+    # Get several by ID from the reference snapshot in the order given, skipping ids that don't exist
+    by_id = reference.snapshot(mysql).ship_class_by_id
+    return [select_fields(by_id[id_], COLUMNS, fields) for id_ in class_ids if id_ in by_id]
 
 
 def create(mysql, data):
@@ -38,68 +54,68 @@ def create(mysql, data):
     mysql.connection.commit()
     class_id = cursor.lastrowid
     cursor.close()
+    
+    # The new row is fully known, so the snapshot is patched rather than reloaded
+    reference.apply_write('ship_class', class_id, (class_id, data['name'], description))
+    table_versions.bump('ship_class')
     return class_id
 
 
 def update(mysql, class_id, data):
-    # Update an existing ship class
-    update_fields = []
-    values = []
-    
-    if 'name' in data:
-        update_fields.append('name = %s')
-        values.append(data['name'])
-    
-    if 'description' in data:
-        update_fields.append('description = %s')
-        values.append(data['description'])
-    
-    values.append(class_id)
+    # Update an existing ship class in one transaction; returns the updated row,
+    # or None if it does not exist (existence comes from the UPDATE)
+    set_sql, values = set_clause(UPDATE_COLUMNS, data)
     
     cursor = mysql.connection.cursor()
-    query = f"UPDATE ship_class SET {', '.join(update_fields)} WHERE id = %s"
-    cursor.execute(query, values)
-    mysql.connection.commit()
-    rows_affected = cursor.rowcount
-    cursor.close()
-    return rows_affected
+    try:
+        cursor.execute(f'UPDATE ship_class SET {set_sql} WHERE id = %s', values + [class_id])
+        if cursor.rowcount == 0:
+            updated = None
+        elif all(field in data for field in UPDATE_COLUMNS):
+            # Every column was just written, so there is nothing to read back
+            updated = (class_id,) + tuple(data[field] for field in UPDATE_COLUMNS)
+        else:
+            # Read back inside the transaction, which still holds the row lock;
+            # the snapshot row may predate another process's write
+            cursor.execute('SELECT id, name, description FROM ship_class WHERE id = %s', (class_id,))
+            updated = cursor.fetchone()
+        mysql.connection.commit()
+    except Exception:
+        mysql.connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    
+    # The row as stored is known, so the snapshot is patched rather than
+    # reloaded (a row missing from the UPDATE is dropped from it)
+    reference.apply_write('ship_class', class_id, updated)
+    if updated is None:
+        return None
+    table_versions.bump('ship_class')
+    return updated
 
 
 def delete(mysql, class_id):
-    # Delete a ship class
+    # Delete a ship class; returns the number of rows deleted (0 if it did not exist)
     cursor = mysql.connection.cursor()
     cursor.execute('DELETE FROM ship_class WHERE id = %s', (class_id,))
     mysql.connection.commit()
     rows_affected = cursor.rowcount
     cursor.close()
+    
+    reference.apply_write('ship_class', class_id, None)
+    if rows_affected:
+        table_versions.bump('ship_class')
     return rows_affected
 
 
-def search(mysql, criteria):
-    # Search ship classes based on criteria
-    cursor = mysql.connection.cursor()
-    
-    # Build dynamic WHERE clause
-    where_clauses = []
-    values = []
-    
-    # Name search (LIKE - partial match)
-    if 'name' in criteria and criteria['name']:
-        where_clauses.append('name LIKE %s')
-        values.append(f"%{criteria['name']}%")
-    
-    # Description search (LIKE - partial match)
-    if 'description' in criteria and criteria['description']:
-        where_clauses.append('description LIKE %s')
-        values.append(f"%{criteria['description']}%")
-    
-    # Build query
-    query = 'SELECT id, name, description FROM ship_class'
-    if where_clauses:
-        query += ' WHERE ' + ' AND '.join(where_clauses)
-    query += ' ORDER BY id'
-    
-    cursor.execute(query, values)
-    ship_classes = cursor.fetchall()
-    cursor.close()
-    return ship_classes
+def search(mysql, query, limit=None, after=None, fields=None):
+    # Search ship classes in the reference snapshot with a filter Query
+    # (one keyset page when limit is given)
+    snapshot = reference.snapshot(mysql)
+    text_indexes = {
+        'name': snapshot.text_index('ship_class', 1),
+        'description': snapshot.text_index('ship_class', 2),
+    }
+    rows = FILTERS.select_rows(snapshot.ship_classes, query, limit, after, text_indexes)
+    return [select_fields(row, COLUMNS, fields) for row in rows]
\ No newline at end of file
@@ -1,54 +1,126 @@
-def get_all(mysql):
-    # Get all ship weapon assignments with JOINs
+from models import reference
+from utils.cache import entity_cache
+from utils.bulk import insert_many
+from utils.fields import Projection, select_fields
+from utils.versions import table_versions
+
+# Rows fetched per round trip when streaming from a server-side cursor
+STREAM_BATCH_SIZE = 500
+
+# Column order of a full ship weapon assignment row
+COLUMNS = ('ship_id', 'ship_name', 'ship_class_id', 'ship_class_name',
+           'weapon_class_id', 'weapon_class_name', 'name')
+
+# API column -> SELECT expression. ship_name needs the ship join; the class
+# names are filled in from the reference snapshot instead.
+SELECT_EXPRESSIONS = {
+    'ship_id': 'sw.ship_id',
+    'ship_name': 's.name as ship_name',
+    'ship_class_id': 'sw.ship_class_id',
+    'weapon_class_id': 'sw.weapon_class_id',
+    'name': 'sw.name',
+}
+
+
+def _projection(mysql, fields=None):
+    # Projection for fields (every column by default)
+    fields = fields or COLUMNS
+    derived = {}
+    if 'ship_class_name' in fields or 'weapon_class_name' in fields:
+        snapshot = reference.snapshot(mysql)
+        if 'ship_class_name' in fields:
+            derived['ship_class_name'] = ('ship_class_id', snapshot.ship_class_name)
+        if 'weapon_class_name' in fields:
+            derived['weapon_class_name'] = ('weapon_class_id', snapshot.weapon_class_name)
+    return Projection(fields, SELECT_EXPRESSIONS, derived)
+
+
+def _from_clause(projection):
+    # The ship join is only needed when ship_name is selected
+    if projection.uses('ship_name'):
+        return 'ship_weapons sw LEFT JOIN ship s ON sw.ship_id = s.id'
+    return 'ship_weapons sw'
+
+
+def _list_query(projection, limit=None, after=None):
+    # Build the ship weapon assignment list query and its parameters
+    # after is the (ship_id, ship_class_id, weapon_class_id) key of the previous page's last row
+    query = f'SELECT {projection.select} FROM {_from_clause(projection)}'
+    values = []
+    if after is not None:
+        # Row constructor comparison is a range scan on the composite primary key
+        query += ' WHERE (sw.ship_id, sw.ship_class_id, sw.weapon_class_id) > (%s, %s, %s)'
+        values.extend(after)
+    query += ' ORDER BY sw.ship_id, sw.ship_class_id, sw.weapon_class_id'
+    if limit is not None:
+        query += ' LIMIT %s'
+        values.append(limit)
+    return query, values
+
+
+def get_all(mysql, limit=None, after=None, fields=None):
+    # Get all ship weapon assignments (one keyset page when limit is given,
+    # only the given columns when fields is given)
+    projection = _projection(mysql, fields)
+    query, values = _list_query(projection, limit, after)
     cursor = mysql.connection.cursor()
-    cursor.execute('''
-        SELECT sw.ship_id, s.name as ship_name,
-               sw.ship_class_id, sc.name as ship_class_name,
-               sw.weapon_class_id, wc.class as weapon_class_name,
-               sw.name
-        FROM ship_weapons sw
-        LEFT JOIN ship s ON sw.ship_id = s.id
-        LEFT JOIN ship_class sc ON sw.ship_class_id = sc.id
-        LEFT JOIN weapon_class wc ON sw.weapon_class_id = wc.id
-        ORDER BY sw.ship_id, sw.ship_class_id, sw.weapon_class_id
-    ''')
+    cursor.execute(query, values)
     ship_weapons = cursor.fetchall()
     cursor.close()
-    return ship_weapons
+    return projection.build(ship_weapons)
+
 
+def stream(mysql, fields=None):
+    # Yield all ship weapon assignments row by row from an unbuffered server-side cursor
+    projection = _projection(mysql, fields)
+    query, values = _list_query(projection)
+    with mysql.server_side_cursor() as cursor:
+        cursor.execute(query, values)
+        while True:
+            rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            yield from projection.build(rows)
 
-def get_by_ship_id(mysql, ship_id):
+
+def get_by_ship_id(mysql, ship_id, fields=None):
     # Get all weapons for a specific ship
+    projection = _projection(mysql, fields)
     cursor = mysql.connection.cursor()
-    cursor.execute('''
-        SELECT sw.ship_id, s.name as ship_name,
-               sw.ship_class_id, sc.name as ship_class_name,
-               sw.weapon_class_id, wc.class as weapon_class_name,
-               sw.name
-        FROM ship_weapons sw
-        LEFT JOIN ship s ON sw.ship_id = s.id
-        LEFT JOIN ship_class sc ON sw.ship_class_id = sc.id
-        LEFT JOIN weapon_class wc ON sw.weapon_class_id = wc.id
+    cursor.execute(f'''
+        SELECT {projection.select}
+        FROM {_from_clause(projection)}
         WHERE sw.ship_id = %s
         ORDER BY sw.ship_class_id, sw.weapon_class_id
     ''', (ship_id,))
     ship_weapons = cursor.fetchall()
     cursor.close()
-    return ship_weapons
+    return projection.build(ship_weapons)
 
 
-def get_by_id(mysql, ship_id, ship_class_id, weapon_class_id):
-    # Get a specific ship weapon assignment by composite key
+
+def get_by_ship_ids(mysql, ship_ids, fields=None):
+    # Get the weapons of several ships with one IN (...) query, ordered by
+    # ship and then as get_by_ship_id orders them
+    projection = _projection(mysql, fields)
+    cursor = mysql.connection.cursor()
+    cursor.execute(f'''
+        SELECT {projection.select}
+        FROM {_from_clause(projection)}
+        WHERE sw.ship_id IN ({', '.join(['%s'] * len(ship_ids))})
+        ORDER BY sw.ship_id, sw.ship_class_id, sw.weapon_class_id
+    ''', list(ship_ids))
+    ship_weapons = cursor.fetchall()
+    cursor.close()
+    return projection.build(ship_weapons)
+
+def _fetch_by_id(mysql, ship_id, ship_class_id, weapon_class_id):
     cursor = mysql.connection.cursor()
     cursor.execute('''
         SELECT sw.ship_id, s.name as ship_name,
-               sw.ship_class_id, sc.name as ship_class_name,
-               sw.weapon_class_id, wc.class as weapon_class_name,
-               sw.name
+               sw.ship_class_id, sw.weapon_class_id, sw.name
         FROM ship_weapons sw
         LEFT JOIN ship s ON sw.ship_id = s.id
-        LEFT JOIN ship_class sc ON sw.ship_class_id = sc.id
-        LEFT JOIN weapon_class wc ON sw.weapon_class_id = wc.id
         WHERE sw.ship_id = %s 
           AND sw.ship_class_id = %s 
           AND sw.weapon_class_id = %s
@@ -58,6 +130,47 @@ def get_by_id(mysql, ship_id, ship_class_id, weapon_class_id):
     return ship_weapon
 
 
+def get_by_id(mysql, ship_id, ship_class_id, weapon_class_id, fields=None):
+    # Get a specific ship weapon assignment by composite key (read through the entity cache).
+    # The cached row embeds ship_name, so it is tagged with the ship; class names are
+    # added from the reference snapshot on every read.
+    key = (ship_id, ship_class_id, weapon_class_id)
+    ship_weapon = entity_cache.get_or_load(('ship_weapons', key),
+                                           lambda: _fetch_by_id(mysql, *key),
+                                           tags=lambda row: [('ship', ship_id)])
+    if ship_weapon is None:
+        return None
+    ship_weapon = _projection(mysql).build([ship_weapon])[0]
+    return select_fields(ship_weapon, COLUMNS, fields)
+
+
+def _fetch_many(mysql, keys):
+    # One IN (...) query for several assignments, as {(ship_id, ship_class_id, weapon_class_id): row}
+    cursor = mysql.connection.cursor()
+    placeholders = ', '.join(['(%s, %s, %s)'] * len(keys))
+    cursor.execute(f'''
+        SELECT sw.ship_id, s.name as ship_name,
+               sw.ship_class_id, sw.weapon_class_id, sw.name
+        FROM ship_weapons sw
+        LEFT JOIN ship s ON sw.ship_id = s.id
+        WHERE (sw.ship_id, sw.ship_class_id, sw.weapon_class_id) IN ({placeholders})
+    ''', [value for key in keys for value in key])
+    ship_weapons = cursor.fetchall()
+    cursor.close()
+    return {(row[0], row[2], row[3]): row for row in ship_weapons}
+
+
+def get_many(mysql, keys, fields=None):
+    # Get several assignments by (ship_id, ship_class_id, weapon_class_id) key in the
+    # order given, skipping keys that don't exist (read through the entity cache;
+    # all misses are loaded with one query)
+    found = entity_cache.get_many_or_load('ship_weapons', keys,
+                                          lambda missing: _fetch_many(mysql, missing),
+                                          tags=lambda row: [('ship', row[0])])
+    ship_weapons = _projection(mysql).build(found[key] for key in keys if key in found)
+    return [select_fields(ship_weapon, COLUMNS, fields) for ship_weapon in ship_weapons]
+
+
 def create(mysql, data):
     # Create a new ship weapon assignment
     cursor = mysql.connection.cursor()
@@ -68,9 +181,30 @@ def create(mysql, data):
           data['weapon_class_id'], data['name']))
     mysql.connection.commit()
     cursor.close()
+    table_versions.bump('ship_weapons')
     return True
 
 
+def create_many(mysql, items):
+    # Create many ship weapon assignments with batched multi-row INSERTs in one
+    # transaction (items are validated); returns the number created
+    cursor = mysql.connection.cursor()
+    try:
+        insert_many(
+            cursor, 'ship_weapons', ['ship_id', 'ship_class_id', 'weapon_class_id', 'name'],
+            [(item['ship_id'], item['ship_class_id'], item['weapon_class_id'], item['name'])
+             for item in items],
+            returning_ids=False)
+        mysql.connection.commit()
+    except Exception:
+        mysql.connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    table_versions.bump('ship_weapons')
+    return len(items)
+
+
 def delete(mysql, ship_id, ship_class_id, weapon_class_id):
     # Delete a ship weapon assignment by composite key
     cursor = mysql.connection.cursor()
@@ -83,4 +217,9 @@ def delete(mysql, ship_id, ship_class_id, weapon_class_id):
     mysql.connection.commit()
     rows_affected = cursor.rowcount
     cursor.close()
+    if rows_affected == 0:
+        return 0
+    
+    entity_cache.invalidate(('ship_weapons', (ship_id, ship_class_id, weapon_class_id)))
+    table_versions.bump('ship_weapons')
     return rows_affected
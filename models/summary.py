@@ -0,0 +1,146 @@
+"""
+Ship totals per pilot and per ship class, kept in summary tables.
+
+pilot_ship_summary and ship_class_ship_summary (migration 0004) hold the
+number of ships and their total capacity and shield for each pilot and each
+class. The ship write functions keep them current by applying deltas in the
+same transaction as the ship write: a created ship is added to its pilot's
+and class's totals, a deleted one subtracted, and an updated one subtracted
+with its old values and added with its new ones, which moves it when its
+pilot or class changes. rebuild() recomputes the totals from ship
+(repair_summaries.py).
+
+apply() upserts with INSERT ... AS delta ON DUPLICATE KEY UPDATE, which
+needs MySQL 8.0.19 or later.
+"""
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# Entity -> (summary table, ship column it groups by)
+TABLES = {
+    'pilot': ('pilot_ship_summary', 'pilot_id'),
+    'ship_class': ('ship_class_ship_summary', 'ship_class_id'),
+}
+
+# Ship fields that move a ship's totals, in the order of a summary source row
+SOURCE_FIELDS = ('pilot_id', 'ship_class_id', 'capacity', 'shield')
+
+# Summary columns, in response order
+TOTALS = ('ship_count', 'total_capacity', 'total_shield')
+
+# Subtracts a ship from both of its summary rows in one statement (run
+# before the ship row is deleted); its rowcount is the number of summary rows
+# updated, so 2 for an existing ship (see check_subtracted)
+SUBTRACT_SHIP = '''
+    UPDATE ship s
+    LEFT JOIN pilot_ship_summary ps ON ps.pilot_id = s.pilot_id
+    LEFT JOIN ship_class_ship_summary cs ON cs.ship_class_id = s.ship_class_id
+    SET ps.ship_count = ps.ship_count - 1,
+        ps.total_capacity = ps.total_capacity - s.capacity,
+        ps.total_shield = ps.total_shield - s.shield,
+        cs.ship_count = cs.ship_count - 1,
+        cs.total_capacity = cs.total_capacity - s.capacity,
+        cs.total_shield = cs.total_shield - s.shield
+    WHERE s.id = %s
+'''
+
+
+def check_subtracted(ship_id, subtracted):
+    """
+    Log a deleted ship whose SUBTRACT_SHIP did not update both summary rows.
+
+    A missing row means the summaries had already drifted from ship (e.g.
+    ships inserted by hand), so its totals stay wrong until
+    repair_summaries.py is run.
+    """
+    if subtracted < len(TABLES):
+        logger.warning('Ship %s was deleted with %s of %s summary rows present; '
+                       'run repair_summaries.py', ship_id, subtracted, len(TABLES))
+
+
+def deltas(removed=(), added=()):
+    """
+    Net changes to the summary rows for ships leaving and joining groups.
+
+    Args:
+        removed: Source rows (pilot_id, ship_class_id, capacity, shield) of
+            ships whose old values leave their groups
+        added: Source rows of ships whose new values join their groups
+
+    Returns:
+        dict: Entity -> {group id: [ships, capacity, shield]}, without
+            groups whose totals do not change
+    """
+    changes = {entity: defaultdict(lambda: [0, 0, 0]) for entity in TABLES}
+    for rows, sign in ((removed, -1), (added, 1)):
+        for pilot_id, ship_class_id, capacity, shield in rows:
+            for entity, key in (('pilot', pilot_id), ('ship_class', ship_class_id)):
+                delta = changes[entity][key]
+                delta[0] += sign
+                delta[1] += sign * capacity
+                delta[2] += sign * shield
+    return {entity: {key: delta for key, delta in groups.items() if any(delta)}
+            for entity, groups in changes.items()}
+
+
+def apply(cursor, changes):
+    # Add deltas() to the summary rows inside the caller's transaction, one
+    # upsert per table (a missing row starts from zero). Rows are written in
+    # key order, so concurrent writers lock them in the same order.
+    for entity, groups in changes.items():
+        if not groups:
+            continue
+        table, column = TABLES[entity]
+        cursor.execute(
+            f'INSERT INTO {table} ({column}, ship_count, total_capacity, total_shield) VALUES '
+            + ', '.join(['(%s, %s, %s, %s)'] * len(groups))
+            + ' AS delta ON DUPLICATE KEY UPDATE ship_count = ship_count + delta.ship_count,'
+              ' total_capacity = total_capacity + delta.total_capacity,'
+              ' total_shield = total_shield + delta.total_shield',
+            [value for key in sorted(groups) for value in (key, *groups[key])])
+
+
+def rebuild(cursor):
+    """Recompute both summary tables from ship inside the caller's transaction."""
+    for table, column in TABLES.values():
+        cursor.execute(f'DELETE FROM {table}')
+        cursor.execute(f'''
+            INSERT INTO {table} ({column}, ship_count, total_capacity, total_shield)
+            SELECT {column}, COUNT(*), SUM(capacity), SUM(shield) FROM ship GROUP BY {column}
+        ''')
+
+
+def drift(cursor):
+    """
+    Compare the summary tables with totals recomputed from ship.
+
+    Returns:
+        list: (entity, group id, stored totals, actual totals) for every
+            group that differs; a group without ships counts as zeros
+    """
+    differences = []
+    for entity, (table, column) in TABLES.items():
+        cursor.execute(f"SELECT {column}, {', '.join(TOTALS)} FROM {table}")
+        stored = {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+        cursor.execute(f'SELECT {column}, COUNT(*), SUM(capacity), SUM(shield) FROM ship GROUP BY {column}')
+        actual = {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+        for key in sorted(stored.keys() | actual.keys()):
+            have, want = stored.get(key, (0, 0, 0)), actual.get(key, (0, 0, 0))
+            if have != want:
+                differences.append((entity, key, have, want))
+    return differences
+
+
+def get(mysql, entity, key):
+    """
+    Return the totals of one pilot or class as (ship_count, total_capacity,
+    total_shield); zeros when it has no ships.
+    """
+    table, column = TABLES[entity]
+    cursor = mysql.connection.cursor()
+    cursor.execute(f"SELECT {', '.join(TOTALS)} FROM {table} WHERE {column} = %s", (key,))
+    row = cursor.fetchone()
+    cursor.close()
+    return tuple(row) if row else (0, 0, 0)
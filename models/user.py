@@ -1,6 +1,8 @@
 """
 User model for authentication and user management.
 """
+from utils.cache import entity_cache
+from utils.versions import table_versions
 
 def get_all(mysql):
     """Get all users (excluding passwords)"""
@@ -11,8 +13,7 @@ def get_all(mysql):
     cursor.close()
     return users
 
-def get_by_id(mysql, user_id):
-    """Get a user by ID (excluding password)"""
+def _fetch_by_id(mysql, user_id):
     cursor = mysql.connection.cursor()
     query = "SELECT id, username, email, created_at FROM users WHERE id = %s"
     cursor.execute(query, (user_id,))
@@ -20,6 +21,11 @@ def get_by_id(mysql, user_id):
     cursor.close()
     return user
 
+def get_by_id(mysql, user_id):
+    """Get a user by ID (excluding password), read through the entity cache"""
+    return entity_cache.get_or_load(('users', user_id),
+                                    lambda: _fetch_by_id(mysql, user_id))
+
 def get_by_username(mysql, username):
     """Get a user by username (including password hash for authentication)"""
     cursor = mysql.connection.cursor()
@@ -62,6 +68,7 @@ def create(mysql, data):
     mysql.connection.commit()
     user_id = cursor.lastrowid
     cursor.close()
+    table_versions.bump('users')
     return user_id
 
 def update(mysql, user_id, data):
@@ -101,6 +108,8 @@ def update(mysql, user_id, data):
     cursor.execute(query, tuple(values))
     mysql.connection.commit()
     cursor.close()
+    entity_cache.invalidate(('users', user_id))
+    table_versions.bump('users')
 
 def delete(mysql, user_id):
     """
@@ -115,6 +124,8 @@ def delete(mysql, user_id):
     cursor.execute(query, (user_id,))
     mysql.connection.commit()
     cursor.close()
+    entity_cache.invalidate(('users', user_id))
+    table_versions.bump('users')
 
 def username_exists(mysql, username):
     """
@@ -151,3 +162,26 @@ def email_exists(mysql, email):
     count = cursor.fetchone()[0]
     cursor.close()
     return count > 0
+
+def find_taken(mysql, username, email):
+    """
+    Check a username and an email for registration with one query.
+    
+    Args:
+        mysql: MySQL connection
+        username: Username to check
+        email: Email to check
+        
+    Returns:
+        tuple: (username_taken, email_taken)
+    """
+    cursor = mysql.connection.cursor()
+    query = """
+        SELECT COALESCE(MAX(username = %s), 0), COALESCE(MAX(email = %s), 0)
+        FROM users
+        WHERE username = %s OR email = %s
+    """
+    cursor.execute(query, (username, email, username, email))
+    username_taken, email_taken = cursor.fetchone()
+    cursor.close()
+    return bool(username_taken), bool(email_taken)
@@ -1,27 +1,54 @@
-def get_all(mysql):
-    # Get all weapon classes from the database
-    cursor = mysql.connection.cursor()
-    cursor.execute('''
-        SELECT id, class, damage, reload_speed, spread, `range`
-        FROM weapon_class
-        ORDER BY id
-    ''')
-    weapon_classes = cursor.fetchall()
-    cursor.close()
-    return weapon_classes
+from models import reference
+from utils.bulk import insert_many, set_clause, update_grouped
+from utils.fields import select_fields
+from utils.filters import Field, FilterSpec
+from utils.stats import StatsSpec
+from utils.versions import table_versions
 
+# Column order of a full row
+COLUMNS = ('id', 'class', 'damage', 'reload_speed', 'spread', 'range')
+
+# Updatable field -> column, for single and bulk updates
+UPDATE_COLUMNS = {
+    'class': 'class',
+    'damage': 'damage',
+    'reload_speed': 'reload_speed',
+    'spread': 'spread',
+    'range': '`range`',
+}
+
+# Filterable and sortable fields: class= and min_/max_ of each number, evaluated
+# over the reference snapshot (index is the column's position in a row)
+FILTERS = FilterSpec({
+    'id': Field(ops=(), sortable=True, indexed=True, index=0),
+    'class': Field(type=str, ops=('match',), sortable=True, index=1),
+    'damage': Field(ops=('min', 'max'), sortable=True, index=2),
+    'reload_speed': Field(ops=('min', 'max'), sortable=True, index=3),
+    'spread': Field(ops=('min', 'max'), sortable=True, index=4),
+    'range': Field(ops=('min', 'max'), sortable=True, index=5),
+})
+
+
+# Metrics summarized by /api/stats/weapon-classes, overall or per class name
+STATS = StatsSpec(FILTERS, metrics=('damage', 'reload_speed', 'spread', 'range'), group_by=('class',))
+
+
+def get_all(mysql, limit=None, after=None, fields=None):
+    # Get all weapon classes from the reference snapshot (one keyset page when limit is given)
+    rows = reference.page(reference.snapshot(mysql).weapon_classes, limit, after)
+    return [select_fields(row, COLUMNS, fields) for row in rows]
 
-def get_by_id(mysql, weapon_id):
-    # Get a specific weapon class by ID
-    cursor = mysql.connection.cursor()
-    cursor.execute('''
-        SELECT id, class, damage, reload_speed, spread, `range`
-        FROM weapon_class
-        WHERE id = %s
-    ''', (weapon_id,))
-    weapon_class = cursor.fetchone()
-    cursor.close()
-    return weapon_class
+
+def get_by_id(mysql, weapon_id, fields=None):
+    # Get a specific weapon class by ID from the reference snapshot
+    row = reference.snapshot(mysql).weapon_class_by_id.get(weapon_id)
+    return select_fields(row, COLUMNS, fields)
+
+
+def get_many(mysql, weapon_ids, fields=None):
+    # Get several by ID from the reference snapshot in the order given, skipping ids that don't exist
+    by_id = reference.snapshot(mysql).weapon_class_by_id
+    return [select_fields(by_id[id_], COLUMNS, fields) for id_ in weapon_ids if id_ in by_id]
 
 
 def create(mysql, data):
@@ -35,107 +62,126 @@ def create(mysql, data):
     mysql.connection.commit()
     weapon_id = cursor.lastrowid
     cursor.close()
+    
+    # The new row is fully known, so the snapshot is patched rather than reloaded
+    reference.apply_write('weapon_class', weapon_id,
+                          (weapon_id,) + tuple(data[column] for column in COLUMNS[1:]))
+    table_versions.bump('weapon_class')
     return weapon_id
 
 
+def create_many(mysql, items):
+    # Create many weapon classes with batched multi-row INSERTs in one transaction
+    # (items are validated); returns the new ids in item order
+    cursor = mysql.connection.cursor()
+    try:
+        weapon_ids = insert_many(
+            cursor, 'weapon_class', ['class', 'damage', 'reload_speed', 'spread', '`range`'],
+            [(item['class'], item['damage'], item['reload_speed'], item['spread'], item['range'])
+             for item in items])
+        mysql.connection.commit()
+    except Exception:
+        mysql.connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    reference.refresh_after_write(mysql)
+    table_versions.bump('weapon_class')
+    return weapon_ids
+
+
 def update(mysql, weapon_id, data):
-    # Update an existing weapon class
-    update_fields = []
-    values = []
-    
-    if 'class' in data:
-        update_fields.append('class = %s')
-        values.append(data['class'])
-    
-    if 'damage' in data:
-        update_fields.append('damage = %s')
-        values.append(data['damage'])
-    
-    if 'reload_speed' in data:
-        update_fields.append('reload_speed = %s')
-        values.append(data['reload_speed'])
-    
-    if 'spread' in data:
-        update_fields.append('spread = %s')
-        values.append(data['spread'])
-    
-    if 'range' in data:
-        update_fields.append('`range` = %s')
-        values.append(data['range'])
+    # Update an existing weapon class in one transaction; returns the updated row,
+    # or None if it does not exist (existence comes from the UPDATE)
+    set_sql, values = set_clause(UPDATE_COLUMNS, data)
     
-    values.append(weapon_id)
+    cursor = mysql.connection.cursor()
+    try:
+        cursor.execute(f'UPDATE weapon_class SET {set_sql} WHERE id = %s', values + [weapon_id])
+        if cursor.rowcount == 0:
+            updated = None
+        elif all(field in data for field in UPDATE_COLUMNS):
+            # Every column was just written, so there is nothing to read back
+            updated = (weapon_id,) + tuple(data[field] for field in UPDATE_COLUMNS)
+        else:
+            # Read back inside the transaction, which still holds the row lock;
+            # the snapshot row may predate another process's write
+            cursor.execute('SELECT id, class, damage, reload_speed, spread, `range` FROM weapon_class WHERE id = %s', (weapon_id,))
+            updated = cursor.fetchone()
+        mysql.connection.commit()
+    except Exception:
+        mysql.connection.rollback()
+        raise
+    finally:
+        cursor.close()
     
+    # The row as stored is known, so the snapshot is patched rather than
+    # reloaded (a row missing from the UPDATE is dropped from it)
+    reference.apply_write('weapon_class', weapon_id, updated)
+    if updated is None:
+        return None
+    table_versions.bump('weapon_class')
+    return updated
+
+
+def update_many(mysql, updates):
+    # Apply (id, changes) pairs in one transaction, one UPDATE per distinct
+    # change set; returns the number of weapon classes matched
     cursor = mysql.connection.cursor()
-    query = f"UPDATE weapon_class SET {', '.join(update_fields)} WHERE id = %s"
-    cursor.execute(query, values)
-    mysql.connection.commit()
-    rows_affected = cursor.rowcount
-    cursor.close()
-    return rows_affected
+    try:
+        matched = update_grouped(cursor, 'weapon_class', UPDATE_COLUMNS, updates)
+        mysql.connection.commit()
+    except Exception:
+        mysql.connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    reference.refresh_after_write(mysql)
+    table_versions.bump('weapon_class')
+    return matched
+
+
+def update_where(mysql, query, changes):
+    # Apply one change set to every weapon class matching a filter Query;
+    # the matching ids come from the reference snapshot, so this is a single
+    # UPDATE ... WHERE id IN (...)
+    weapon_ids = [row[0] for row in search(mysql, query, fields=('id',))]
+    if not weapon_ids:
+        return 0
+    return update_many(mysql, [(weapon_id, changes) for weapon_id in weapon_ids])
 
 
 def delete(mysql, weapon_id):
-    # Delete a weapon class
+    # Delete a weapon class; returns the number of rows deleted (0 if it did not exist)
     cursor = mysql.connection.cursor()
     cursor.execute('DELETE FROM weapon_class WHERE id = %s', (weapon_id,))
     mysql.connection.commit()
     rows_affected = cursor.rowcount
     cursor.close()
+    
+    reference.apply_write('weapon_class', weapon_id, None)
+    if rows_affected:
+        table_versions.bump('weapon_class')
     return rows_affected
 
 
-def search(mysql, criteria):
-    # Search weapon classes based on criteria
-    cursor = mysql.connection.cursor()
-    
-    # Build dynamic WHERE clause
-    where_clauses = []
-    values = []
-    
-    # Class name search (LIKE - partial match)
-    if 'class' in criteria and criteria['class']:
-        where_clauses.append('class LIKE %s')
-        values.append(f"%{criteria['class']}%")
-    
-    # Damage range
-    if 'min_damage' in criteria and criteria['min_damage'] is not None:
-        where_clauses.append('damage >= %s')
-        values.append(criteria['min_damage'])
-    if 'max_damage' in criteria and criteria['max_damage'] is not None:
-        where_clauses.append('damage <= %s')
-        values.append(criteria['max_damage'])
-    
-    # Reload speed range
-    if 'min_reload_speed' in criteria and criteria['min_reload_speed'] is not None:
-        where_clauses.append('reload_speed >= %s')
-        values.append(criteria['min_reload_speed'])
-    if 'max_reload_speed' in criteria and criteria['max_reload_speed'] is not None:
-        where_clauses.append('reload_speed <= %s')
-        values.append(criteria['max_reload_speed'])
-    
-    # Spread range
-    if 'min_spread' in criteria and criteria['min_spread'] is not None:
-        where_clauses.append('spread >= %s')
-        values.append(criteria['min_spread'])
-    if 'max_spread' in criteria and criteria['max_spread'] is not None:
-        where_clauses.append('spread <= %s')
-        values.append(criteria['max_spread'])
-    
-    # Range range
-    if 'min_range' in criteria and criteria['min_range'] is not None:
-        where_clauses.append('`range` >= %s')
-        values.append(criteria['min_range'])
-    if 'max_range' in criteria and criteria['max_range'] is not None:
-        where_clauses.append('`range` <= %s')
-        values.append(criteria['max_range'])
-    
-    # Build query
-    query = 'SELECT id, class, damage, reload_speed, spread, `range` FROM weapon_class'
-    if where_clauses:
-        query += ' WHERE ' + ' AND '.join(where_clauses)
-    query += ' ORDER BY id'
-    
-    cursor.execute(query, values)
-    weapon_classes = cursor.fetchall()
-    cursor.close()
-    return weapon_classes
+def search(mysql, query, limit=None, after=None, fields=None):
+    # Search weapon classes in the reference snapshot with a filter Query
+    # (one keyset page when limit is given)
+    snapshot = reference.snapshot(mysql)
+    text_indexes = {'class': snapshot.text_index('weapon_class', 1)}
+    rows = FILTERS.select_rows(snapshot.weapon_classes, query, limit, after, text_indexes)
+    return [select_fields(row, COLUMNS, fields) for row in rows]
+
+
+def stream(mysql, query=None, fields=None):
+    # Yield weapon classes matching a filter Query (served from the reference snapshot)
+    yield from search(mysql, query or FILTERS.unfiltered(), fields=fields)
+
+
+def stats(mysql, query, group=None):
+    # Summarize weapon classes matching a filter Query in one pass over the
+    # reference snapshot (per group when group is given)
+    snapshot = reference.snapshot(mysql)
+    text_indexes = {'class': snapshot.text_index('weapon_class', 1)}
+    return STATS.aggregate(snapshot.weapon_classes, query, group, text_indexes)
@@ -0,0 +1,51 @@
+"""
+Rebuild the per-pilot and per-class ship summary tables from ship.
+
+Usage:
+    python repair_summaries.py          Recompute every summary row
+    python repair_summaries.py --check  List rows that differ; fail if any do
+
+The ship write functions keep the summaries current, so this is only needed
+after ships were changed outside the API (manual SQL, restores). Connection
+settings are read like run_migration.py's.
+"""
+import argparse
+import sys
+
+from dotenv import load_dotenv
+
+from models import summary
+from run_migration import connect
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Rebuild ship summary tables')
+    parser.add_argument('--check', action='store_true', help='list summary rows that differ from ship')
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    connection = connect()
+    cursor = connection.cursor()
+    try:
+        if args.check:
+            differences = summary.drift(cursor)
+            for entity, key, stored, actual in differences:
+                print(f'{entity} {key}: stored {stored}, actual {actual}')
+            print('Summaries match ship' if not differences
+                  else f'{len(differences)} summary row(s) differ')
+            return 1 if differences else 0
+
+        summary.rebuild(cursor)
+        connection.commit()
+        print('Summaries rebuilt')
+        return 0
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+        connection.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""
+Apply pending schema migrations from migrations/.
+
+Usage:
+    python run_migration.py             Apply every pending migration
+    python run_migration.py --to 1      Apply pending migrations up to version 1
+    python run_migration.py --status    List applied and pending migrations
+    python run_migration.py --check     EXPLAIN every indexed search; fail if one scans
+
+Connection settings come from the same MYSQL_* environment variables (or
+.env file) as the API. Import shiperd_final.sql first on a new database.
+"""
+import argparse
+import logging
+import os
+import sys
+
+import MySQLdb
+from dotenv import load_dotenv
+
+from utils.migrations import MigrationError, applied_versions, check_indexes, discover, migrate
+
+
+def connect():
+    return MySQLdb.connect(
+        host=os.getenv('MYSQL_HOST', 'localhost'),
+        port=int(os.getenv('MYSQL_PORT', 3306)),
+        user=os.getenv('MYSQL_USER', 'root'),
+        passwd=os.getenv('MYSQL_PASSWORD', 'vondev'),
+        db=os.getenv('MYSQL_DB', 'shiperd'),
+        charset='utf8',
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Apply schema migrations')
+    parser.add_argument('--to', type=int, help='highest version to apply')
+    parser.add_argument('--status', action='store_true', help='list applied and pending migrations')
+    parser.add_argument('--check', action='store_true', help='check that indexed searches use an index')
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    connection = connect()
+    try:
+        if args.status:
+            applied = applied_versions(connection)
+            for version, name, _ in discover():
+                print(f"{'applied' if version in applied else 'pending'}  {version:04d}_{name}")
+            return 0
+
+        if args.check:
+            failures = check_indexes(connection)
+            for description, sql, access_type, key in failures:
+                print(f'NO INDEX  {description}  (type={access_type}, key={key})\n    {sql}')
+            print('All indexed searches use an index' if not failures
+                  else f'{len(failures)} indexed search(es) scan the table')
+            return 1 if failures else 0
+
+        try:
+            applied = migrate(connection, target=args.to)
+        except MigrationError as e:
+            print(e, file=sys.stderr)
+            return 1
+        print(f'Applied {len(applied)} migration(s)' if applied else 'Database is up to date')
+        return 0
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -66,6 +66,15 @@ class TestBasicEndpoints:
         assert data['status'] == 'success'
         assert data['message'] == 'Database connection successful'
 
+    def test_database_connection_pool_stats(self, client):
+        """Test that pool statistics are reported"""
+        response = client.get('/api/test-db')
+        data = json.loads(response.data)
+        assert 'pool' in data
+        for key in ('in_use', 'idle', 'size', 'max_size', 'avg_wait_time'):
+            assert key in data['pool']
+        assert data['pool']['size'] <= data['pool']['max_size']
+
 
 class TestAuthentication:
     """Test authentication endpoints"""
@@ -750,6 +759,453 @@ class TestShipWeaponsEndpoints:
         assert response.status_code == 404
 
 
+class TestPagination:
+    """Test keyset pagination on list endpoints"""
+    
+    def test_limit_and_next_link(self, client):
+        """Test that limit caps the page and next continues after it"""
+        response = client.get('/api/ships?limit=2')
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert len(data['ships']) <= 2
+        assert 'next' in data
+        
+        if data['next']:
+            next_response = client.get(data['next'])
+            assert next_response.status_code == 200
+            next_data = json.loads(next_response.data)
+            first_ids = [s['id'] for s in data['ships']]
+            assert all(s['id'] > max(first_ids) for s in next_data['ships'])
+    
+    def test_pagination_with_search(self, client):
+        """Test that cursors work together with search filters"""
+        response = client.get('/api/ships?min_speed=1&limit=1')
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert len(data['ships']) <= 1
+        if data['next']:
+            assert 'min_speed=1' in data['next']
+    
+    def test_ship_weapons_composite_cursor(self, client):
+        """Test that ship weapons paginate on the composite key"""
+        response = client.get('/api/ship-weapons?limit=1')
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        if data['next']:
+            next_data = json.loads(client.get(data['next']).data)
+            first = data['ship_weapons'][0]
+            for row in next_data['ship_weapons']:
+                assert ((row['ship_id'], row['ship_class_id'], row['weapon_class_id']) >
+                        (first['ship_id'], first['ship_class_id'], first['weapon_class_id']))
+    
+    def test_invalid_cursor(self, client):
+        """Test that a malformed cursor is rejected"""
+        response = client.get('/api/pilots?after=not-a-cursor')
+        assert response.status_code == 400
+    
+    def test_invalid_limit(self, client):
+        """Test that an out-of-range limit is rejected"""
+        response = client.get('/api/pilots?limit=0')
+        assert response.status_code == 400
+
+
+class TestStreaming:
+    """Test streamed list responses"""
+    
+    def test_stream_ships_matches_full_list(self, client):
+        """Test that a streamed list parses as JSON and holds every row"""
+        response = client.get('/api/ships?stream=true')
+        assert response.status_code == 200
+        assert response.is_streamed
+        data = json.loads(response.data)
+        assert isinstance(data['ships'], list)
+        
+        paged = json.loads(client.get('/api/ships?limit=1000').data)
+        assert [s['id'] for s in data['ships']][:len(paged['ships'])] == [s['id'] for s in paged['ships']]
+    
+    def test_stream_with_search(self, client):
+        """Test that search filters apply to streamed results"""
+        response = client.get('/api/pilots?stream=true&min_flight_years=20')
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert all(p['flight_years'] >= 20 for p in data['pilots'])
+    
+    def test_stream_ship_weapons(self, client):
+        """Test streaming ship weapon assignments"""
+        response = client.get('/api/ship-weapons?stream=1')
+        assert response.status_code == 200
+        assert 'ship_weapons' in json.loads(response.data)
+    
+    def test_stream_xml(self, client):
+        """Test that XML can be streamed too"""
+        response = client.get('/api/pilots?stream=true&format=xml')
+        assert response.status_code == 200
+        assert response.mimetype == 'application/xml'
+        assert response.data.startswith(b'<?xml')
+        assert response.data.endswith(b'</pilots></response>')
+
+
+class TestSparseFieldsets:
+    """Test the fields= parameter on list and detail endpoints"""
+    
+    def test_list_returns_only_requested_fields(self, client):
+        """Test that only the requested columns (plus the key) are returned"""
+        response = client.get('/api/ships?fields=name')
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        for row in data['ships']:
+            assert set(row) == {'id', 'name'}
+    
+    def test_joined_field(self, client):
+        """Test that a joined column can be requested on its own"""
+        response = client.get('/api/ship-weapons?fields=weapon_class_name&limit=5')
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        for row in data['ship_weapons']:
+            assert set(row) == {'ship_id', 'ship_class_id', 'weapon_class_id', 'weapon_class_name'}
+    
+    def test_detail_fields(self, client):
+        """Test fields= on a detail endpoint"""
+        response = client.get('/api/ship-classes?limit=1')
+        ship_classes = json.loads(response.data)['ship_classes']
+        if ship_classes:
+            class_id = ship_classes[0]['id']
+            response = client.get(f'/api/ship-classes/{class_id}?fields=name')
+            assert response.status_code == 200
+            assert set(json.loads(response.data)['ship_class']) == {'id', 'name'}
+    
+    def test_unknown_field(self, client):
+        """Test that an unknown field name is rejected"""
+        response = client.get('/api/pilots?fields=name,password')
+        assert response.status_code == 400
+        data = json.loads(response.data)
+        assert 'password' in data['message']
+
+
+class TestMultiGet:
+    """Test fetching several records by id in one request"""
+    
+    def test_ids_with_not_found(self, client):
+        """Test that found records are returned in request order and the rest reported"""
+        response = client.get('/api/pilots?limit=2')
+        pilot_ids = [p['id'] for p in json.loads(response.data)['pilots']]
+        missing_id = 999999999
+        
+        ids = ','.join(str(i) for i in reversed(pilot_ids + [missing_id]))
+        response = client.get(f'/api/pilots?ids={ids}')
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert [p['id'] for p in data['pilots']] == list(reversed(pilot_ids))
+        assert data['not_found'] == [missing_id]
+    
+    def test_ship_weapons_keys(self, client):
+        """Test the composite-key batch lookup"""
+        response = client.get('/api/ship-weapons?limit=1')
+        rows = json.loads(response.data)['ship_weapons']
+        keys = [f"{r['ship_id']}-{r['ship_class_id']}-{r['weapon_class_id']}" for r in rows]
+        response = client.get('/api/ship-weapons?keys=' + ','.join(keys + ['999999-1-1']))
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert len(data['ship_weapons']) == len(rows)
+        assert data['not_found'] == [{'ship_id': 999999, 'ship_class_id': 1, 'weapon_class_id': 1}]
+    
+    def test_invalid_ids(self, client):
+        """Test that malformed or too many ids are rejected"""
+        assert client.get('/api/ships?ids=1,abc').status_code == 400
+        too_many = ','.join(str(i) for i in range(1, 1002))
+        assert client.get(f'/api/ships?ids={too_many}').status_code == 400
+        assert client.get('/api/ship-weapons?keys=1-2').status_code == 400
+
+
+class TestBulkCreate:
+    """Test creating many records in one request"""
+    
+    def test_bulk_create_pilots(self, client, auth_token):
+        """Test that every pilot is created and returned with its new id"""
+        items = [{
+            'name': f'Bulk Pilot {i}',
+            'flight_years': i,
+            'rank': 'Cadet',
+            'mission_success': i
+        } for i in range(5)]
+        
+        response = client.post('/api/pilots/bulk',
+                              json=items,
+                              headers={'Authorization': f'Bearer {auth_token}'})
+        assert response.status_code == 201
+        created = json.loads(response.data)['pilots']
+        assert [p['name'] for p in created] == [item['name'] for item in items]
+        
+        # Ids point at the rows that were actually written
+        for p in created:
+            response = client.get(f"/api/pilots/{p['id']}")
+            assert json.loads(response.data)['pilot']['name'] == p['name']
+            client.delete(f"/api/pilots/{p['id']}",
+                         headers={'Authorization': f'Bearer {auth_token}'})
+    
+    def test_bulk_create_is_all_or_nothing(self, client, auth_token):
+        """Test that one invalid item rejects the whole request"""
+        items = [
+            {'name': 'Bulk Valid', 'flight_years': 1, 'rank': 'Cadet', 'mission_success': 1},
+            {'name': 'Bulk Invalid', 'flight_years': -1, 'rank': 'Cadet', 'mission_success': 1}
+        ]
+        
+        response = client.post('/api/pilots/bulk',
+                              json=items,
+                              headers={'Authorization': f'Bearer {auth_token}'})
+        assert response.status_code == 400
+        data = json.loads(response.data)
+        assert [e['index'] for e in data['errors']] == [1]
+        
+        response = client.get('/api/pilots?name=Bulk Valid')
+        assert json.loads(response.data)['pilots'] == []
+    
+    def test_bulk_create_ships_missing_pilot(self, client, auth_token):
+        """Test that references are checked before anything is written"""
+        items = [{
+            'name': 'Bulk Ship',
+            'capacity': 10,
+            'speed': 100,
+            'shield': 50,
+            'ship_class_id': 1,
+            'pilot_id': 999999999
+        }]
+        
+        response = client.post('/api/ships/bulk',
+                              json=items,
+                              headers={'Authorization': f'Bearer {auth_token}'})
+        assert response.status_code == 400
+        assert json.loads(response.data)['errors'][0]['index'] == 0
+    
+    def test_bulk_create_requires_auth(self, client):
+        """Test that bulk create requires authentication"""
+        response = client.post('/api/weapon-classes/bulk', json=[])
+        assert response.status_code == 401
+
+
+class TestBulkUpdate:
+    """Test updating many records in one request"""
+    
+    def test_bulk_update_by_id(self, client, auth_token):
+        """Test per-id changes and the returned counts"""
+        headers = {'Authorization': f'Bearer {auth_token}'}
+        items = [{
+            'name': f'Bulk Update Pilot {i}',
+            'flight_years': 1,
+            'rank': 'Cadet',
+            'mission_success': 1
+        } for i in range(3)]
+        response = client.post('/api/pilots/bulk', json=items, headers=headers)
+        pilot_ids = [p['id'] for p in json.loads(response.data)['pilots']]
+        
+        updates = [{'id': pilot_id, 'changes': {'rank': 'Captain'}} for pilot_id in pilot_ids]
+        updates.append({'id': 999999999, 'changes': {'rank': 'Captain'}})
+        response = client.patch('/api/pilots/bulk', json=updates, headers=headers)
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data['updated'] == 3
+        assert data['not_found'] == 1
+        
+        for pilot_id in pilot_ids:
+            response = client.get(f'/api/pilots/{pilot_id}')
+            assert json.loads(response.data)['pilot']['rank'] == 'Captain'
+            client.delete(f'/api/pilots/{pilot_id}', headers=headers)
+    
+    def test_bulk_update_by_filter(self, client, auth_token):
+        """Test one change set applied to every matching record"""
+        headers = {'Authorization': f'Bearer {auth_token}'}
+        items = [{
+            'name': 'Bulk Filter Pilot',
+            'flight_years': 1,
+            'rank': 'Cadet',
+            'mission_success': 1
+        }] * 2
+        response = client.post('/api/pilots/bulk', json=items, headers=headers)
+        pilot_ids = [p['id'] for p in json.loads(response.data)['pilots']]
+        
+        response = client.patch('/api/pilots/bulk',
+                               json={'filter': {'name': 'Bulk Filter Pilot'},
+                                     'changes': {'mission_success': 7}},
+                               headers=headers)
+        assert response.status_code == 200
+        assert json.loads(response.data)['updated'] == 2
+        
+        for pilot_id in pilot_ids:
+            response = client.get(f'/api/pilots/{pilot_id}')
+            assert json.loads(response.data)['pilot']['mission_success'] == 7
+            client.delete(f'/api/pilots/{pilot_id}', headers=headers)
+    
+    def test_bulk_update_rejects_empty_filter(self, client, auth_token):
+        """Test that a filter matching every row is refused"""
+        response = client.patch('/api/ships/bulk',
+                               json={'filter': {}, 'changes': {'shield': 1}},
+                               headers={'Authorization': f'Bearer {auth_token}'})
+        assert response.status_code == 400
+
+
+class TestExpand:
+    """Test embedding related records"""
+    
+    def test_expand_ship_detail(self, client):
+        """Test that a ship embeds its pilot, class and weapons with their classes"""
+        ship_data = json.loads(client.get('/api/ships/1').data)['ship']
+        response = client.get('/api/ships/1?expand=pilot,ship_class,weapons.weapon_class')
+        assert response.status_code == 200
+        expanded = json.loads(response.data)['ship']
+        assert expanded['pilot']['id'] == ship_data['pilot_id']
+        assert expanded['ship_class']['name'] == ship_data['ship_class_name']
+        
+        weapons = json.loads(client.get('/api/ship-weapons/ship/1').data)['ship_weapons']
+        assert [w['weapon_class_id'] for w in expanded['weapons']] == [w['weapon_class_id'] for w in weapons]
+        for weapon in expanded['weapons']:
+            assert weapon['weapon_class']['id'] == weapon['weapon_class_id']
+    
+    def test_expand_list_with_fields(self, client):
+        """Test that expansion keeps the ids it needs in a sparse fieldset"""
+        response = client.get('/api/ships?limit=5&fields=name&expand=pilot')
+        assert response.status_code == 200
+        for ship_data in json.loads(response.data)['ships']:
+            assert ship_data['pilot']['id'] == ship_data['pilot_id']
+            assert 'speed' not in ship_data
+    
+    def test_invalid_expand(self, client):
+        """Test unknown paths and expand with streaming"""
+        assert client.get('/api/ships?expand=crew').status_code == 400
+        assert client.get('/api/ships/1?expand=weapons.crew').status_code == 400
+        assert client.get('/api/ships?expand=pilot&stream=true').status_code == 400
+
+
+class TestShipSummaries:
+    """Test the per-pilot and per-class ship summaries"""
+    
+    def summary(self, client, path):
+        return json.loads(client.get(path).data)['summary']
+    
+    def test_summaries_follow_ship_writes(self, client, auth_token):
+        """Test create, move between pilots and classes, and delete"""
+        headers = {'Authorization': f'Bearer {auth_token}'}
+        pilots = json.loads(client.get('/api/pilots?limit=2').data)['pilots']
+        classes = json.loads(client.get('/api/ship-classes?limit=2').data)['ship_classes']
+        first_pilot = f"/api/pilots/{pilots[0]['id']}/summary"
+        second_pilot = f"/api/pilots/{pilots[1]['id']}/summary"
+        first_class = f"/api/ship-classes/{classes[0]['id']}/summary"
+        second_class = f"/api/ship-classes/{classes[1]['id']}/summary"
+        before = {path: self.summary(client, path)
+                  for path in (first_pilot, second_pilot, first_class, second_class)}
+        
+        response = client.post('/api/ships', json={
+            'name': 'Summary Test Ship',
+            'capacity': 70,
+            'speed': 100,
+            'shield': 30,
+            'ship_class_id': classes[0]['id'],
+            'pilot_id': pilots[0]['id']
+        }, headers=headers)
+        ship_id = json.loads(response.data)['ship']['id']
+        after = self.summary(client, first_pilot)
+        assert after['ship_count'] == before[first_pilot]['ship_count'] + 1
+        assert after['total_capacity'] == before[first_pilot]['total_capacity'] + 70
+        assert after['total_shield'] == before[first_pilot]['total_shield'] + 30
+        
+        client.put(f'/api/ships/{ship_id}', json={
+            'pilot_id': pilots[1]['id'],
+            'ship_class_id': classes[1]['id'],
+            'capacity': 90
+        }, headers=headers)
+        assert self.summary(client, first_pilot) == before[first_pilot]
+        assert self.summary(client, first_class) == before[first_class]
+        after = self.summary(client, second_class)
+        assert after['ship_count'] == before[second_class]['ship_count'] + 1
+        assert after['total_capacity'] == before[second_class]['total_capacity'] + 90
+        
+        client.delete(f'/api/ships/{ship_id}', headers=headers)
+        assert self.summary(client, second_pilot) == before[second_pilot]
+        assert self.summary(client, second_class) == before[second_class]
+    
+    def test_summary_not_found(self, client):
+        """Test that an unknown pilot or class returns 404"""
+        assert client.get('/api/pilots/999999999/summary').status_code == 404
+        assert client.get('/api/ship-classes/999999999/summary').status_code == 404
+
+
+class TestStatistics:
+    """Test grouped statistics endpoints"""
+    
+    def test_ship_stats_agree_with_list(self, client):
+        """Test per-class counts and ranges against the ship list"""
+        ships = json.loads(client.get('/api/ships?stream=1').data)['ships']
+        response = client.get('/api/stats/ships?group_by=ship_class_id')
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data['group_by'] == 'ship_class_id'
+        for group in data['groups']:
+            speeds = [s['speed'] for s in ships if s['ship_class_id'] == group['ship_class_id']]
+            assert group['count'] == len(speeds)
+            assert group['speed']['min'] == min(speeds)
+            assert group['speed']['max'] == max(speeds)
+            assert group['speed']['sum'] == sum(speeds)
+        assert sum(group['count'] for group in data['groups']) == len(ships)
+    
+    def test_ship_stats_with_filter(self, client):
+        """Test that list filters narrow the summarized rows"""
+        response = client.get('/api/stats/ships?min_speed=1000000')
+        data = json.loads(response.data)
+        assert data['groups'] == [{
+            'count': 0,
+            **{name: {'sum': None, 'min': None, 'max': None, 'mean': None, 'stddev': None}
+               for name in ('capacity', 'speed', 'shield')}
+        }]
+    
+    def test_weapon_class_stats(self, client):
+        """Test the in-memory summary of weapon classes"""
+        weapons = json.loads(client.get('/api/weapon-classes?stream=1').data)['weapon_classes']
+        data = json.loads(client.get('/api/stats/weapon-classes').data)
+        assert data['groups'][0]['count'] == len(weapons)
+        assert data['groups'][0]['damage']['max'] == max(w['damage'] for w in weapons)
+    
+    def test_invalid_group_by(self, client):
+        """Test that an unknown group_by is rejected"""
+        assert client.get('/api/stats/ships?group_by=name').status_code == 400
+        assert client.get('/api/stats/weapon-classes?group_by=pilot_id').status_code == 400
+
+
+class TestAutocomplete:
+    """Test name suggestions"""
+    
+    def test_suggestions_follow_writes(self, client, auth_token):
+        """Test that created, renamed and deleted pilots show up immediately"""
+        headers = {'Authorization': f'Bearer {auth_token}'}
+        response = client.post('/api/pilots', json={
+            'name': 'Zyxquor Autocomplete',
+            'flight_years': 1,
+            'rank': 'Cadet',
+            'mission_success': 1
+        }, headers=headers)
+        pilot_id = json.loads(response.data)['pilot']['id']
+        
+        response = client.get('/api/autocomplete?entity=pilots&q=zyxq')
+        assert response.status_code == 200
+        assert {'id': pilot_id, 'name': 'Zyxquor Autocomplete'} in json.loads(response.data)['suggestions']
+        # A word later in the name, and a typo
+        response = client.get('/api/autocomplete?entity=pilots&q=autocompelte')
+        assert pilot_id in [s['id'] for s in json.loads(response.data)['suggestions']]
+        
+        client.put(f'/api/pilots/{pilot_id}', json={'name': 'Qwvzor Autocomplete'}, headers=headers)
+        response = client.get('/api/autocomplete?entity=pilots&q=zyxq')
+        assert pilot_id not in [s['id'] for s in json.loads(response.data)['suggestions']]
+        
+        client.delete(f'/api/pilots/{pilot_id}', headers=headers)
+        response = client.get('/api/autocomplete?entity=pilots&q=qwvz')
+        assert pilot_id not in [s['id'] for s in json.loads(response.data)['suggestions']]
+    
+    def test_invalid_arguments(self, client):
+        """Test unknown entity, missing q and out-of-range limit"""
+        assert client.get('/api/autocomplete?entity=users&q=a').status_code == 400
+        assert client.get('/api/autocomplete?entity=ships').status_code == 400
+        assert client.get('/api/autocomplete?entity=ships&q=a&limit=0').status_code == 400
+        assert client.get('/api/autocomplete?entity=ships&q=a&limit=x').status_code == 400
+
+
 class TestDataValidation:
     """Test data validation rules"""
     
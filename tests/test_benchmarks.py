@@ -0,0 +1,206 @@
+"""
+Serialization benchmarks
+
+These build large synthetic payloads in memory and compare our writers with
+the libraries they replace. The timed benchmarks take about a minute and
+their speed ratios depend on the machine, so they only run with
+RUN_BENCHMARKS=1; row counts can be lowered with BENCHMARK_ROWS. The checks
+that the outputs agree run on a small payload in the normal suite.
+"""
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import json
+import random
+import time
+import pytest
+from flask import Flask
+
+from utils.autocomplete import NameIndex
+from utils.encoders import Rows
+from utils.formatters import format_response, json_response
+from utils.xml_writer import to_xml
+
+BENCHMARK_ROWS = int(os.getenv('BENCHMARK_ROWS', 100000))
+
+# Rows of the payloads the output checks run on
+SMALL_ROWS = 200
+
+benchmark = pytest.mark.skipif(not os.getenv('RUN_BENCHMARKS'), reason='set RUN_BENCHMARKS=1 to run benchmarks')
+
+SHIP_COLUMNS = ['id', 'name', 'capacity', 'speed', 'shield', 'ship_class_id', 'ship_class_name', 'pilot_id', 'pilot_name']
+
+
+def make_ships(count):
+    """Build a ships list shaped like the /api/ships payload"""
+    classes = ['corvette', 'hauler', 'fighter', 'cruise', 'tank']
+    return [
+        dict(zip(SHIP_COLUMNS, (
+            i, f'Ship {i} & Co', 100 + i % 400, 250 + i % 500, 100 + i % 200,
+            i % 5 + 1, classes[i % 5], i % 6 + 1, None if i % 50 == 0 else f'Pilot {i % 6}'
+        )))
+        for i in range(1, count + 1)
+    ]
+
+
+def best_of(func, runs=3):
+    """Best wall time of several runs"""
+    best = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+class TestXmlBenchmark:
+    """Benchmark the XML writer against dicttoxml"""
+
+    def test_xml_writer_matches_dicttoxml(self):
+        """Test that the XML writer's output equals dicttoxml's on a ships list"""
+        dicttoxml = pytest.importorskip('dicttoxml')
+        payload = {'ships': make_ships(SMALL_ROWS), 'next': None}
+        assert to_xml(payload) == dicttoxml.dicttoxml(payload, custom_root='response', attr_type=False)
+
+    @benchmark
+    def test_xml_writer_faster_than_dicttoxml(self):
+        """Test that the XML writer is several times faster on a large ships list"""
+        dicttoxml = pytest.importorskip('dicttoxml')
+        payload = {'ships': make_ships(BENCHMARK_ROWS), 'next': None}
+
+        writer_time, writer_xml = best_of(lambda: to_xml(payload))
+        dicttoxml_time, dicttoxml_xml = best_of(
+            lambda: dicttoxml.dicttoxml(payload, custom_root='response', attr_type=False), runs=1)
+
+        print(f'\nXML {BENCHMARK_ROWS} rows: writer {writer_time:.3f}s, '
+              f'dicttoxml {dicttoxml_time:.3f}s ({dicttoxml_time / writer_time:.1f}x)')
+        assert writer_xml == dicttoxml_xml
+        assert dicttoxml_time / writer_time >= 5
+
+
+class TestJsonEncoderBenchmark:
+    """Benchmark the precompiled row encoders against jsonify"""
+
+    def test_row_encoder_matches_jsonify(self):
+        """Test that encoding row tuples decodes to what jsonify of row dicts does"""
+        rows = [tuple(ship.values()) for ship in make_ships(SMALL_ROWS)]
+        app = Flask(__name__)
+
+        with app.app_context():
+            encoded = json_response({'ships': Rows(rows, SHIP_COLUMNS), 'next': None}).get_data()
+            jsonified = app.json.response({'ships': [dict(zip(SHIP_COLUMNS, row)) for row in rows],
+                                           'next': None}).get_data()
+        assert json.loads(encoded) == json.loads(jsonified)
+
+    @benchmark
+    def test_row_encoder_faster_than_jsonify(self):
+        """Test that encoding row tuples beats building dicts for jsonify"""
+        rows = [tuple(ship.values()) for ship in make_ships(BENCHMARK_ROWS)]
+        app = Flask(__name__)
+
+        with app.app_context():
+            encoder_time, encoded = best_of(
+                lambda: json_response({'ships': Rows(rows, SHIP_COLUMNS), 'next': None}).get_data(), runs=5)
+            jsonify_time, jsonified = best_of(
+                lambda: app.json.response({'ships': [dict(zip(SHIP_COLUMNS, row)) for row in rows],
+                                           'next': None}).get_data(), runs=5)
+
+        print(f'\nJSON {BENCHMARK_ROWS} rows: encoder {encoder_time:.3f}s, '
+              f'jsonify {jsonify_time:.3f}s ({jsonify_time / encoder_time:.1f}x)')
+        assert json.loads(encoded) == json.loads(jsonified)
+        assert jsonify_time / encoder_time >= 1.1
+
+
+class TestBinaryFormatBenchmark:
+    """Compare the binary response formats with JSON on a large ships list"""
+
+    def test_binary_formats_round_trip(self):
+        """Test that MessagePack and CBOR bodies decode to the JSON body's data"""
+        msgpack = pytest.importorskip('msgpack')
+        cbor2 = pytest.importorskip('cbor2')
+        rows = [tuple(ship.values()) for ship in make_ships(SMALL_ROWS)]
+        app = Flask(__name__)
+        decoders = {'json': json.loads, 'msgpack': msgpack.unpackb, 'cbor': cbor2.loads}
+
+        decoded = {}
+        for name, decode in decoders.items():
+            with app.test_request_context(f'/?format={name}'):
+                body = format_response({'ships': Rows(rows, SHIP_COLUMNS), 'next': None}).get_data()
+            decoded[name] = decode(body)
+        assert decoded['msgpack'] == decoded['json'] == decoded['cbor']
+        assert len(decoded['json']['ships']) == SMALL_ROWS
+
+    @benchmark
+    def test_binary_formats_smaller_than_json(self):
+        """Test payload size and encode/decode time of MessagePack and CBOR against JSON"""
+        msgpack = pytest.importorskip('msgpack')
+        cbor2 = pytest.importorskip('cbor2')
+        rows = [tuple(ship.values()) for ship in make_ships(BENCHMARK_ROWS)]
+        app = Flask(__name__)
+        decoders = {'json': json.loads, 'msgpack': msgpack.unpackb, 'cbor': cbor2.loads}
+
+        results = {}
+        for name, decode in decoders.items():
+            with app.test_request_context(f'/?format={name}'):
+                encode_time, body = best_of(
+                    lambda: format_response({'ships': Rows(rows, SHIP_COLUMNS), 'next': None}).get_data())
+            decode_time, data = best_of(lambda: decode(body))
+            results[name] = (len(body), encode_time, decode_time)
+            assert len(data['ships']) == BENCHMARK_ROWS
+
+        print(f'\nShips list, {BENCHMARK_ROWS} rows:')
+        for name, (size, encode_time, decode_time) in results.items():
+            print(f'  {name:8} {size / 1e6:6.2f} MB  encode {encode_time:.3f}s  decode {decode_time:.3f}s')
+        assert results['msgpack'][0] < results['json'][0]
+        assert results['cbor'][0] < results['json'][0]
+
+
+class TestColumnarBenchmark:
+    """Compare the columnar format with row JSON on a large ships list"""
+
+    @benchmark
+    def test_columnar_smaller_and_faster_to_decode(self):
+        """Test that columnar bodies are much smaller and parse faster than row JSON"""
+        rows = [tuple(ship.values()) for ship in make_ships(BENCHMARK_ROWS)]
+        app = Flask(__name__)
+
+        results = {}
+        for name in ('json', 'columnar'):
+            with app.test_request_context(f'/?format={name}'):
+                encode_time, body = best_of(
+                    lambda: format_response({'ships': Rows(rows, SHIP_COLUMNS), 'next': None}).get_data())
+            decode_time, _ = best_of(lambda: json.loads(body))
+            results[name] = (len(body), encode_time, decode_time)
+
+        print(f'\nShips list, {BENCHMARK_ROWS} rows:')
+        for name, (size, encode_time, decode_time) in results.items():
+            print(f'  {name:8} {size / 1e6:6.2f} MB  encode {encode_time:.3f}s  decode {decode_time:.3f}s')
+        assert results['columnar'][0] * 2 < results['json'][0]
+        assert results['columnar'][2] * 2 < results['json'][2]
+
+
+class TestAutocompleteBenchmark:
+    """Benchmark name suggestions against a large index"""
+
+    @benchmark
+    def test_suggestions_under_a_millisecond(self):
+        """Test that prefix and typo lookups each take well under a millisecond"""
+        rng = random.Random(1)
+        syllables = ['ka', 'ro', 'zen', 'tar', 'vo', 'li', 'mu', 'sha', 'der', 'ix', 'qu', 'bel']
+
+        def make_name():
+            return ' '.join(''.join(rng.choice(syllables) for _ in range(rng.randint(2, 4))).capitalize()
+                            for _ in range(rng.randint(1, 3)))
+
+        index = NameIndex((i, make_name()) for i in range(1, BENCHMARK_ROWS * 10 + 1))
+        terms = ['ka', 'karoz', 'kxro', 'kraoz', 'zentxr vo', 'sha mu']
+
+        lookup_time, _ = best_of(lambda: [index.suggest(term) for _ in range(100) for term in terms])
+        per_lookup = lookup_time / (100 * len(terms))
+
+        print(f'\nAutocomplete {len(index)} names: {per_lookup * 1e6:.0f}us per lookup')
+        assert index.suggest('karoz')
+        assert per_lookup < 0.001
+
@@ -0,0 +1,233 @@
+"""
+Per-request query budgets for the write endpoints.
+
+Each write handler is run against a scripted connection that counts the
+statements it receives, so an extra existence check or re-read shows up as
+a failing budget rather than as a slow endpoint.
+"""
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from app import app, mysql
+from models import reference
+from utils import bulk
+from utils.auth import generate_token
+from utils.cache import entity_cache
+from utils.response_cache import response_cache
+
+
+class ScriptedConnection:
+    """Connection stand-in that records statements and answers from in-memory rows"""
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.statements = []
+        self.rowcount = 0
+        self.lastrowid = None
+        self._rows = []
+
+    def cursor(self, *args):
+        return self
+
+    def _matching(self, table, query, values):
+        # Rows selected by the WHERE clause: one or more ids, or a ship weapon key
+        # (or the weapons of several ships)
+        where = query.split(' WHERE ', 1)[1]
+        params = list(values[len(values) - where.count('%s'):])
+        if table == 'ship_weapons' and 'sw.ship_id IN (' in where:
+            return [row for row in self.tables[table] if row[0] in params]
+        if table == 'ship_weapons':
+            return [row for row in self.tables[table] if tuple(row[:len(params)]) == tuple(params)]
+        ids = params if ' IN (' in where else params[:1]
+        return [row for row in self.tables[table] if row[0] in ids]
+
+    def execute(self, query, values=()):
+        query = ' '.join(query.split())
+        self.statements.append(query)
+        verb = query.split()[0]
+        self._rows = []
+        if verb == 'INSERT':
+            self.lastrowid = 1000
+            self.rowcount = query.count('(%s')
+        elif verb == 'UPDATE':
+            self.rowcount = len(self._matching(query.split()[1], query, values))
+        elif verb == 'DELETE':
+            self.rowcount = len(self._matching(query.split()[2], query, values))
+        else:
+            table = query.split(' FROM ')[1].split()[0]
+            if table == 'users':
+                # Registration: nothing is taken, and the new user reads back
+                self._rows = [(0, 0)] if 'MAX(' in query else [(values[0], 'new', 'new@example.com', None)]
+                return
+            rows = self._matching(table, query, values) if ' WHERE ' in query else list(self.tables[table])
+            if 'pilot_name' in query:
+                pilots = {row[0]: row[1] for row in self.tables['pilot']}
+                rows = [tuple(row) + (pilots.get(row[6]),) for row in rows]
+            self._rows = rows
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """Scripted connection handed out by the pool, with the snapshot loaded"""
+    conn = ScriptedConnection({
+        'pilot': [(1, 'Jo', 3, 'Ace', 90)],
+        'ship': [(1, 'Enterprise', 10, 100, 50, 1, 1)],
+        'ship_class': [(1, 'Frigate', None)],
+        'weapon_class': [(1, 'Laser', 10, 1, 1, 1)],
+        'ship_weapons': [(1, 1, 1, 'Main gun')],
+    })
+    monkeypatch.setattr(mysql.pool, 'checkout', lambda: conn)
+    monkeypatch.setattr(mysql.pool, 'checkin', lambda c, discard=False: None)
+    monkeypatch.setattr(bulk, '_consecutive_ids', True)
+    entity_cache.clear()
+    response_cache.clear()
+    with app.app_context():
+        reference.load(mysql)
+    conn.statements.clear()
+    return conn
+
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+
+@pytest.fixture
+def headers():
+    return {'Authorization': f"Bearer {generate_token(1, 'tester')}"}
+
+
+PILOT = {'name': 'Al', 'flight_years': 1, 'rank': 'Cadet', 'mission_success': 5}
+SHIP = {'name': 'Nova', 'capacity': 5, 'speed': 200, 'shield': 30, 'ship_class_id': 1, 'pilot_id': 1}
+
+
+@pytest.mark.parametrize('method, path, body, status, budget', [
+    # Creates: one INSERT, plus one cold entity cache lookup for an embedded name;
+    # a ship also adds itself to its pilot's and class's summary rows
+    ('post', '/api/pilots', PILOT, 201, 1),
+    ('post', '/api/ships', SHIP, 201, 4),
+    ('post', '/api/ship-classes', {'name': 'Corvette'}, 201, 1),
+    ('post', '/api/weapon-classes',
+     {'class': 'Rail', 'damage': 1, 'reload_speed': 1, 'spread': 1, 'range': 1}, 201, 1),
+    ('post', '/api/ship-weapons',
+     {'ship_id': 1, 'ship_class_id': 1, 'weapon_class_id': 1, 'name': 'Aft gun'}, 201, 2),
+    # Updates: existence from the UPDATE, read back only columns not written
+    ('put', '/api/pilots/1', {'rank': 'Captain'}, 200, 2),
+    ('put', '/api/pilots/1', PILOT, 200, 1),
+    ('put', '/api/pilots/99', {'rank': 'Captain'}, 404, 1),
+    ('put', '/api/ships/1', {'speed': 300}, 200, 3),
+    # Changes to summarized columns: locked read of the old row instead of a read back
+    ('put', '/api/ships/1', {'capacity': 20}, 200, 5),
+    ('put', '/api/ship-classes/1', {'description': 'Escort'}, 200, 2),
+    ('put', '/api/ship-classes/1', {'name': 'Frigate', 'description': 'Escort'}, 200, 1),
+    ('put', '/api/ship-classes/99', {'description': 'Escort'}, 404, 1),
+    ('put', '/api/weapon-classes/1', {'damage': 20}, 200, 2),
+    # Deletes: existence from the DELETE
+    ('delete', '/api/pilots/1', None, 200, 1),
+    ('delete', '/api/pilots/99', None, 404, 1),
+    ('delete', '/api/ships/1', None, 200, 3),
+    ('delete', '/api/ship-classes/1', None, 200, 1),
+    ('delete', '/api/weapon-classes/1', None, 200, 1),
+    ('delete', '/api/ship-weapons/1/1/1', None, 200, 1),
+    # Bulk: one statement per batch or per distinct change set
+    ('post', '/api/pilots/bulk', [PILOT] * 3, 201, 1),
+    ('patch', '/api/ships/bulk', [{'id': 1, 'changes': {'speed': 1}}, {'id': 2, 'changes': {'speed': 1}}], 200, 1),
+])
+def test_write_query_budget(db, client, headers, method, path, body, status, budget):
+    """Test that each write handler stays within its statement budget"""
+    response = getattr(client, method)(path, json=body, headers=headers)
+    assert response.status_code == status, response.get_json()
+    assert len(db.statements) <= budget, db.statements
+
+
+def test_update_response_built_without_reread(db, client, headers):
+    """Test that a response built from the input carries every column"""
+    response = client.put('/api/ships/1', json=SHIP, headers=headers)
+    ship = response.get_json()['ship']
+    assert ship == dict(SHIP, id=1, ship_class_name='Frigate', pilot_name='Jo')
+    # The summary deltas lock and read the old row first; nothing is read after the UPDATE
+    update = next(i for i, statement in enumerate(db.statements) if statement.startswith('UPDATE ship'))
+    assert not any(statement.startswith('SELECT') and 'FROM ship ' in statement
+                   for statement in db.statements[update:])
+
+
+def test_class_update_patches_snapshot(db, client, headers):
+    """Test that a full class update is visible to reads without reloading the snapshot"""
+    client.put('/api/ship-classes/1', json={'name': 'Frigate', 'description': 'Escort'}, headers=headers)
+    response = client.get('/api/ship-classes/1')
+    assert response.get_json()['ship_class'] == {'id': 1, 'name': 'Frigate', 'description': 'Escort'}
+    assert len(db.statements) == 1, db.statements
+
+
+def test_partial_class_update_reads_row_back(db, client, headers):
+    """Test that a partial class update returns the stored row, not the snapshot's"""
+    # Renamed by another process since the snapshot was loaded; the row as
+    # stored once this update commits
+    db.tables['ship_class'] = [(1, 'Sloop', 'Escort')]
+    response = client.put('/api/ship-classes/1', json={'description': 'Escort'}, headers=headers)
+    assert response.get_json()['ship_class'] == {'id': 1, 'name': 'Sloop', 'description': 'Escort'}
+    assert client.get('/api/ship-classes/1').get_json()['ship_class']['name'] == 'Sloop'
+
+
+def test_register_query_budget(db, client):
+    """Test that registration checks username and email with one query"""
+    response = client.post('/api/auth/register',
+                           json={'username': 'newuser', 'email': 'new@example.com', 'password': 'secret1'})
+    assert response.status_code == 201
+    assert len(db.statements) <= 3, db.statements
+
+
+def test_expand_query_budget(db, client):
+    """Test that expanding every relation costs the same queries for any page size"""
+    db.tables['pilot'].append((2, 'Max', 5, 'Ace', 80))
+    db.tables['ship'] = [(ship_id, f'Ship {ship_id}', 10, 100, 50, 1, ship_id % 2 + 1)
+                         for ship_id in range(1, 41)]
+    db.tables['ship_weapons'] = [(ship_id, 1, 1, 'Main gun') for ship_id in range(1, 41, 3)]
+    
+    response = client.get('/api/ships?limit=30&expand=pilot,ship_class,weapons.weapon_class')
+    assert response.status_code == 200, response.get_json()
+    ships = response.get_json()['ships']
+    assert len(ships) == 30
+    assert ships[0]['pilot']['name'] == 'Max'
+    assert ships[0]['ship_class'] == {'id': 1, 'name': 'Frigate', 'description': None}
+    assert ships[0]['weapons'][0]['weapon_class']['class'] == 'Laser'
+    assert ships[1]['weapons'] == []
+    # The page, one IN query for the pilots and one for the weapons; classes
+    # come from the reference snapshot
+    assert len(db.statements) == 3, db.statements
+
+
+
+def test_cached_get_skips_database(db, client, headers):
+    """Test that a repeat GET is served without queries until a write touches its tables"""
+    first = client.get('/api/pilots')
+    assert first.status_code == 200
+    statements = len(db.statements)
+    assert statements >= 1
+    assert client.get('/api/pilots').data == first.data
+    assert len(db.statements) == statements, db.statements
+    
+    client.put('/api/pilots/1', json=PILOT, headers=headers)
+    statements = len(db.statements)
+    client.get('/api/pilots')
+    assert len(db.statements) > statements, db.statements
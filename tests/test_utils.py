@@ -0,0 +1,1729 @@
+"""
+Unit tests for utility modules that do not need a running database
+"""
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import datetime
+import decimal
+import json
+import re
+import threading
+import time
+import types
+import zlib
+from contextlib import contextmanager
+import pytest
+from flask import Flask, Response, request
+
+from models import autocomplete, pilot, reference, ship, ship_class, summary, weapon_class
+from utils import bulk
+from utils import compression as compression_module
+from utils.autocomplete import NameIndex
+from utils.bulk import insert_many, update_grouped
+from utils.columnar import iter_columnar_rows
+from utils.compression import Compression
+from utils.cache import EntityCache, MISSING
+from utils.db_pool import ConnectionPool, PoolTimeoutError
+from utils.encoders import Row, Rows, row_encoder
+from utils.etag import conditional
+from utils.expand import Relation, expand_rows, parse_expand, required_fields
+from utils.fields import Projection, parse_fields
+from utils.filters import Field, FilterSpec
+from utils.formatters import format_response
+from utils.migrations import MigrationError, _index_checks, discover, migrate, split_statements
+from utils.multiget import parse_ids, parse_keys
+from utils.pagination import encode_cursor, decode_cursor, paginate
+from utils.response_cache import ResponseCache
+from utils.statements import PreparedConnection, StatementStats, normalize, server_text
+from utils.stats import StatsSpec
+from utils.streaming import iter_json_rows, start_stream
+from utils.textsearch import (FulltextSettings, InvertedIndex, boolean_query, matches, relevance,
+                              relevance_patterns, tokenize)
+from utils.validators import validate_bulk_data, validate_bulk_update_data, validate_pilot_data
+from utils.versions import TableVersions
+from utils.xml_writer import to_xml, iter_xml_rows
+
+
+class FakeConnection:
+    """Minimal stand-in for a MySQLdb connection"""
+
+    def __init__(self):
+        self.closed = False
+        self.healthy = True
+        self.rollbacks = 0
+
+    def ping(self):
+        if not self.healthy:
+            raise Exception('server has gone away')
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+class FakeMySQL:
+    """Stand-in for PooledMySQL that answers queries from in-memory tables"""
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.queries = []
+        self.connection = self
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, values=None):
+        self.queries.append(query)
+        table = query.split('FROM ')[1].split()[0]
+        self._rows = list(self.tables[table])
+
+    def fetchall(self):
+        return self._rows
+
+    def close(self):
+        pass
+
+    @contextmanager
+    def server_side_cursor(self):
+        yield self
+
+
+class FakePilotMySQL:
+    """Stand-in for PooledMySQL serving pilot rows by id and applying renames"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.connection = self
+        self.rowcount = 0
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, values=None):
+        pilot_id = values[-1]
+        self._row = self.rows.get(pilot_id)
+        if query.startswith('UPDATE'):
+            self.rowcount = int(self._row is not None)
+            if self._row is not None:
+                self.rows[pilot_id] = self._row[:1] + (values[0],) + self._row[2:]
+
+    def fetchone(self):
+        return self._row
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def make_pool(**kwargs):
+    pool = ConnectionPool({}, **kwargs)
+    pool._connect = lambda: FakeConnection()
+    return pool
+
+
+class TestConnectionPool:
+    """Test connection pool sizing, health checks and stats"""
+
+    def test_warmup_opens_min_size(self):
+        """Test that warmup pre-opens min_size connections"""
+        pool = make_pool(min_size=3, max_size=5)
+        pool.warmup()
+        stats = pool.stats()
+        assert stats['size'] == 3
+        assert stats['idle'] == 3
+        assert stats['in_use'] == 0
+
+    def test_checkout_reuses_connections(self):
+        """Test that a returned connection is handed out again"""
+        pool = make_pool(min_size=0, max_size=2)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        assert pool.checkout() is conn
+        assert conn.rollbacks == 1
+
+    def test_checkout_timeout_when_exhausted(self):
+        """Test that checkout gives up after the timeout"""
+        pool = make_pool(min_size=0, max_size=1, timeout=0.05)
+        pool.checkout()
+        with pytest.raises(PoolTimeoutError):
+            pool.checkout()
+        assert pool.stats()['timeouts'] == 1
+
+    def test_waiter_gets_released_connection(self):
+        """Test that a waiting checkout receives a connection checked in by another thread"""
+        pool = make_pool(min_size=0, max_size=1, timeout=2)
+        conn = pool.checkout()
+        threading.Timer(0.05, pool.checkin, args=(conn,)).start()
+        assert pool.checkout() is conn
+        stats = pool.stats()
+        assert stats['waits'] == 1
+        assert stats['max_wait_time'] > 0
+
+    def test_unhealthy_connection_replaced(self):
+        """Test that a connection failing its health check is discarded"""
+        pool = make_pool(min_size=0, max_size=1, ping_interval=0)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        conn.healthy = False
+        replacement = pool.checkout()
+        assert replacement is not conn
+        assert conn.closed
+        assert pool.stats()['health_check_failures'] == 1
+
+    def test_idle_connections_reaped(self):
+        """Test that idle connections above min_size are closed"""
+        pool = make_pool(min_size=1, max_size=3, idle_timeout=0.01)
+        conns = [pool.checkout() for _ in range(3)]
+        for conn in conns:
+            pool.checkin(conn)
+        time.sleep(0.02)
+        pool.checkin(pool.checkout())
+        stats = pool.stats()
+        assert stats['size'] == 1
+        assert stats['reaped'] == 2
+
+    def test_reaped_connections_closed_outside_lock(self):
+        """Test that closing a reaped connection does not hold the pool lock"""
+        pool = make_pool(min_size=0, max_size=2, idle_timeout=0.01)
+        lock_free = []
+
+        def try_lock():
+            acquired = pool._cond.acquire(timeout=1)
+            if acquired:
+                pool._cond.release()
+            lock_free.append(acquired)
+
+        def close():
+            # Another thread must be able to take the lock while this runs
+            waiter = threading.Thread(target=try_lock)
+            waiter.start()
+            waiter.join()
+
+        conn = pool.checkout()
+        conn.close = close
+        pool.checkin(conn)
+        time.sleep(0.02)
+        pool.checkout()
+        assert lock_free == [True]
+
+
+class TestPaginationCursors:
+    """Test keyset cursor encoding and page trimming"""
+
+    def test_cursor_round_trip(self):
+        """Test that a composite key survives encoding"""
+        token = encode_cursor((3, 7, 1))
+        assert decode_cursor(token, key_size=3) == (3, 7, 1)
+
+    def test_cursor_rejects_garbage(self):
+        """Test that malformed or mis-sized cursors raise ValueError"""
+        with pytest.raises(ValueError):
+            decode_cursor('not-a-cursor')
+        with pytest.raises(ValueError):
+            decode_cursor(encode_cursor((1, 2)), key_size=1)
+        with pytest.raises(ValueError):
+            decode_cursor(encode_cursor(('x',)))
+
+    def test_paginate_detects_next_page(self):
+        """Test that the lookahead row produces a cursor for the last kept row"""
+        rows = [(1,), (2,), (3,)]
+        page, cursor = paginate(rows, 2, lambda row: (row[0],))
+        assert page == [(1,), (2,)]
+        assert decode_cursor(cursor) == (2,)
+
+        page, cursor = paginate(rows, 3, lambda row: (row[0],))
+        assert len(page) == 3
+        assert cursor is None
+
+
+class TestStreaming:
+    """Test chunked JSON generation"""
+
+    def test_chunks_form_valid_json(self):
+        """Test that the concatenated chunks parse to the expected rows"""
+        rows = [(i, f'ship {i}') for i in range(450)]
+        chunks = list(iter_json_rows('ships', iter(rows), ['id', 'name']))
+        assert len(chunks) > 3
+        data = json.loads(''.join(chunks))
+        assert data['ships'][0] == {'id': 0, 'name': 'ship 0'}
+        assert len(data['ships']) == 450
+
+    def test_empty_stream(self):
+        """Test that an empty result is still a valid document"""
+        chunks = iter_json_rows('ships', start_stream(iter(())), ['id'])
+        assert json.loads(''.join(chunks)) == {'ships': []}
+
+    def test_start_stream_runs_query_eagerly(self):
+        """Test that priming raises query errors before the response starts"""
+        def failing_rows():
+            raise RuntimeError('query failed')
+            yield
+
+        with pytest.raises(RuntimeError):
+            start_stream(failing_rows())
+
+
+class TestXmlWriter:
+    """Test that the XML writer matches the dicttoxml layout"""
+
+    def test_matches_dicttoxml(self):
+        """Test escaping, nulls, booleans, nesting and invalid keys against dicttoxml"""
+        dicttoxml = pytest.importorskip('dicttoxml')
+        data = {
+            'ships': [
+                {'id': 1, 'name': 'A & <B> "q" \'s', 'pilot_name': None, 'active': True},
+                {'id': 2, 'name': 'Lars', 'pilot_name': 'Jophil', 'active': False},
+            ],
+            'next': None,
+            'meta': {'count': 2, 'ids': [1, 2], 'ratio': 0.5},
+            '1 bad key': 'x',
+            'empty': [],
+        }
+        expected = dicttoxml.dicttoxml(data, custom_root='response', attr_type=False)
+        assert to_xml(data) == expected
+
+    def test_row_stream_matches_buffered(self):
+        """Test that streaming row tuples gives the same document as the buffered writer"""
+        columns = ['id', 'name', 'description']
+        rows = [(i, f'class {i}', None) for i in range(1200)]
+        streamed = ''.join(iter_xml_rows('ship_classes', rows, columns)).encode('utf-8')
+        buffered = to_xml({'ship_classes': [dict(zip(columns, row)) for row in rows]})
+        assert streamed == buffered
+
+
+class TestRowEncoders:
+    """Test that precompiled row encoders match jsonify"""
+
+    COLUMNS = ('id', 'name', 'created_at', 'launched', 'price', 'ratio', 'active', 'pilot_name', '50% "q"')
+    ROWS = [
+        (1, 'Zoë <&> "q"', datetime.datetime(2024, 1, 2, 3, 4, 5), datetime.date(2024, 1, 2),
+         decimal.Decimal('1.50'), 0.25, True, None, [1, {'b': 2, 'a': 1}]),
+        (2, '', datetime.datetime(2024, 6, 1), None, None, float('inf'), False, 'Lars', None),
+    ]
+
+    @pytest.fixture
+    def app(self):
+        return Flask(__name__)
+
+    def test_rows_match_jsonify(self, app):
+        """Test datetimes, Decimals, NULLs, escaping and odd keys against jsonify of row dicts"""
+        with app.test_request_context('/'):
+            expected = app.json.response({'ships': [dict(zip(self.COLUMNS, row)) for row in self.ROWS],
+                                          'ship': dict(zip(self.COLUMNS, self.ROWS[0])), 'next': None})
+            response = format_response({'ships': Rows(self.ROWS, self.COLUMNS),
+                                        'ship': Row(self.ROWS[0], self.COLUMNS), 'next': None})
+        assert response.mimetype == 'application/json'
+        assert json.loads(response.get_data()) == json.loads(expected.get_data())
+        assert response.get_data().isascii()
+
+    def test_encoder_shared_per_column_list(self):
+        """Test that one encoder is compiled per column tuple and sparse rows encode"""
+        assert row_encoder(('id', 'name')) is row_encoder(('id', 'name'))
+        assert row_encoder(('id',)).encode((7,)) == '{"id":7}'
+        assert row_encoder(()).encode_many([]) == '[]'
+
+    def test_xml_matches_row_dicts(self, app):
+        """Test that Rows and Row render the same XML as the dicts they replace"""
+        rows = [row[:8] for row in self.ROWS]
+        columns = self.COLUMNS[:8]
+        data = {'ships': Rows(rows, columns), 'ship': Row(rows[1], columns), 'next': None}
+        assert to_xml(data) == to_xml({'ships': Rows(rows, columns).to_dicts(),
+                                       'ship': Row(rows[1], columns).to_dict(), 'next': None})
+
+
+class TestContentNegotiation:
+    """Test response format selection and the binary encodings"""
+
+    COLUMNS = ('id', 'name', 'created_at', 'price', 'pilot_name')
+    ROWS = [
+        (1, 'Zoë', datetime.datetime(2024, 1, 2, 3, 4, 5), decimal.Decimal('1.50'), None),
+        (2, 'Lars', datetime.datetime(2024, 6, 1), decimal.Decimal('2'), 'Jophil'),
+    ]
+
+    @pytest.fixture
+    def app(self):
+        return Flask(__name__)
+
+    def respond(self, app, path='/', accept=None):
+        headers = {'Accept': accept} if accept else {}
+        with app.test_request_context(path, headers=headers):
+            return format_response({'ships': Rows(self.ROWS, self.COLUMNS), 'next': None})
+
+    @pytest.mark.parametrize('accept, path, mimetype', [
+        (None, '/', 'application/json'),
+        ('*/*', '/', 'application/json'),
+        ('text/html,application/xhtml+xml,*/*;q=0.8', '/', 'application/json'),
+        ('text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8', '/', 'application/json'),
+        ('application/xml, */*', '/', 'application/xml'),
+        ('application/xml, application/json', '/', 'application/json'),
+        ('application/xml;q=0.9, application/json;q=0.8', '/', 'application/xml'),
+        ('application/xml', '/', 'application/xml'),
+        ('application/x-msgpack', '/', 'application/msgpack'),
+        ('application/json;q=0.5, application/cbor', '/', 'application/cbor'),
+        ('image/png', '/', 'application/json'),
+        ('application/cbor', '/?format=xml', 'application/xml'),
+        ('application/cbor', '/?format=JSON', 'application/json'),
+        ('application/cbor', '/?format=yaml', 'application/json'),
+    ])
+    def test_format_selection(self, app, accept, path, mimetype):
+        """Test Accept negotiation and the format parameter override"""
+        response = self.respond(app, path, accept)
+        assert response.mimetype == mimetype
+        assert 'Accept' in response.headers['Vary']
+
+    def test_msgpack_matches_json(self, app):
+        """Test that MessagePack carries the same values as JSON"""
+        msgpack = pytest.importorskip('msgpack')
+        data = msgpack.unpackb(self.respond(app, '/?format=msgpack').get_data())
+        assert data == json.loads(self.respond(app).get_data())
+        assert data['ships'][0]['created_at'] == 'Tue, 02 Jan 2024 03:04:05 GMT'
+
+    def test_cbor_native_types(self, app):
+        """Test that CBOR sends datetimes and decimals as tagged values"""
+        cbor2 = pytest.importorskip('cbor2')
+        data = cbor2.loads(self.respond(app, '/?format=cbor').get_data())
+        assert data['next'] is None
+        assert data['ships'][0] == {
+            'id': 1, 'name': 'Zoë', 'price': decimal.Decimal('1.50'), 'pilot_name': None,
+            'created_at': datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc),
+        }
+
+
+def decode_columnar(table):
+    """Rebuild row dicts from a columnar list object"""
+    dictionaries = {column: [] for column in table['dictionary_columns']}
+    rows = []
+    for batch in table['batches']:
+        for column, entries in batch['dictionaries'].items():
+            dictionaries[column].extend(entries)
+        columns = []
+        for column, values in zip(table['columns'], batch['values']):
+            if column in dictionaries:
+                values = [None if code is None else dictionaries[column][code] for code in values]
+            columns.append(values)
+        assert all(len(values) == batch['length'] for values in columns)
+        rows.extend(dict(zip(table['columns'], row)) for row in zip(*columns))
+    return rows
+
+
+class TestColumnar:
+    """Test the columnar, dictionary-encoded JSON format"""
+
+    COLUMNS = ('id', 'name', 'ship_class_name', 'pilot_name', 'created_at')
+    ROWS = [
+        (i, f'Ship {i}', ['fighter', 'hauler', 'tank'][i % 3], None if i % 4 == 0 else f'Pilot {i % 2}',
+         datetime.datetime(2024, 1, 1 + i % 28))
+        for i in range(1, 26)
+    ]
+
+    def test_buffered_response(self):
+        """Test column arrays, dictionary encoding of repeated strings and plain extra values"""
+        app = Flask(__name__)
+        with app.test_request_context('/?format=columnar'):
+            response = format_response({'ships': Rows(self.ROWS, self.COLUMNS), 'next': 'link',
+                                        'ship': Row(self.ROWS[0], self.COLUMNS)})
+        assert response.mimetype == 'application/json'
+        data = json.loads(response.get_data())
+        table = data['ships']
+        assert table['dictionary_columns'] == ['ship_class_name', 'pilot_name']
+        batch, = table['batches']
+        assert batch['dictionaries'] == {'ship_class_name': ['hauler', 'tank', 'fighter'],
+                                         'pilot_name': ['Pilot 1', 'Pilot 0']}
+        assert batch['values'][2][:4] == [0, 1, 2, 0]
+        assert batch['values'][3][:4] == [0, 1, 0, None]
+        assert data['next'] == 'link'
+        assert data['ship']['created_at'] == 'Tue, 02 Jan 2024 00:00:00 GMT'
+        rows = decode_columnar(table)
+        assert [row['id'] for row in rows] == list(range(1, 26))
+        assert rows[0]['ship_class_name'] == 'hauler' and rows[3]['pilot_name'] is None
+
+    def test_stream_batches_share_dictionaries(self, monkeypatch):
+        """Test that streamed batches only carry new dictionary entries and decode to the rows"""
+        monkeypatch.setattr('utils.columnar.BATCH_ROWS', 4)
+        rows = [row[:4] for row in self.ROWS]
+        table = json.loads(''.join(iter_columnar_rows('ships', iter(rows), self.COLUMNS[:4])))['ships']
+        assert len(table['batches']) == 7
+        assert table['batches'][1]['dictionaries'] == {}
+        assert decode_columnar(table) == [dict(zip(self.COLUMNS, row)) for row in rows]
+        empty = json.loads(''.join(iter_columnar_rows('ships', iter(()), ['id'])))
+        assert empty == {'ships': {'columns': ['id'], 'dictionary_columns': [], 'batches': []}}
+
+    def test_expanded_rows_and_unique_strings(self):
+        """Test that lists of row dicts are laid out as columns and unique strings stay plain"""
+        app = Flask(__name__)
+        ships = [{'id': i, 'name': f'Ship {i}', 'pilot': {'id': i % 2}} for i in range(6)]
+        with app.test_request_context('/?format=columnar'):
+            data = json.loads(format_response({'ships': ships, 'not_found': [9]}).get_data())
+        assert data['ships']['dictionary_columns'] == []
+        assert decode_columnar(data['ships']) == ships
+        assert data['not_found'] == [9]
+
+
+class TestCompression:
+    """Test Accept-Encoding negotiation, thresholds and the compressed body cache"""
+
+    @pytest.fixture
+    def client(self, monkeypatch):
+        versions = TableVersions()
+        monkeypatch.setattr('utils.etag.table_versions', versions)
+        app = Flask(__name__)
+        app.config['COMPRESS_MIN_SIZE'] = 500
+        app.versions = versions
+        app.compression = Compression(app)
+
+        @app.route('/ships')
+        @conditional('ship')
+        def ships():
+            return format_response({'ships': Rows([(i, f'Ship {i}') for i in range(100)], ('id', 'name'))})
+
+        @app.route('/small')
+        def small():
+            return format_response({'ships': []})
+
+        @app.route('/stream')
+        def stream():
+            return Response((f'{{"n":{i}}}\n' * 50 for i in range(5)), mimetype='application/json')
+
+        return app.test_client()
+
+    def test_gzip_above_threshold(self, client):
+        """Test that large bodies are gzipped, small ones and identity-only clients are not"""
+        plain = client.get('/ships')
+        assert 'Content-Encoding' not in plain.headers
+        response = client.get('/ships', headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response.headers['Vary']
+        assert zlib.decompress(response.data, 31) == plain.data
+        assert int(response.headers['Content-Length']) == len(response.data)
+        assert 'Content-Encoding' not in client.get('/small', headers={'Accept-Encoding': 'gzip'}).headers
+        assert 'Content-Encoding' not in client.get('/ships', headers={'Accept-Encoding': 'identity'}).headers
+
+    def test_coding_preference(self, client):
+        """Test that brotli is preferred when equally accepted and q-values are respected"""
+        brotli = pytest.importorskip('brotli')
+        response = client.get('/ships', headers={'Accept-Encoding': 'gzip, deflate, br'})
+        assert response.headers['Content-Encoding'] == 'br'
+        assert brotli.decompress(response.data) == client.get('/ships').data
+        response = client.get('/ships', headers={'Accept-Encoding': 'gzip, br;q=0.5'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+
+    def test_weak_etag_revalidates(self, client):
+        """Test that the weak ETag of a compressed body still gets a 304"""
+        response = client.get('/ships', headers={'Accept-Encoding': 'gzip'})
+        etag, weak = response.get_etag()
+        assert weak
+        assert client.get('/ships').get_etag() == (etag, False)
+        response = client.get('/ships', headers={'Accept-Encoding': 'gzip', 'If-None-Match': f'W/"{etag}"'})
+        assert response.status_code == 304
+        assert response.get_etag() == (etag, True)
+
+    def test_compressed_bodies_cached_per_etag(self, client, monkeypatch):
+        """Test that a repeat request reuses the compressed body until the ETag changes"""
+        calls = []
+        real_compress = compression_module.compress
+        monkeypatch.setattr('utils.compression.compress',
+                            lambda *args: calls.append(args[1]) or real_compress(*args))
+        headers = {'Accept-Encoding': 'gzip'}
+        first = client.get('/ships', headers=headers).data
+        assert client.get('/ships', headers=headers).data == first
+        assert calls == ['gzip']
+        client.application.versions.bump('ship')
+        client.get('/ships', headers=headers)
+        assert calls == ['gzip', 'gzip']
+        assert client.application.compression.stats()['hits'] == 1
+
+    def test_stream_compressed_incrementally(self, client):
+        """Test that each streamed chunk is flushed and decodable on arrival"""
+        response = client.get('/stream', headers={'Accept-Encoding': 'gzip'}, buffered=False)
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Content-Length' not in response.headers
+        decompressor = zlib.decompressobj(31)
+        decoded = [decompressor.decompress(chunk) for chunk in response.response]
+        assert decoded[0] == b'{"n":0}\n' * 50
+        assert b''.join(decoded) == b''.join(f'{{"n":{i}}}\n'.encode() * 50 for i in range(5))
+
+
+class TestEntityCache:
+    """Test LRU/TTL bounds and tag invalidation of the entity cache"""
+
+    def test_read_through(self):
+        """Test that a hit skips the loader and None results are not cached"""
+        cache = EntityCache()
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return (1, 'Jophil')
+
+        assert cache.get_or_load(('pilot', 1), loader) == (1, 'Jophil')
+        assert cache.get_or_load(('pilot', 1), loader) == (1, 'Jophil')
+        assert len(calls) == 1
+        assert cache.get_or_load(('pilot', 2), lambda: None) is None
+        assert cache.get(('pilot', 2)) is MISSING
+        assert cache.stats()['hits'] == 1
+
+    def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted at max_size"""
+        cache = EntityCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        assert cache.get('b') is MISSING
+        assert cache.get('a') == 1
+        assert cache.stats()['evictions'] == 1
+
+    def test_ttl_expiry(self):
+        """Test that entries expire after ttl seconds"""
+        cache = EntityCache(ttl=0.01)
+        cache.set('a', 1)
+        time.sleep(0.02)
+        assert cache.get('a') is MISSING
+        assert cache.stats()['expirations'] == 1
+
+    def test_tag_invalidation(self):
+        """Test that invalidating a tag drops only the entries carrying it"""
+        cache = EntityCache()
+        cache.set(('ship', 1), 'ship 1', tags=[('pilot', 1)])
+        cache.set(('ship', 2), 'ship 2', tags=[('pilot', 2)])
+        cache.invalidate_tag(('pilot', 1))
+        assert cache.get(('ship', 1)) is MISSING
+        assert cache.get(('ship', 2)) == 'ship 2'
+
+    def test_get_many_loads_misses_once(self):
+        """Test that only missed ids reach the loader, in a single call"""
+        cache = EntityCache()
+        cache.set(('pilot', 1), 'pilot 1')
+        calls = []
+
+        def loader(ids):
+            calls.append(ids)
+            return {pilot_id: f'pilot {pilot_id}' for pilot_id in ids if pilot_id != 3}
+
+        found = cache.get_many_or_load('pilot', [1, 2, 3], loader)
+        assert found == {1: 'pilot 1', 2: 'pilot 2'}
+        assert calls == [[2, 3]]
+        assert cache.get(('pilot', 2)) == 'pilot 2'
+
+    def test_load_racing_invalidation_is_dropped(self):
+        """Test that a value loaded before a concurrent write is not stored"""
+        cache = EntityCache()
+
+        def loader():
+            cache.invalidate(('pilot', 1))
+            return 'stale'
+
+        assert cache.get_or_load(('pilot', 1), loader) == 'stale'
+        assert cache.get(('pilot', 1)) is MISSING
+
+
+class TestReferenceSnapshot:
+    """Test the in-memory ship_class/weapon_class snapshot"""
+
+    @pytest.fixture
+    def mysql(self, monkeypatch):
+        monkeypatch.setattr(reference, '_snapshot', None)
+        monkeypatch.setattr(reference, '_stale', False)
+        return FakeMySQL({
+            'ship_class': [(1, 'Frigate', None), (2, 'Cruiser', 'Heavy')],
+            'weapon_class': [(1, 'Laser', 40, 2, 1, 900), (2, 'Railgun', 120, 8, 0, 2000),
+                             (3, 'Flak', 15, 1, 30, 400)],
+        })
+
+    def test_loaded_once(self, mysql):
+        """Test that reads are served from memory after the first load"""
+        snapshot = reference.snapshot(mysql)
+        assert reference.snapshot(mysql) is snapshot
+        assert snapshot.ship_class_name(2) == 'Cruiser'
+        assert snapshot.weapon_class_name(9) is None
+        assert len(mysql.queries) == 2
+
+    def test_write_swaps_in_new_version(self, mysql):
+        """Test that a write replaces the snapshot without touching the old one"""
+        old = reference.snapshot(mysql)
+        mysql.tables['ship_class'] = [(1, 'Frigate', None), (2, 'Battlecruiser', 'Heavy')]
+        reference.refresh_after_write(mysql)
+        new = reference.snapshot(mysql)
+        assert new.version == old.version + 1
+        assert new.ship_class_name(2) == 'Battlecruiser'
+        assert old.ship_class_name(2) == 'Cruiser'
+
+    def test_load_overlapping_write_is_read_again(self, mysql, monkeypatch):
+        """Test that a reload whose read may predate an applied write does not replace it"""
+        reference.snapshot(mysql)
+        monkeypatch.setattr(reference, 'REFRESH_INTERVAL', -1)
+        discarded = reference.stats()['discarded_loads']
+        execute = mysql.execute
+
+        def execute_during_write(query, values=None):
+            execute(query, values)
+            if len(mysql.queries) == 3:
+                # Another request commits and applies a rename after this read
+                mysql.tables['ship_class'] = [(1, 'Frigate', None), (2, 'Battlecruiser', 'Heavy')]
+                reference.apply_write('ship_class', 2, (2, 'Battlecruiser', 'Heavy'))
+
+        monkeypatch.setattr(mysql, 'execute', execute_during_write)
+        assert reference.snapshot(mysql).ship_class_name(2) == 'Battlecruiser'
+        assert reference.stats()['discarded_loads'] == discarded + 1
+        assert len(mysql.queries) == 6
+
+    def test_stale_snapshot_served_when_reload_fails(self, mysql, monkeypatch):
+        """Test that a failed refresh keeps serving the last good snapshot"""
+        current = reference.snapshot(mysql)
+        monkeypatch.setattr(reference, 'REFRESH_INTERVAL', -1)
+        mysql.tables = {}
+        assert reference.snapshot(mysql) is current
+
+    def test_search_and_keyset_page(self, mysql):
+        """Test in-memory filtering and paging of weapon classes"""
+        query = weapon_class.FILTERS.from_criteria({'class': 'LA', 'min_range': 500})
+        rows = weapon_class.search(mysql, query)
+        assert [row[0] for row in rows] == [1]
+        query = weapon_class.FILTERS.from_criteria({'max_damage': 100})
+        rows = weapon_class.search(mysql, query, limit=1, after=(1,))
+        assert [row[0] for row in rows] == [3]
+
+
+class TestConditionalGet:
+    """Test ETag generation and If-None-Match handling"""
+
+    @pytest.fixture
+    def client(self, monkeypatch):
+        versions = TableVersions()
+        monkeypatch.setattr('utils.etag.table_versions', versions)
+        monkeypatch.setattr('utils.etag.response_cache', ResponseCache())
+        clock = [960.0]
+        monkeypatch.setattr('utils.etag.time', types.SimpleNamespace(time=lambda: clock[0]))
+        app = Flask(__name__)
+        app.calls = 0
+        app.versions = versions
+        app.clock = clock
+
+        @app.route('/pilots')
+        @conditional('pilot')
+        def pilots():
+            app.calls += 1
+            if request.args.get('write'):
+                versions.bump('pilot')
+            return format_response({'pilots': [{'id': 1}]}, 200)
+
+        return app.test_client()
+
+    def test_not_modified_skips_view(self, client):
+        """Test that a matching If-None-Match returns 304 without running the view"""
+        response = client.get('/pilots')
+        etag = response.headers['ETag']
+        response = client.get('/pilots', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+        assert client.application.calls == 1
+
+    def test_write_changes_etag(self, client):
+        """Test that bumping a table's counter invalidates its ETags"""
+        etag = client.get('/pilots').headers['ETag']
+        client.application.versions.bump('ship')
+        assert client.get('/pilots', headers={'If-None-Match': etag}).status_code == 304
+        client.application.versions.bump('pilot')
+        assert client.get('/pilots', headers={'If-None-Match': etag}).status_code == 200
+
+    def test_write_during_view_gets_no_etag(self, client):
+        """Test that a body built while a write bumped the counters carries no ETag"""
+        response = client.get('/pilots?write=1')
+        assert response.status_code == 200
+        assert 'ETag' not in response.headers
+        assert 'ETag' in client.get('/pilots').headers
+
+    def test_etag_expires_after_ttl(self, client, monkeypatch):
+        """Test that ETags change every ETAG_TTL seconds, unless it is 0"""
+        etag = client.get('/pilots').headers['ETag']
+        client.application.clock[0] += 30
+        assert client.get('/pilots', headers={'If-None-Match': etag}).status_code == 304
+        client.application.clock[0] += 30
+        assert client.get('/pilots', headers={'If-None-Match': etag}).status_code == 200
+        monkeypatch.setattr('utils.etag.ETAG_TTL', 0)
+        etag = client.get('/pilots').headers['ETag']
+        client.application.clock[0] += 3600
+        assert client.get('/pilots', headers={'If-None-Match': etag}).status_code == 304
+
+    def test_etag_varies_by_format_and_filters(self, client):
+        """Test that format and query parameters produce distinct ETags"""
+        etags = {
+            client.get('/pilots').headers['ETag'],
+            client.get('/pilots?format=xml').headers['ETag'],
+            client.get('/pilots?name=Jo').headers['ETag'],
+        }
+        assert len(etags) == 3
+        assert client.get('/pilots?format=JSON').headers['ETag'] == client.get('/pilots').headers['ETag']
+
+    def test_etag_follows_accept_header(self, client):
+        """Test that a negotiated format shares the ETag of the same explicit format"""
+        response = client.get('/pilots', headers={'Accept': 'application/msgpack'})
+        assert response.mimetype == 'application/msgpack'
+        assert 'Accept' in response.headers['Vary']
+        assert response.headers['ETag'] == client.get('/pilots?format=msgpack').headers['ETag']
+        assert response.headers['ETag'] != client.get('/pilots').headers['ETag']
+        response = client.get('/pilots', headers={'Accept': 'application/msgpack',
+                                                  'If-None-Match': response.headers['ETag']})
+        assert response.status_code == 304
+        assert 'Accept' in response.headers['Vary']
+
+
+class TestResponseCache:
+    """Test the full-response cache behind the conditional GET endpoints"""
+
+    @pytest.fixture
+    def client(self, monkeypatch):
+        versions = TableVersions()
+        cache = ResponseCache(max_body=2000)
+        versions.subscribe(cache.invalidate)
+        monkeypatch.setattr('utils.etag.table_versions', versions)
+        monkeypatch.setattr('utils.etag.response_cache', cache)
+        monkeypatch.setattr('utils.etag.ETAG_TTL', 0)
+        app = Flask(__name__)
+        app.calls = []
+        app.versions = versions
+        app.cache = cache
+
+        @app.route('/ships')
+        @conditional('ship', 'pilot')
+        def ships():
+            app.calls.append(request.full_path)
+            if request.args.get('write'):
+                versions.bump('ship')
+            if request.args.get('missing'):
+                return format_response({'status': 'error'}, 404)
+            count = int(request.args.get('count', 2))
+            return format_response({'ships': Rows([(i, f'Ship {i}') for i in range(count)], ('id', 'name'))})
+
+        return app.test_client()
+
+    def test_hit_skips_view(self, client):
+        """Test that a repeat request is served from the cache with the same body and ETag"""
+        first = client.get('/ships?a=1&b=2')
+        second = client.get('/ships?b=2&a=1')
+        assert len(client.application.calls) == 1
+        assert second.data == first.data
+        assert second.mimetype == 'application/json'
+        assert second.headers['ETag'] == first.headers['ETag']
+        assert 'Accept' in second.headers['Vary']
+        client.get('/ships?a=1&b=2&format=xml')
+        client.get('/ships?a=1&b=2', headers={'Accept': 'application/xml'})
+        assert len(client.application.calls) == 2
+
+    def test_writes_purge_tagged_tables_only(self, client):
+        """Test that bumping a declared table drops the response and others do not"""
+        client.get('/ships')
+        client.application.versions.bump('weapon_class')
+        client.get('/ships')
+        assert len(client.application.calls) == 1
+        client.application.versions.bump('pilot')
+        assert client.get('/ships').status_code == 200
+        assert len(client.application.calls) == 2
+
+    def test_uncacheable_requests(self, client):
+        """Test that authorized requests, errors, large bodies and raced writes are not stored"""
+        for _ in range(2):
+            client.get('/ships', headers={'Authorization': 'Bearer x'})
+            client.get('/ships?missing=1')
+            client.get('/ships?count=500')
+            client.get('/ships?write=1')
+        assert len(client.application.calls) == 8
+        assert client.application.cache.stats()['size'] == 0
+
+    def test_read_racing_a_write_stores_fresh_body(self, monkeypatch):
+        """Test that a read served as a model write bumps the version sees the write"""
+        versions = TableVersions()
+        cache = ResponseCache()
+        versions.subscribe(cache.invalidate)
+        monkeypatch.setattr('utils.etag.table_versions', versions)
+        monkeypatch.setattr('utils.etag.response_cache', cache)
+        monkeypatch.setattr('utils.etag.ETAG_TTL', 0)
+        monkeypatch.setattr('models.pilot.table_versions', versions)
+        monkeypatch.setattr('models.pilot.entity_cache', EntityCache())
+        mysql = FakePilotMySQL({1: (1, 'Jo', 3, 'Ace', 90)})
+        app = Flask(__name__)
+
+        @app.route('/pilots/<int:pilot_id>')
+        @conditional('pilot')
+        def get_pilot(pilot_id):
+            return format_response({'pilot': pilot.get_by_id(mysql, pilot_id)})
+
+        client = app.test_client()
+        assert b'"Jo"' in client.get('/pilots/1').data
+
+        # Another request arrives the moment the new version is visible
+        raced = []
+        versions.subscribe(lambda *tables: raced.append(client.get('/pilots/1')))
+        pilot.update(mysql, 1, {'name': 'Lars'})
+        assert b'"Lars"' in raced[0].data
+        fresh = client.get('/pilots/1')
+        assert b'"Lars"' in fresh.data
+        assert fresh.headers['ETag'] == raced[0].headers['ETag']
+
+
+class TestSparseFieldsets:
+    """Test fieldset parsing and SQL projections"""
+
+    EXPRESSIONS = {'id': 's.id', 'name': 's.name', 'class_id': 's.class_id', 'pilot_name': 'p.name'}
+
+    def test_parse_fields(self):
+        """Test canonical ordering, required keys and unknown names"""
+        app = Flask(__name__)
+        columns = ('id', 'name', 'class_id', 'pilot_name')
+        with app.test_request_context('/?fields=pilot_name, name'):
+            assert parse_fields(columns) == ('id', 'name', 'pilot_name')
+        with app.test_request_context('/'):
+            assert parse_fields(columns) is None
+        with app.test_request_context('/?fields=name,secret'):
+            with pytest.raises(ValueError):
+                parse_fields(columns)
+
+    def test_projection_selects_only_needed_columns(self):
+        """Test that unrequested columns are not selected"""
+        projection = Projection(('id', 'name'), self.EXPRESSIONS)
+        assert projection.select == 's.id, s.name'
+        assert not projection.uses('pilot_name')
+        assert projection.build([(1, 'Lars')]) == [(1, 'Lars')]
+
+    def test_derived_column(self):
+        """Test that a derived column reads its source without returning it"""
+        names = {7: 'Frigate'}
+        projection = Projection(('id', 'class_name'), self.EXPRESSIONS,
+                                {'class_name': ('class_id', names.get)})
+        assert projection.select == 's.id, s.class_id'
+        assert projection.build([(1, 7)]) == [(1, 'Frigate')]
+
+
+class TestExpand:
+    """Test expand parsing and batched relation loading"""
+
+    def relations(self, calls):
+        def loader(name, records):
+            def load(mysql, ids):
+                calls.append((name, ids))
+                return {key: value for key, value in records.items() if key in ids}
+            return load
+        return {
+            'pilot': Relation('pilot_id', loader('pilot', {1: {'id': 1, 'name': 'Jo'}})),
+            'weapons': Relation('id', loader('weapons', {10: [{'weapon_class_id': 5}, {'weapon_class_id': 6}]}),
+                                many=True, nested={
+                'weapon_class': Relation('weapon_class_id', loader('weapon_class', {5: {'id': 5}})),
+            }),
+        }
+
+    def test_parse_expand(self):
+        """Test nested paths imply their parents and unknown paths are rejected"""
+        app = Flask(__name__)
+        relations = self.relations([])
+        with app.test_request_context('/?expand=weapons.weapon_class'):
+            assert parse_expand(relations) == {'weapons', 'weapons.weapon_class'}
+        with app.test_request_context('/'):
+            assert parse_expand(relations) == frozenset()
+        with app.test_request_context('/?expand=pilot,crew'):
+            with pytest.raises(ValueError):
+                parse_expand(relations)
+        assert required_fields(relations, {'pilot', 'weapons'}) == ('pilot_id', 'id')
+
+    def test_one_load_per_relation(self):
+        """Test that ids are collected from every row and loaded once per relation"""
+        calls = []
+        rows = [{'id': 10, 'pilot_id': 1}, {'id': 11, 'pilot_id': 1}, {'id': 12, 'pilot_id': 2}]
+        expand_rows(None, rows, self.relations(calls), {'pilot', 'weapons', 'weapons.weapon_class'})
+        assert calls == [('pilot', [1, 2]), ('weapons', [10, 11, 12]), ('weapon_class', [5, 6])]
+        assert rows[0]['pilot'] == {'id': 1, 'name': 'Jo'} and rows[2]['pilot'] is None
+        assert rows[0]['weapons'] == [{'weapon_class_id': 5, 'weapon_class': {'id': 5}},
+                                      {'weapon_class_id': 6, 'weapon_class': None}]
+        assert rows[1]['weapons'] == []
+
+    def test_unrequested_relations_not_loaded(self):
+        """Test that nothing is loaded without expand"""
+        calls = []
+        rows = [{'id': 10, 'pilot_id': 1}]
+        expand_rows(None, rows, self.relations(calls), frozenset())
+        assert calls == [] and rows == [{'id': 10, 'pilot_id': 1}]
+
+
+class TestMultiGetParams:
+    """Test ids= and keys= parsing"""
+
+    def test_parse_ids(self):
+        """Test de-duplication, ordering and the upper bound"""
+        app = Flask(__name__)
+        app.config['API_MAX_IDS'] = 3
+        with app.test_request_context('/?ids=3,1,3,2'):
+            assert parse_ids() == [3, 1, 2]
+        with app.test_request_context('/?ids=1,2,3,4'):
+            with pytest.raises(ValueError):
+                parse_ids()
+        with app.test_request_context('/?ids=0'):
+            with pytest.raises(ValueError):
+                parse_ids()
+
+    def test_parse_keys(self):
+        """Test composite keys"""
+        app = Flask(__name__)
+        with app.test_request_context('/?keys=1-2-3,4-5-6'):
+            assert parse_keys(3) == [(1, 2, 3), (4, 5, 6)]
+        with app.test_request_context('/?keys=1-2'):
+            with pytest.raises(ValueError):
+                parse_keys(3)
+
+
+class FakeInsertCursor:
+    """
+    Cursor that hands out auto-increment ids like InnoDB.
+
+    foreign_ids are taken by other sessions as they come up, splitting this
+    session's ids in interleaved lock mode; their rows stay invisible to it.
+    """
+
+    def __init__(self, lock_mode=1, isolation='REPEATABLE-READ', foreign_ids=()):
+        self.lock_mode = lock_mode
+        self.isolation = isolation
+        self.foreign_ids = set(foreign_ids)
+        self.statements = []
+        self.next_id = 1
+        self.inserted = []
+        self.lastrowid = None
+
+    def _take_id(self):
+        while self.next_id in self.foreign_ids:
+            self.next_id += 1
+        self.next_id += 1
+        return self.next_id - 1
+
+    def execute(self, query, values=None):
+        self.statements.append((query, values))
+        self._result = [(self.lock_mode,)]
+        if query.startswith('SELECT @@transaction_isolation'):
+            self._result = [(self.isolation, None)]
+        elif query.startswith('SELECT id'):
+            self._result = [(row_id,) for row_id in self.inserted if row_id >= values[0]]
+        elif query.startswith('INSERT'):
+            ids = [self._take_id() for _ in range(query.count('(%s'))]
+            self.inserted.extend(ids)
+            self.lastrowid = ids[0]
+
+    def fetchone(self):
+        return self._result[0]
+
+    def fetchall(self):
+        return self._result
+
+
+class TestBulkInsert:
+    """Test batched multi-row INSERTs and bulk payload validation"""
+
+    def setup_method(self):
+        bulk._consecutive_ids = None
+
+    def test_insert_many_batches(self):
+        """Test one statement per batch and ids taken from lastrowid"""
+        cursor = FakeInsertCursor()
+        ids = insert_many(cursor, 'pilot', ['name', 'flight_years'],
+                          [('a', 1), ('b', 2), ('c', 3)], batch_size=2)
+        assert ids == [1, 2, 3]
+        inserts = [s for s in cursor.statements if s[0].startswith('INSERT')]
+        assert len(inserts) == 2
+        assert inserts[0] == ('INSERT INTO pilot (name, flight_years) VALUES (%s, %s), (%s, %s)',
+                              ['a', 1, 'b', 2])
+
+    def test_insert_many_interleaved_lock_mode(self):
+        """Test multi-row batches with ids read back when they may not be consecutive"""
+        cursor = FakeInsertCursor(lock_mode=2, foreign_ids=(2, 4, 7))
+        ids = insert_many(cursor, 'pilot', ['name'], [('a',), ('b',), ('c',), ('d',), ('e',)],
+                          batch_size=3)
+        assert ids == [1, 3, 5, 6, 8]
+        assert len([s for s in cursor.statements if s[0].startswith('INSERT')]) == 2
+        assert cursor.statements[-1] == ('SELECT id FROM pilot WHERE id >= %s ORDER BY id', (1,))
+
+    def test_insert_many_interleaved_without_snapshot(self):
+        """Test single-row statements when the isolation level cannot isolate the read back"""
+        cursor = FakeInsertCursor(lock_mode=2, isolation='READ-COMMITTED', foreign_ids=(2,))
+        assert insert_many(cursor, 'pilot', ['name'], [('a',), ('b',)]) == [1, 3]
+        assert len([s for s in cursor.statements if s[0].startswith('INSERT')]) == 2
+
+    def test_validate_bulk_data(self):
+        """Test per-item errors and payload bounds"""
+        valid = {'name': 'A', 'flight_years': 1, 'rank': 'Ace', 'mission_success': 5}
+        assert validate_bulk_data([valid], validate_pilot_data, 10) == (True, None, [])
+        is_valid, message, errors = validate_bulk_data([valid, {'name': 'B'}, 3],
+                                                       validate_pilot_data, 10)
+        assert not is_valid
+        assert [error['index'] for error in errors] == [1, 2]
+        assert not validate_bulk_data({}, validate_pilot_data, 10)[0]
+        assert not validate_bulk_data([], validate_pilot_data, 10)[0]
+        assert not validate_bulk_data([valid] * 3, validate_pilot_data, 2)[0]
+
+
+class FakeUpdateCursor:
+    """Cursor that reports every id in an UPDATE ... IN (...) as matched"""
+
+    def __init__(self):
+        self.statements = []
+        self.rowcount = 0
+
+    def execute(self, query, values=None):
+        self.statements.append((query, values))
+        self.rowcount = query.split('IN (')[1].count('%s')
+
+
+class TestBulkUpdate:
+    """Test grouped UPDATEs and bulk update payload validation"""
+
+    def test_identical_changes_share_a_statement(self):
+        """Test one UPDATE per distinct change set, batched by id"""
+        cursor = FakeUpdateCursor()
+        columns = {'name': 'name', 'rank': '`rank`'}
+        updates = [(1, {'rank': 'Ace'}), (2, {'rank': 'Ace'}), (3, {'rank': 'Ace', 'name': 'Jo'}),
+                   (4, {'rank': 'Ace'})]
+        assert update_grouped(cursor, 'pilot', columns, updates, batch_size=2) == 4
+        assert cursor.statements == [
+            ('UPDATE pilot SET `rank` = %s WHERE id IN (%s, %s)', ['Ace', 1, 2]),
+            ('UPDATE pilot SET `rank` = %s WHERE id IN (%s)', ['Ace', 4]),
+            ('UPDATE pilot SET name = %s, `rank` = %s WHERE id IN (%s)', ['Jo', 'Ace', 3]),
+        ]
+
+    def test_validate_id_list(self):
+        """Test per-item errors for ids and change sets"""
+        valid = {'id': 1, 'changes': {'rank': 'Ace'}}
+        assert validate_bulk_update_data([valid], validate_pilot_data, pilot.UPDATE_COLUMNS,
+                                         pilot.FILTERS.param_types, 10) == (True, None, [])
+        is_valid, message, errors = validate_bulk_update_data(
+            [valid, valid, {'id': 2, 'changes': {}}, {'id': 3, 'changes': {'flight_years': -1}}],
+            validate_pilot_data, pilot.UPDATE_COLUMNS, pilot.FILTERS.param_types, 10)
+        assert not is_valid
+        assert [error['index'] for error in errors] == [1, 2, 3]
+
+    def test_validate_filter(self):
+        """Test that a filter must be known, typed and non-empty"""
+        def check(data):
+            return validate_bulk_update_data(data, validate_pilot_data, pilot.UPDATE_COLUMNS,
+                                             pilot.FILTERS.param_types, 10)[0]
+        changes = {'rank': 'Ace'}
+        assert check({'filter': {'min_flight_years': 3}, 'changes': changes})
+        assert not check({'filter': {}, 'changes': changes})
+        assert not check({'filter': {'name': ''}, 'changes': changes})
+        assert not check({'filter': {'min_flight_years': '3'}, 'changes': changes})
+        assert not check({'filter': {'speed': 3}, 'changes': changes})
+
+
+class TestFilters:
+    """Test the declarative filter and sort layer"""
+
+    def test_parse_criteria(self):
+        """Test that query arguments become typed criteria in spec order"""
+        query = ship.FILTERS.parse({'max_speed': '300', 'name': 'Nova', 'limit': '5', 'pilot_id': ''})
+        assert query.criteria == (('name', 'Nova'), ('max_speed', 300))
+        assert query.sort_fields == ('relevance', 'id')
+        with pytest.raises(ValueError, match='min_speed must be a valid integer'):
+            ship.FILTERS.parse({'min_speed': 'fast'})
+
+    def test_parse_sort(self):
+        """Test that sort ends with the key and rejects unknown or repeated fields"""
+        assert ship.FILTERS.parse_sort('-speed,name') == (('speed', True), ('name', False), ('id', False))
+        assert ship.FILTERS.parse_sort('-id,name') == (('id', True),)
+        assert ship.FILTERS.parse({'sort': '-speed'}).cursor_types() == (int, int)
+        for raw in ('pilot_name', 'speed,speed'):
+            with pytest.raises(ValueError):
+                ship.FILTERS.parse_sort(raw)
+
+    def test_sql_compiled_once_per_shape(self):
+        """Test that requests of the same shape reuse one SQL text"""
+        spec = FilterSpec({
+            'id': Field(ops=(), sortable=True),
+            'name': Field(type=str, ops=('like',), sortable=True),
+            'speed': Field(ops=('min', 'max'), sortable=True),
+        })
+        first = spec.sql('id, name', 't', spec.parse({'min_speed': '1', 'sort': '-speed'}), 10)
+        second = spec.sql('id, name', 't', spec.parse({'min_speed': '9', 'sort': '-speed'}), 20)
+        assert first[0] is second[0]
+        assert first == ('SELECT id, name FROM t WHERE speed >= %s ORDER BY speed DESC, id LIMIT %s', [1, 10])
+        assert len(spec._sql_cache) == 1
+
+    def test_keyset_sql(self):
+        """Test that the cursor condition continues strictly after the last row"""
+        query = pilot.FILTERS.parse({'rank': 'Ace', 'sort': '-flight_years'})
+        sql, values = pilot.FILTERS.sql('id', 'pilot', query, 5, (3, 7))
+        assert '`rank` = %s AND ((flight_years < %s) OR (flight_years = %s AND id > %s))' in sql
+        assert sql.endswith('ORDER BY flight_years DESC, id LIMIT %s')
+        assert values == ['Ace', 3, 3, 7, 5]
+
+    def test_from_criteria(self):
+        """Test that a validated filter object builds WHERE conditions"""
+        query = pilot.FILTERS.from_criteria({'min_flight_years': 3, 'rank': 'Ace'})
+        assert pilot.FILTERS.where(query) == (['`rank` = %s', 'flight_years >= %s'], ['Ace', 3])
+
+    def test_select_rows_matches_sql_semantics(self):
+        """Test in-memory filtering, sorting and paging of snapshot rows"""
+        rows = [(1, 'Laser', 10, 1, 1, 5), (2, 'laser cannon', 30, 2, 1, 9),
+                (3, 'Rail', 30, 3, 1, 7), (4, 'Missile', 50, 4, 1, 8)]
+        query = weapon_class.FILTERS.parse({'min_damage': '20', 'sort': '-damage'})
+        assert [row[0] for row in weapon_class.FILTERS.select_rows(rows, query)] == [4, 2, 3]
+        assert [row[0] for row in weapon_class.FILTERS.select_rows(rows, query, 1, (30, 2))] == [3]
+        query = weapon_class.FILTERS.parse({'class': 'LASER', 'sort': 'class'})
+        assert [row[0] for row in weapon_class.FILTERS.select_rows(rows, query)] == [1, 2]
+
+
+class TestTextSearch:
+    """Test token/prefix text search and relevance ordering"""
+
+    def test_tokens_match_word_prefixes(self):
+        """Test that every search token must prefix a word, in any order"""
+        assert matches('Death Star', 'star de')
+        assert not matches('Death Star', 'star dx')
+        assert not matches('Deathstar', 'star')
+        assert not matches('Death Star', '%%')
+        assert boolean_query(tokenize("O'Neil  jr.")) == '+o* +neil* +jr*'
+
+    def test_inverted_index_agrees_with_matches(self):
+        """Test that the inverted index returns the rows matches() accepts"""
+        rows = [(1, 'Star Destroyer'), (2, 'Death Star'), (3, 'Starling'), (4, None), (5, 'Nebula')]
+        index = InvertedIndex(rows)
+        for term in ('star', 'sta de', 'neb', 'x', ''):
+            assert index.search(term) == {row_id for row_id, text in rows if matches(text, term)}
+
+    def test_relevance_tiers(self):
+        """Test exact, whole-value prefix and word prefix tiers"""
+        assert relevance('Star', 'star') == 3
+        assert relevance('Starling', 'star') == 2
+        assert relevance('Death Star', 'star') == 1
+
+    def test_search_sorted_by_relevance(self):
+        """Test that a text search ranks by relevance and pages by (tier, id)"""
+        rows = [(1, 'Death Star', None), (2, 'Star', None), (3, 'Starling', None), (4, 'Star Base', None)]
+        spec = ship_class.FILTERS
+        query = spec.parse({'name': 'star'})
+        assert query.sort_fields == ('relevance', 'id')
+        assert query.columns == ('name', 'id')
+        assert [row[0] for row in spec.select_rows(rows, query)] == [2, 3, 4, 1]
+        assert [row[0] for row in spec.select_rows(rows, query, after=(2, 3))] == [4, 1]
+        assert query.cursor_key(('id', 'name', 'description'))(rows[3]) == (2, 4)
+        with pytest.raises(ValueError):
+            spec.parse({'sort': 'relevance'})
+
+    def test_relevance_sql(self):
+        """Test the FULLTEXT condition and relevance keyset SQL"""
+        query = pilot.FILTERS.parse({'name': 'jo_'})
+        sql, values = pilot.FILTERS.sql('id, name', 'pilot', query, 5, (2, 7))
+        match = "REGEXP_LIKE(name, %s, 'i')"
+        tier = f"CASE WHEN {match} THEN 3 WHEN {match} THEN 2 ELSE 1 END"
+        assert sql == ('SELECT id, name FROM pilot WHERE MATCH(name) AGAINST(%s IN BOOLEAN MODE) '
+                       f'AND (({tier} < %s) OR ({tier} = %s AND id > %s)) '
+                       f'ORDER BY {tier} DESC, id LIMIT %s')
+        assert values == ['+jo_*', '^jo_$', '^jo_', 2, '^jo_$', '^jo_', 2, 7, '^jo_$', '^jo_', 5]
+
+    def test_tokens_fulltext_cannot_find_use_like(self, monkeypatch):
+        """Test that short tokens, stopwords and word-less terms fall back to patterns"""
+        monkeypatch.setattr('utils.textsearch.fulltext', FulltextSettings())
+        where = 'SELECT id FROM pilot WHERE {} ORDER BY id'
+        word = "REGEXP_LIKE(name, %s, 'i')"
+
+        def search(term):
+            query = pilot.FILTERS.parse({'name': term, 'sort': 'id'})
+            return pilot.FILTERS.sql('id', 'pilot', query)
+
+        assert search('star de the') == (
+            where.format(f'MATCH(name) AGAINST(%s IN BOOLEAN MODE) AND {word} AND {word}'),
+            ['+star*', '\\bde', '\\bthe'])
+        assert search('x') == (where.format(word), ['\\bx'])
+        assert search('--%') == (where.format('name LIKE %s'), ['--\\%%'])
+        assert pilot.FILTERS.where(pilot.FILTERS.from_criteria({'name': 'ab'})) == ([word], ['\\bab'])
+
+    def test_missing_fulltext_index_uses_like(self, monkeypatch):
+        """Test that a table without a FULLTEXT index is searched with patterns only"""
+        settings = FulltextSettings()
+        settings.tables = frozenset(('ship',))
+        monkeypatch.setattr('utils.textsearch.fulltext', settings)
+        query = pilot.FILTERS.parse({'name': 'star', 'sort': 'id'})
+        sql, values = pilot.FILTERS.sql('id', 'pilot', query)
+        assert 'MATCH' not in sql and values == ['\\bstar']
+        query = ship.FILTERS.parse({'name': 'star', 'sort': 'id'})
+        assert 'MATCH(s.name)' in ship.FILTERS.sql('s.id', 'ship s', query)[0]
+
+    def test_sql_patterns_agree_with_memory(self, monkeypatch):
+        """Test that the SQL patterns match and rank the values the in-memory search does"""
+        # Python's re stands in for MySQL's ICU regular expressions: \b, ^, $
+        # and the escapes used here mean the same in both
+        settings = FulltextSettings()
+        settings.tables = frozenset()
+        monkeypatch.setattr('utils.textsearch.fulltext', settings)
+        values = ['X-Wing', 'x wing', "O'Neil", 'Star Destroyer', 'Death Star', 'Starling',
+                  'a.b (c)', 'snake_case', 'Wingman', '--dash', None]
+        for term in ('wing', 'x-wing', 'neil', 'star de', 'a.b', 'case', '(c', 'snake_c', 'STAR'):
+            _, patterns = pilot.FILTERS.where(pilot.FILTERS.from_criteria({'name': term}))
+            for value in values:
+                in_sql = value is not None and all(re.search(p, value, re.I) for p in patterns)
+                assert in_sql == matches(value, term), (term, value)
+                if in_sql:
+                    exact, prefix = relevance_patterns(term)
+                    tier = 3 if re.search(exact, value, re.I) else 2 if re.search(prefix, value, re.I) else 1
+                    assert tier == relevance(value, term), (term, value)
+
+    def test_fulltext_settings_load(self):
+        """Test reading the token size, stopwords and indexed tables from the server"""
+        class Cursor:
+            def execute(self, query):
+                self.query = query
+
+            def fetchone(self):
+                return (1, 0, None)
+
+            def fetchall(self):
+                return [('pilot',)]
+
+            def close(self):
+                pass
+
+        mysql = types.SimpleNamespace(connection=types.SimpleNamespace(cursor=Cursor))
+        settings = FulltextSettings()
+        assert settings.split(['de', 'star'], 'pilot') == (['star'], ['de'])
+        settings.ensure_loaded(mysql)
+        assert settings.split(['de', 'x', 'the'], 'pilot') == (['de', 'x', 'the'], [])
+        assert settings.split(['star'], 'ship') == ([], ['star'])
+
+    def test_wordless_term_matches_prefix_in_memory(self):
+        """Test that a term without word tokens matches value prefixes, as in SQL"""
+        rows = [(1, '--Alpha', None), (2, 'Beta --', None)]
+        index = InvertedIndex([(row[0], row[1]) for row in rows])
+        query = ship_class.FILTERS.parse({'name': '--', 'sort': 'id'})
+        for text_indexes in (None, {'name': index}):
+            assert [row[0] for row in ship_class.FILTERS.select_rows(rows, query, text_indexes=text_indexes)] == [1]
+
+
+class TestStats:
+    """Test grouped statistics in SQL and in memory"""
+
+    def test_sql_single_aggregated_pass(self):
+        """Test one GROUP BY query carrying the list filters"""
+        query = ship.FILTERS.parse({'min_speed': '100', 'sort': '-speed'})
+        sql, values = ship.STATS.sql('ship s', query, 'pilot_id')
+        assert sql == ('SELECT s.pilot_id, COUNT(*), '
+                       'SUM(s.capacity), MIN(s.capacity), MAX(s.capacity), AVG(s.capacity), STDDEV_POP(s.capacity), '
+                       'SUM(s.speed), MIN(s.speed), MAX(s.speed), AVG(s.speed), STDDEV_POP(s.speed), '
+                       'SUM(s.shield), MIN(s.shield), MAX(s.shield), AVG(s.shield), STDDEV_POP(s.shield) '
+                       'FROM ship s WHERE s.speed >= %s GROUP BY s.pilot_id ORDER BY s.pilot_id')
+        assert values == [100]
+        sql, values = ship.STATS.sql('ship s', ship.FILTERS.unfiltered())
+        assert sql.startswith('SELECT NULL, COUNT(*)') and 'WHERE' not in sql and 'GROUP' not in sql
+
+    def test_sql_rows_formatted(self):
+        """Test that Decimal sums and means come back as JSON numbers"""
+        spec = StatsSpec(ship.FILTERS, metrics=('speed',), group_by=('ship_class_id',))
+        rows = [(1, 2, decimal.Decimal(300), 100, 200, decimal.Decimal('150.0000'), 50.0)]
+        assert spec.from_sql_rows(rows, 'ship_class_id') == [{
+            'ship_class_id': 1, 'count': 2,
+            'speed': {'sum': 300, 'min': 100, 'max': 200, 'mean': 150.0, 'stddev': 50.0},
+        }]
+
+    def test_in_memory_matches_definition(self):
+        """Test the one-pass summary against a direct computation"""
+        rows = [(1, 'laser', 80, 7, 0, 1500), (2, 'Laser', 120, 3, 0, 900),
+                (3, 'missile', 200, 2, 0, 5000), (4, 'laser', 40, 5, 10, 1200)]
+        query = weapon_class.FILTERS.parse({'max_damage': '150'})
+        groups = weapon_class.STATS.aggregate(rows, query, 'class')
+        assert [(g['class'], g['count']) for g in groups] == [('Laser', 1), ('laser', 2)]
+        damage = groups[1]['damage']
+        assert (damage['sum'], damage['min'], damage['max'], damage['mean']) == (120, 40, 80, 60.0)
+        assert damage['stddev'] == pytest.approx(20.0)
+
+        overall = weapon_class.STATS.aggregate(rows, weapon_class.FILTERS.unfiltered())
+        assert len(overall) == 1 and overall[0]['count'] == 4
+        values = [row[5] for row in rows]
+        mean = sum(values) / len(values)
+        assert overall[0]['range']['stddev'] == pytest.approx(
+            (sum((v - mean) ** 2 for v in values) / len(values)) ** 0.5)
+
+    def test_empty_and_invalid_group(self):
+        """Test an empty ungrouped summary and an unknown group_by"""
+        query = weapon_class.FILTERS.parse({'min_damage': '999'})
+        assert weapon_class.STATS.aggregate([(1, 'laser', 80, 7, 0, 1500)], query) == [{
+            'count': 0,
+            **{name: {'sum': None, 'min': None, 'max': None, 'mean': None, 'stddev': None}
+               for name in weapon_class.STATS.metrics},
+        }]
+        assert weapon_class.STATS.aggregate([], query, 'class') == []
+        with pytest.raises(ValueError):
+            ship.STATS.parse_group({'group_by': 'name'})
+        assert ship.STATS.parse_group({}) is None
+
+
+class FakeSummaryCursor:
+    """Cursor stand-in answering the summary drift queries"""
+
+    def __init__(self, stored, actual):
+        self.results = [stored['pilot'], actual['pilot'], stored['ship_class'], actual['ship_class']]
+        self.statements = []
+
+    def execute(self, query, values=None):
+        self.statements.append(' '.join(query.split()))
+
+    def fetchall(self):
+        return self.results.pop(0)
+
+
+class TestShipSummaries:
+    """Test the per-pilot and per-class summary deltas"""
+
+    def test_create_and_delete_deltas(self):
+        """Test that added and removed ships count in both groups"""
+        assert summary.deltas(added=[(1, 2, 100, 50), (1, 3, 10, 5)]) == {
+            'pilot': {1: [2, 110, 55]},
+            'ship_class': {2: [1, 100, 50], 3: [1, 10, 5]},
+        }
+        assert summary.deltas(removed=[(1, 2, 100, 50)]) == {
+            'pilot': {1: [-1, -100, -50]},
+            'ship_class': {2: [-1, -100, -50]},
+        }
+
+    def test_move_between_groups(self):
+        """Test that a ship moving pilots leaves one group and joins another"""
+        changes = summary.deltas([(1, 2, 100, 50)], [(4, 2, 120, 50)])
+        assert changes == {'pilot': {1: [-1, -100, -50], 4: [1, 120, 50]},
+                           'ship_class': {2: [0, 20, 0]}}
+        # Changes that move no totals leave nothing to write
+        assert summary.deltas([(1, 2, 100, 50)], [(1, 2, 100, 50)]) == {'pilot': {}, 'ship_class': {}}
+
+    def test_apply_one_upsert_per_table(self):
+        """Test that deltas are written in key order with one statement per table"""
+        log = []
+        summary.apply(FakeStatementCursor(log), {'pilot': {4: [1, 120, 50], 1: [-1, -100, -50]}, 'ship_class': {}})
+        assert len(log) == 1
+        sql, values = log[0]
+        assert sql.startswith('INSERT INTO pilot_ship_summary (pilot_id, ship_count, total_capacity, '
+                              'total_shield) VALUES (%s, %s, %s, %s), (%s, %s, %s, %s) AS delta')
+        assert list(values) == [1, -1, -100, -50, 4, 1, 120, 50]
+
+    def test_drift(self):
+        """Test that missing, stale and extra summary rows are reported"""
+        cursor = FakeSummaryCursor(
+            stored={'pilot': [(1, 2, 110, 55), (2, 1, 5, 5)], 'ship_class': [(3, 0, 0, 0)]},
+            actual={'pilot': [(1, 2, 110, 55), (3, 1, 7, 7)], 'ship_class': []})
+        assert summary.drift(cursor) == [
+            ('pilot', 2, (1, 5, 5), (0, 0, 0)),
+            ('pilot', 3, (0, 0, 0), (1, 7, 7)),
+        ]
+
+    def test_missing_summary_row_on_delete_is_logged(self, caplog):
+        """Test that a delete which found fewer than both summary rows is reported"""
+        summary.check_subtracted(7, 2)
+        assert not caplog.records
+        summary.check_subtracted(7, 1)
+        assert 'repair_summaries.py' in caplog.records[0].getMessage()
+        assert "LEFT JOIN pilot_ship_summary" in summary.SUBTRACT_SHIP
+
+
+class FakeNamesMySQL:
+    """Stand-in for PooledMySQL serving (id, name) rows from a server-side cursor"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.loads = 0
+
+    @contextmanager
+    def server_side_cursor(self):
+        self.loads += 1
+        remaining = list(self.rows)
+
+        class Cursor:
+            def execute(self, query):
+                pass
+
+            def fetchmany(self, size):
+                batch = remaining[:size]
+                del remaining[:size]
+                return batch
+
+        yield Cursor()
+
+
+class TestAutocomplete:
+    """Test the name index and its write-through model layer"""
+
+    NAMES = [(1, 'Imperial Star Destroyer'), (2, 'Star Courier'), (3, 'Starling'),
+             (4, 'Death Star'), (5, 'Nebula Frigate'), (6, None)]
+
+    def test_prefix_ranking(self):
+        """Test whole-name prefixes before word prefixes, each by key then id"""
+        index = NameIndex(self.NAMES)
+        assert [row_id for row_id, _ in index.suggest('star')] == [2, 3, 4, 1]
+        # Exact prefix matches rank before typo matches ('star c')
+        assert index.suggest('STAR  d', limit=2) == [(1, 'Imperial Star Destroyer'), (2, 'Star Courier')]
+        assert [row_id for row_id, _ in index.suggest('star', limit=2)] == [2, 3]
+        assert index.suggest('   ') == []
+        assert len(index) == 5
+
+    def test_typo_matches(self):
+        """Test that typos within the allowed distance still suggest names"""
+        index = NameIndex(self.NAMES)
+        assert index.suggest('nebual') == [(5, 'Nebula Frigate')]
+        assert index.suggest('dearh st') == [(4, 'Death Star')]
+        # Too short to tolerate a typo, and the first character must match
+        assert index.suggest('sx') == []
+        assert index.suggest('xebula') == []
+
+    def test_add_remove_rename(self):
+        """Test in-place updates keep the index consistent"""
+        index = NameIndex(self.NAMES)
+        index.add(7, 'Star Hauler')
+        index.add(2, 'Courier')
+        index.remove(3)
+        index.remove(99)
+        assert [row_id for row_id, _ in index.suggest('star')] == [7, 4, 1]
+        assert index.suggest('cour') == [(2, 'Courier')]
+        assert len(index) == 5
+        assert NameIndex(index._names.items())._keys == index._keys
+
+    @pytest.fixture
+    def mysql(self, monkeypatch):
+        for entity in autocomplete.ENTITIES:
+            monkeypatch.setitem(autocomplete._states, entity, autocomplete._State())
+        return FakeNamesMySQL(self.NAMES)
+
+    def test_loaded_once_and_written_through(self, mysql):
+        """Test that writes update a loaded index without reloading it"""
+        autocomplete.record('ships', 7, 'Nova')
+        assert autocomplete.suggest(mysql, 'ships', 'nova') == []
+        autocomplete.record('ships', 8, 'Starfall')
+        autocomplete.record('ships', 2, None)
+        assert autocomplete.suggest(mysql, 'ships', 'star') == [(8, 'Starfall'), (3, 'Starling'),
+                                                                (4, 'Death Star'),
+                                                                (1, 'Imperial Star Destroyer')]
+        assert mysql.loads == 1
+        assert autocomplete.stats()['ships']['names'] == 5
+        assert autocomplete.stats()['pilots']['names'] == 0
+
+    def test_invalidate_reloads(self, mysql):
+        """Test that an invalidated index is reloaded on next use"""
+        autocomplete.suggest(mysql, 'pilots', 'star')
+        mysql.rows = [(1, 'Starbuck')]
+        autocomplete.invalidate('pilots')
+        assert autocomplete.suggest(mysql, 'pilots', 'star') == [(1, 'Starbuck')]
+        assert mysql.loads == 2
+
+
+class FakeStatementCursor:
+    """Raw cursor that records statements; SELECT and EXECUTE statements return rows."""
+
+    def __init__(self, log, refuse=(), rows=(), errors=None):
+        self.log = log
+        self.refuse = refuse
+        self.rows = rows
+        # Exceptions raised by the next PREPAREs, in order
+        self.errors = errors if errors is not None else []
+        self.rowcount = 0
+        self._current = []
+
+    def execute(self, query, args=None):
+        if query.startswith('PREPARE') and self.errors:
+            raise self.errors.pop(0)
+        if ';' in query:
+            raise Exception(1064, 'multi-statements are disabled')
+        if any(text in str(args) for text in self.refuse):
+            raise Exception(1295, 'This command is not supported in the prepared statement protocol yet')
+        self.log.append((query, list(args) if args else []))
+        self._current = list(self.rows) if query.startswith(('SELECT', 'EXECUTE')) else []
+        self.rowcount = 1
+
+    def fetchall(self):
+        rows, self._current = self._current, []
+        return rows
+
+    def fetchone(self):
+        return self._current.pop(0) if self._current else None
+
+
+class FakeStatementConnection:
+    def __init__(self, refuse=(), rows=(), errors=()):
+        self.log = []
+        self.refuse = refuse
+        self.rows = rows
+        self.errors = list(errors)
+
+    def cursor(self, cursorclass=None):
+        return FakeStatementCursor(self.log, self.refuse, self.rows, self.errors)
+
+
+class TestPreparedStatements:
+    """Test the per-connection prepared statement cache"""
+
+    @pytest.fixture(autouse=True)
+    def stats(self, monkeypatch):
+        stats = StatementStats()
+        monkeypatch.setattr('utils.statements.statement_stats', stats)
+        return stats
+
+    def test_hot_statement_prepared_once(self, stats):
+        """Test that a repeated shape is prepared once and then executed by handle"""
+        raw = FakeStatementConnection()
+        conn = PreparedConnection(raw, cache_size=4)
+        for pilot_id in (1, 2, 3):
+            conn.cursor().execute("""
+                SELECT id, name FROM pilot
+                WHERE id = %s""", (pilot_id,))
+        # The first run is plain text; the second crosses the threshold
+        assert raw.log[0][1] == [1]
+        assert raw.log[1:] == [
+            ('PREPARE s1 FROM %s', ['SELECT id, name FROM pilot WHERE id = ?']),
+            ('SET @p0 = %s', [2]),
+            ('EXECUTE s1 USING @p0', []),
+            ('SET @p0 = %s', [3]),
+            ('EXECUTE s1 USING @p0', []),
+        ]
+        entry = stats.stats()['top'][0]
+        assert entry['sql'] == 'SELECT id, name FROM pilot WHERE id = %s'
+        assert (entry['executions'], entry['prepared_executions'], entry['prepares']) == (3, 2, 1)
+        assert entry['parse_savings'] == 1
+
+    def test_lru_handle_deallocated(self):
+        """Test that preparing past the cache size deallocates the least recently used handle"""
+        raw = FakeStatementConnection()
+        conn = PreparedConnection(raw, cache_size=2)
+        for table in ('pilot', 'ship', 'pilot', 'ship_class'):
+            for _ in range(2):
+                conn.cursor().execute(f'SELECT id FROM {table} WHERE id = %s', (1,))
+        assert raw.log[-4:-2] == [('DEALLOCATE PREPARE s2', []),
+                                  ('PREPARE s3 FROM %s', ['SELECT id FROM ship_class WHERE id = ?'])]
+        assert conn.statement_cache.stats()['evictions'] == 1
+
+    def test_prepared_execution_returns_rows(self):
+        """Test that rows of a prepared SELECT are fetched from the EXECUTE"""
+        raw = FakeStatementConnection(rows=[(1, 'Jo')])
+        conn = PreparedConnection(raw, cache_size=1)
+        for table in ('pilot', 'pilot', 'pilot', 'ship', 'ship'):
+            cursor = conn.cursor()
+            cursor.execute(f'SELECT id, name FROM {table} WHERE id = %s', (1,))
+            assert cursor.fetchall() == [(1, 'Jo')]
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, name FROM ship WHERE id = %s', (1,))
+        assert cursor.fetchone() == (1, 'Jo')
+        # Both pilot executions after the first and the last ship one ran by handle
+        assert sum(query.startswith('SET') for query, _ in raw.log) == 4
+        assert ('PREPARE s2 FROM %s', ['SELECT id, name FROM ship WHERE id = ?']) in raw.log
+        assert ('DEALLOCATE PREPARE s1', []) in raw.log
+
+    def test_unpreparable_and_wide_statements_run_as_text(self):
+        """Test fallbacks for refused shapes and statements with many parameters"""
+        raw = FakeStatementConnection(refuse=('LOCK',))
+        conn = PreparedConnection(raw)
+        for _ in range(3):
+            conn.cursor().execute('SELECT id FROM pilot LOCK IN SHARE MODE')
+        wide = 'SELECT id FROM pilot WHERE id IN (' + ', '.join(['%s'] * 40) + ')'
+        for _ in range(2):
+            conn.cursor().execute(wide, list(range(40)))
+        assert not any(query.startswith(('SET', 'EXECUTE')) for query, _ in raw.log)
+        assert conn.statement_cache.stats()['prepare_failures'] == 1
+
+    def test_transient_prepare_failure_is_retried(self):
+        """Test that an error unrelated to the statement propagates without disabling the shape"""
+        raw = FakeStatementConnection(errors=[Exception(2013, 'Lost connection to MySQL server')])
+        conn = PreparedConnection(raw)
+        query = 'SELECT id FROM pilot WHERE id = %s'
+        conn.cursor().execute(query, (1,))
+        with pytest.raises(Exception):
+            conn.cursor().execute(query, (2,))
+        conn.cursor().execute(query, (3,))
+        assert raw.log[-2:] == [('SET @p0 = %s', [3]), ('EXECUTE s2 USING @p0', [])]
+        assert conn.statement_cache.stats()['prepare_failures'] == 0
+
+    def test_prepared_text_keeps_literals(self):
+        """Test the driver's % escapes and literal whitespace in prepared text and shapes"""
+        raw = FakeStatementConnection()
+        conn = PreparedConnection(raw)
+        for _ in range(2):
+            conn.cursor().execute("SELECT id FROM pilot WHERE name LIKE 'a%%'")
+            conn.cursor().execute("SELECT id FROM pilot WHERE name LIKE CONCAT(%s, '%%')", ('a',))
+        prepared = [args[0] for query, args in raw.log if query.startswith('PREPARE')]
+        assert prepared == ["SELECT id FROM pilot WHERE name LIKE 'a%%'",
+                            "SELECT id FROM pilot WHERE name LIKE CONCAT(?, '%')"]
+        assert normalize("SELECT  id\n FROM pilot WHERE name = 'a  b'") == "SELECT id FROM pilot WHERE name = 'a  b'"
+        assert normalize("SELECT 'a  b'") != normalize("SELECT 'a b'")
+        assert server_text("SELECT id FROM pilot WHERE name = '%s'", True) is None
+
+
+class FakeMigrationConnection:
+    """Connection stand-in that records DDL and remembers applied versions"""
+
+    def __init__(self, applied=(), errors=None):
+        self.versions = set(applied)
+        self.errors = errors or {}
+        self.executed = []
+        self.commits = 0
+        self._rows = []
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, values=None):
+        if query.startswith('INSERT INTO schema_migrations'):
+            self.versions.add(values[0])
+        elif query.startswith('SELECT version'):
+            self._rows = [(version,) for version in self.versions]
+        elif 'schema_migrations' not in query:
+            for text, error in self.errors.items():
+                if text in query:
+                    raise Exception(*error)
+            self.executed.append(query)
+
+    def fetchall(self):
+        return self._rows
+
+    def commit(self):
+        self.commits += 1
+
+    def close(self):
+        pass
+
+
+class TestMigrations:
+    """Test migration discovery, ordering and resumption"""
+
+    @pytest.fixture
+    def path(self, tmp_path):
+        (tmp_path / '0002_indexes.sql').write_text(
+            '-- indexes\nALTER TABLE pilot ADD KEY idx_a (a);\n\nALTER TABLE pilot ADD KEY idx_b (b);\n')
+        (tmp_path / '0001_users.sql').write_text('CREATE TABLE users (id int);\n')
+        (tmp_path / 'notes.txt').write_text('not a migration')
+        return str(tmp_path)
+
+    def test_discover_orders_by_version(self, path):
+        """Test that migration files are found in version order"""
+        assert [(version, name) for version, name, _ in discover(path)] == [(1, 'users'), (2, 'indexes')]
+
+    def test_split_statements(self):
+        """Test that comments are dropped and statements split on line-ending semicolons"""
+        assert split_statements('-- c\nSELECT 1;\nSELECT\n  2;\n') == ['SELECT 1', 'SELECT\n  2']
+
+    def test_migrate_applies_pending_only(self, path):
+        """Test that applied versions are skipped and new ones recorded"""
+        conn = FakeMigrationConnection(applied={1})
+        assert migrate(conn, path) == [(2, 'indexes')]
+        assert conn.executed == ['ALTER TABLE pilot ADD KEY idx_a (a)', 'ALTER TABLE pilot ADD KEY idx_b (b)']
+        assert migrate(conn, path) == []
+
+    def test_migrate_resumes_after_partial_failure(self, path):
+        """Test that a failed file is not recorded and re-running skips what it already did"""
+        conn = FakeMigrationConnection(errors={'idx_b': (1146, "Table 'pilot' doesn't exist")})
+        with pytest.raises(MigrationError, match='0002_indexes'):
+            migrate(conn, path)
+        assert conn.versions == {1}
+        conn.errors = {'idx_a': (1061, "Duplicate key name 'idx_a'")}
+        assert migrate(conn, path) == [(2, 'indexes')]
+
+    def test_index_checks_cover_indexed_fields(self):
+        """Test that every indexed SQL filter and sort gets an EXPLAIN check"""
+        descriptions = [check[0] for check in _index_checks()]
+        assert 'pilot: rank=' in descriptions
+        assert 'pilot: sort=name' in descriptions
+        assert 'ship s: min_speed=' in descriptions
+        assert 'ship s: ship_class_id=' in descriptions
+        assert 'pilot: name=' not in descriptions
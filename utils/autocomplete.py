@@ -0,0 +1,173 @@
+"""
+In-memory name index for search-as-you-type suggestions.
+
+Names are kept as case-folded keys in one sorted array, which is a trie
+flattened into sorted order: every trie node (a prefix) is a contiguous run
+of keys found with two binary searches. That gives:
+
+- prefix completion in O(log n + limit), by bisecting to the run for the
+  typed text and reading its first entries;
+- typo-tolerant completion, by walking the implicit trie depth-first while
+  carrying a Levenshtein row for the typed text. A branch is dropped as soon
+  as no extension of it can come within the allowed distance, and the first
+  character must match, so the walk stays within one small subtree.
+
+Besides each whole name, the index holds a key for each later word ('star
+destroyer' for 'Imperial Star Destroyer'), so typing any word finds the
+name. Suggestions are ranked: names starting with the text, then names with
+a word starting with it, then typo matches by distance.
+"""
+from bisect import bisect_left, bisect_right
+
+# Sorts after any character, closing the run of keys with a given prefix
+_END = '\U0010ffff'
+
+
+def _keys(name):
+    # (key, is word key) for a name: the whole name, then each later word start
+    folded = ' '.join(name.casefold().split())
+    keys = [(folded, False)]
+    for i, char in enumerate(folded):
+        if char == ' ' and i + 1 < len(folded):
+            keys.append((folded[i + 1:], True))
+    return keys
+
+
+def max_distance(text):
+    # Typos tolerated for a typed text: none for 1-2 characters, then 1, then 2
+    if len(text) < 3:
+        return 0
+    return 1 if len(text) < 8 else 2
+
+
+def _next_row(row, prev_row, text, char, prev_char):
+    # Edit distance row of text against a prefix extended by char, counting
+    # a swap of two adjacent characters as one edit (optimal string alignment)
+    next_row = [row[0] + 1]
+    for k in range(1, len(text) + 1):
+        cost = min(next_row[k - 1] + 1, row[k] + 1, row[k - 1] + (text[k - 1] != char))
+        if prev_row and k > 1 and text[k - 1] == prev_char and text[k - 2] == char:
+            cost = min(cost, prev_row[k - 2] + 1)
+        next_row.append(cost)
+    return next_row
+
+
+class NameIndex:
+    """
+    Sorted-array prefix index over (id, name) pairs, updatable in place.
+
+    Not thread-safe; callers serialize access.
+    """
+
+    def __init__(self, rows=()):
+        self._names = {}
+        entries = []
+        for row_id, name in rows:
+            if name:
+                self._names[row_id] = name
+                entries.extend((key, word, row_id) for key, word in _keys(name))
+        entries.sort()
+        # Parallel arrays, ordered by (key, is word key, id)
+        self._keys = [entry[0] for entry in entries]
+        self._words = [entry[1] for entry in entries]
+        self._ids = [entry[2] for entry in entries]
+
+    def __len__(self):
+        return len(self._names)
+
+    def add(self, row_id, name):
+        """Index a new name for row_id, replacing any previous one."""
+        self.remove(row_id)
+        if not name:
+            return
+        self._names[row_id] = name
+        for key, word in _keys(name):
+            i = bisect_left(self._keys, key)
+            # Keep equal keys ordered by (is word key, id)
+            while i < len(self._keys) and self._keys[i] == key and (self._words[i], self._ids[i]) < (word, row_id):
+                i += 1
+            self._keys.insert(i, key)
+            self._words.insert(i, word)
+            self._ids.insert(i, row_id)
+
+    def remove(self, row_id):
+        """Drop row_id's name, if indexed."""
+        name = self._names.pop(row_id, None)
+        if name is None:
+            return
+        for key, _ in _keys(name):
+            i = bisect_left(self._keys, key)
+            while self._keys[i] == key and self._ids[i] != row_id:
+                i += 1
+            del self._keys[i], self._words[i], self._ids[i]
+
+    def suggest(self, text, limit=10):
+        """
+        Return up to limit (id, name) suggestions for typed text.
+
+        Args:
+            text: What has been typed so far
+            limit: Maximum suggestions
+
+        Returns:
+            list: (id, name) pairs, best first
+        """
+        text = ' '.join(text.casefold().split())
+        if not text:
+            return []
+        found = []
+        seen = set()
+
+        def take(i):
+            row_id = self._ids[i]
+            if row_id not in seen:
+                seen.add(row_id)
+                found.append((row_id, self._names[row_id]))
+            return len(found) >= limit
+
+        # Exact prefix: whole names first, then word keys
+        lo = bisect_left(self._keys, text)
+        hi = bisect_right(self._keys, text + _END, lo)
+        for word in (False, True):
+            for i in range(lo, hi):
+                if self._words[i] == word and take(i):
+                    return found
+
+        # Typo matches, widening the distance only while more are needed
+        for distance in range(1, max_distance(text) + 1):
+            for _, i in sorted(self._fuzzy(text, distance)):
+                if take(i):
+                    return found
+        return found
+
+    def _fuzzy(self, text, max_dist):
+        # (distance, entry index) for runs of keys whose prefix is within
+        # max_dist edits of text, walking the implicit trie depth-first
+        keys = self._keys
+        results = []
+        limit = 64
+
+        def walk(prefix, row, prev_row, lo, hi):
+            if row[-1] <= max_dist:
+                # Every key in the run completes a close prefix
+                for i in range(lo, min(hi, lo + limit)):
+                    results.append((row[-1], i))
+                return
+            if min(row) > max_dist:
+                return
+            depth = len(prefix)
+            # Keys equal to the prefix sort first and have no child
+            i = bisect_right(keys, prefix, lo, hi)
+            while i < hi and len(results) < limit:
+                child = prefix + keys[i][depth]
+                j = bisect_right(keys, child + _END, i, hi)
+                walk(child, _next_row(row, prev_row, text, child[-1], prefix[-1]), row, i, j)
+                i = j
+
+        # The first character is taken as typed, as typos there are rare and
+        # matching it narrows the walk to one subtree
+        first = text[0]
+        lo = bisect_left(keys, first)
+        hi = bisect_right(keys, first + _END, lo)
+        walk(first, _next_row(range(len(text) + 1), None, text, first, None), None, lo, hi)
+        return results
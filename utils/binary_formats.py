@@ -0,0 +1,48 @@
+"""
+MessagePack and CBOR response bodies.
+
+Both are offered by format_response (format=msgpack / format=cbor, or an
+Accept header naming their media type) when their package is installed.
+MessagePack has no datetime or decimal type that fits naive MySQL values, so
+those are sent as in JSON (HTTP dates and strings). CBOR sends them as its
+standard tagged types: datetimes as RFC 3339 strings in UTC, dates as
+calendar dates and decimals as decimal fractions.
+"""
+import datetime
+
+from utils.encoders import Row, Rows, json_default
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # pragma: no cover - optional dependency
+    cbor2 = None
+
+
+def _plain(data):
+    # Payload with Rows / Row values turned into the dicts they stand for
+    if not isinstance(data, dict):
+        return data
+    return {key: value.to_dicts() if type(value) is Rows else value.to_dict() if type(value) is Row else value
+            for key, value in data.items()}
+
+
+def to_msgpack(data):
+    return msgpack.packb(_plain(data), default=json_default, use_bin_type=True)
+
+
+def to_cbor(data):
+    # Naive datetimes are UTC, as they are for the JSON HTTP dates
+    return cbor2.dumps(_plain(data), timezone=datetime.timezone.utc)
+
+
+# Format name -> (media type, encoder) for the installed packages
+FORMATS = {}
+if msgpack is not None:
+    FORMATS['msgpack'] = ('application/msgpack', to_msgpack)
+if cbor2 is not None:
+    FORMATS['cbor'] = ('application/cbor', to_cbor)
@@ -0,0 +1,141 @@
+"""
+Set-based statements for the bulk create and bulk update endpoints.
+
+Rows are written with one INSERT ... VALUES (...), (...), ... statement per
+batch, and updated with one UPDATE ... WHERE id IN (...) per distinct change
+set, instead of one statement and one commit per row. The caller owns the
+transaction: it commits once after every statement has run.
+"""
+# Rows per INSERT statement; keeps statements well below max_allowed_packet
+BATCH_SIZE = 1000
+
+# Cached result of the auto-increment lock mode check (the server setting
+# is read-only at runtime)
+_consecutive_ids = None
+
+
+def autoinc_ids_are_consecutive(cursor):
+    """
+    Whether a multi-row INSERT gets one consecutive block of auto-increment ids.
+
+    InnoDB guarantees this for lock modes 0 (traditional) and 1 (consecutive).
+    Mode 2 (interleaved, the MySQL 8 default) may hand out ids with gaps when
+    other sessions insert concurrently, so ids cannot be derived from lastrowid.
+    """
+    global _consecutive_ids
+    if _consecutive_ids is None:
+        cursor.execute('SELECT @@innodb_autoinc_lock_mode')
+        _consecutive_ids = int(cursor.fetchone()[0]) != 2
+    return _consecutive_ids
+
+
+def _open_snapshot(cursor, table):
+    # Start the transaction's consistent snapshot before its first INSERT;
+    # False if the isolation level does not keep one snapshot per transaction
+    cursor.execute(f'SELECT @@transaction_isolation, MAX(id) FROM {table}')
+    return cursor.fetchone()[0] == 'REPEATABLE-READ'
+
+
+def insert_many(cursor, table, columns, rows, returning_ids=True, batch_size=BATCH_SIZE):
+    """
+    Insert rows with batched multi-row INSERT statements.
+
+    When the auto-increment lock mode is interleaved, the ids are read back
+    after the last batch instead of being derived from lastrowid. The
+    transaction's REPEATABLE READ snapshot is opened before the first INSERT,
+    and ids are handed out in increasing order. So any other session's row
+    with an id at or above this call's first id committed after the snapshot
+    and is invisible: SELECT id ... WHERE id >= first id returns exactly the
+    rows inserted here, in row order.
+
+    Args:
+        cursor: Cursor inside the caller's transaction
+        table: Table name (its auto-increment key column is id)
+        columns: Column names (quoted where needed, e.g. `rank`)
+        rows: Sequence of value tuples in the order of columns
+        returning_ids: Return the generated auto-increment ids
+        batch_size: Rows per INSERT statement
+
+    Returns:
+        list: Generated ids in row order (empty when returning_ids is False)
+    """
+    read_back = returning_ids and bool(rows) and not autoinc_ids_are_consecutive(cursor)
+    if read_back and not _open_snapshot(cursor, table):
+        # Without a transaction-wide snapshot other sessions' rows would be
+        # read back too; only a single-row INSERT's lastrowid is exact then
+        read_back = False
+        batch_size = 1
+
+    column_sql = ', '.join(columns)
+    row_sql = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    ids = []
+    first_id = None
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        cursor.execute(
+            f'INSERT INTO {table} ({column_sql}) VALUES ' + ', '.join([row_sql] * len(batch)),
+            [value for row in batch for value in row])
+        if read_back:
+            if first_id is None:
+                first_id = cursor.lastrowid
+        elif returning_ids:
+            first_id = cursor.lastrowid
+            ids.extend(range(first_id, first_id + len(batch)))
+
+    if read_back:
+        cursor.execute(f'SELECT id FROM {table} WHERE id >= %s ORDER BY id', (first_id,))
+        ids = [row[0] for row in cursor.fetchall()]
+        if len(ids) != len(rows):
+            raise RuntimeError(f'Read back {len(ids)} {table} ids for {len(rows)} inserted rows')
+    return ids
+
+
+def set_clause(columns, changes):
+    """
+    Build the SET list of an UPDATE.
+
+    Args:
+        columns: Field name -> column (quoted where needed); fields not listed are ignored
+        changes: Field name -> new value
+
+    Returns:
+        tuple: (sql, values), e.g. ('name = %s, `rank` = %s', ['Jo', 'Ace'])
+    """
+    fields = [field for field in columns if field in changes]
+    return (', '.join(f'{columns[field]} = %s' for field in fields),
+            [changes[field] for field in fields])
+
+
+def update_grouped(cursor, table, columns, updates, batch_size=BATCH_SIZE):
+    """
+    Apply per-row changes with one UPDATE per distinct change set.
+
+    Rows whose changes are identical share a single
+    UPDATE table SET ... WHERE id IN (...) statement, so rebalancing hundreds
+    of rows to the same values costs one statement rather than hundreds.
+
+    Args:
+        cursor: Cursor inside the caller's transaction
+        table: Table name
+        columns: Field name -> column (quoted where needed)
+        updates: Sequence of (id, changes) pairs with unique ids
+        batch_size: Ids per UPDATE statement
+
+    Returns:
+        int: Rows matched (the connection reports found rows, not changed rows)
+    """
+    groups = {}
+    for row_id, changes in updates:
+        key = tuple((field, changes[field]) for field in columns if field in changes)
+        groups.setdefault(key, []).append(row_id)
+
+    matched = 0
+    for key, ids in groups.items():
+        set_sql, values = set_clause(columns, dict(key))
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            cursor.execute(
+                f'UPDATE {table} SET {set_sql} WHERE id IN (' + ', '.join(['%s'] * len(batch)) + ')',
+                values + batch)
+            matched += cursor.rowcount
+    return matched
@@ -0,0 +1,198 @@
+"""
+In-process entity cache for get-by-id lookups.
+
+Entries are keyed by (table, id) and bounded by both size (LRU eviction)
+and age (TTL). Each entry can carry tags naming the rows it was built from,
+e.g. a cached ship is tagged ('pilot', pilot_id) because it embeds the
+pilot's name, so renaming that pilot drops exactly the ships that show it.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Sentinel returned by get() on a miss (None is a legitimate cached value)
+MISSING = object()
+
+
+class EntityCache:
+    """
+    Bounded LRU/TTL cache with tag-based invalidation.
+
+    Args:
+        max_size: Maximum number of entries before the least recently used is evicted
+        ttl: Seconds an entry stays valid (bounds staleness from other processes)
+    """
+
+    def __init__(self, max_size=10000, ttl=60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        # key -> (value, expires_at, tags)
+        self._entries = OrderedDict()
+        # tag -> set of keys carrying it
+        self._tagged = {}
+        # Bumped by every invalidation; loads that raced one are not stored
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'invalidations': 0,
+        }
+
+    def _remove_locked(self, key):
+        value, expires_at, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tagged.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tagged[tag]
+
+    def get(self, key):
+        """Return the cached value for key, or MISSING."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return MISSING
+            if entry[1] <= time.monotonic():
+                self._remove_locked(key)
+                self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry[0]
+
+    def generation(self):
+        """Token to pass to set() so a load that raced an invalidation is dropped."""
+        with self._lock:
+            return self._generation
+
+    def set(self, key, value, tags=(), generation=None):
+        """
+        Store value under key.
+
+        Args:
+            key: Cache key, conventionally (table, id)
+            value: Value to cache
+            tags: Iterable of (table, id) tags the value depends on
+            generation: Token from generation() taken before loading value; if an
+                invalidation happened since, the value may be stale and is not stored
+        """
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            if key in self._entries:
+                self._remove_locked(key)
+            tags = tuple(tags)
+            self._entries[key] = (value, time.monotonic() + self.ttl, tags)
+            for tag in tags:
+                self._tagged.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove_locked(oldest)
+                self._stats['evictions'] += 1
+
+    def get_or_load(self, key, loader, tags=None):
+        """
+        Read-through lookup.
+
+        Args:
+            key: Cache key
+            loader: Callable returning the value from the database
+            tags: Optional callable mapping the loaded value to its tags
+
+        Returns:
+            The cached or loaded value. None results are returned but not cached.
+        """
+        value = self.get(key)
+        if value is not MISSING:
+            return value
+        generation = self.generation()
+        value = loader()
+        if value is not None:
+            self.set(key, value, tags(value) if tags else (), generation)
+        return value
+
+    def get_many_or_load(self, table, ids, loader, tags=None):
+        """
+        Read-through lookup of several (table, id) keys with one load for all misses.
+
+        Args:
+            table: Table part of the keys
+            ids: Ids to look up
+            loader: Callable taking the list of missed ids and returning a
+                dict of id -> value for those that exist
+            tags: Optional callable mapping a loaded value to its tags
+
+        Returns:
+            dict: id -> value for every id that was cached or loaded
+        """
+        found = {}
+        missing = []
+        for id_ in ids:
+            value = self.get((table, id_))
+            if value is MISSING:
+                missing.append(id_)
+            else:
+                found[id_] = value
+        if missing:
+            generation = self.generation()
+            for id_, value in loader(missing).items():
+                self.set((table, id_), value, tags(value) if tags else (), generation)
+                found[id_] = value
+        return found
+
+    def invalidate(self, *keys):
+        """Drop the given keys."""
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                if key in self._entries:
+                    self._remove_locked(key)
+                    self._stats['invalidations'] += 1
+
+    def invalidate_tag(self, *tags):
+        """Drop every entry carrying any of the given tags."""
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                for key in list(self._tagged.get(tag, ())):
+                    self._remove_locked(key)
+                    self._stats['invalidations'] += 1
+
+    def invalidate_table(self, table):
+        """Drop every entry whose key belongs to table."""
+        with self._lock:
+            self._generation += 1
+            for key in [key for key in self._entries if key[0] == table]:
+                self._remove_locked(key)
+                self._stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._tagged.clear()
+
+    def stats(self):
+        """Return a snapshot of cache counters."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+            stats['max_size'] = self.max_size
+            stats['ttl'] = self.ttl
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+# Shared cache used by the model get_by_id functions
+entity_cache = EntityCache(
+    max_size=int(os.getenv('ENTITY_CACHE_SIZE', 10000)),
+    ttl=float(os.getenv('ENTITY_CACHE_TTL', 60)),
+)
@@ -0,0 +1,139 @@
+"""
+Columnar JSON responses (format=columnar) for analytics clients.
+
+A list of rows is sent as one array per column instead of one object per
+row, so key names are written once per batch rather than once per row:
+
+    {"ships": {"columns": ["id", "name", "ship_class_name"],
+               "dictionary_columns": ["ship_class_name"],
+               "batches": [{"length": 3,
+                            "dictionaries": {"ship_class_name": ["fighter", "hauler"]},
+                            "values": [[1, 2, 3], ["A", "B", "C"], [0, 1, 0]]}]}}
+
+String columns with few distinct values (class names, pilot names, ...) are
+dictionary-encoded: their array holds integer codes (null stays null) into a
+dictionary. Dictionaries grow across batches; each batch only carries the
+entries it adds, so a client appends them and codes stay valid for the
+whole list. A buffered response is one batch, a streamed response one batch
+per BATCH_ROWS rows, with the encoded columns chosen from the first batch.
+Single records and other values are written as plain JSON.
+"""
+import json
+from json.encoder import encode_basestring_ascii
+
+from utils.encoders import Row, Rows, encode_value, json_default
+
+# Rows per batch of a streamed response
+BATCH_ROWS = 1000
+
+# A string column is dictionary-encoded when its distinct values are at most
+# this share of its rows
+MAX_DISTINCT_SHARE = 0.5
+
+
+def _encode_array(values):
+    # A whole column in one call to the C encoder, with jsonify's value rules
+    return json.dumps(values, default=json_default, separators=(',', ':'), sort_keys=True)
+
+
+def is_low_cardinality(values):
+    # True for a column of strings (and nulls) with few distinct values
+    strings = [value for value in values if value is not None]
+    if not strings or any(type(value) is not str for value in strings):
+        return False
+    return len(set(strings)) <= len(values) * MAX_DISTINCT_SHARE
+
+
+class ColumnBatches:
+    """
+    Encodes row tuples sharing one column list as columnar batches.
+
+    Args:
+        columns: Column names, in row order
+        sample: Rows the dictionary-encoded columns are chosen from (usually
+            the first batch)
+    """
+
+    def __init__(self, columns, sample):
+        self.columns = tuple(columns)
+        sample_columns = list(zip(*sample)) if sample else []
+        self.dictionary_columns = tuple(
+            index for index, values in enumerate(sample_columns) if is_low_cardinality(values))
+        # Column index -> {value: code}, shared by every batch
+        self.codes = {index: {} for index in self.dictionary_columns}
+
+    def header(self):
+        # JSON text of the list object up to its batches array
+        names = [encode_basestring_ascii(str(column)) for column in self.columns]
+        return ('{"columns":[' + ','.join(names) + '],"dictionary_columns":['
+                + ','.join(names[index] for index in self.dictionary_columns) + '],"batches":[')
+
+    def batch(self, rows):
+        # JSON text of one batch of row tuples
+        values = list(zip(*rows))
+        arrays = []
+        added = []
+        for index, column in enumerate(values):
+            codes = self.codes.get(index)
+            if codes is None:
+                arrays.append(_encode_array(column))
+                continue
+            known = len(codes)
+            encoded = [None if value is None else codes.setdefault(value, len(codes)) for value in column]
+            arrays.append(_encode_array(encoded))
+            new = list(codes)[known:]
+            if new:
+                added.append(encode_basestring_ascii(str(self.columns[index])) + ':' + _encode_array(new))
+        return ('{"length":' + str(len(rows)) + ',"dictionaries":{' + ','.join(added)
+                + '},"values":[' + ','.join(arrays) + ']}')
+
+
+def encode_rows(rows, columns):
+    # JSON text of a whole list of row tuples as one batch
+    rows = list(rows)
+    batches = ColumnBatches(columns, rows)
+    return batches.header() + (batches.batch(rows) if rows else '') + ']}'
+
+
+def _as_rows(value):
+    # A list of dicts with the same keys (expanded rows) as (rows, columns)
+    if not value or not all(type(item) is dict for item in value):
+        return None
+    columns = tuple(value[0])
+    if any(tuple(item) != columns for item in value):
+        return None
+    return [tuple(item.values()) for item in value], columns
+
+
+def _encode_payload_value(value):
+    if type(value) is Rows:
+        return encode_rows(value.rows, value.columns)
+    if type(value) is Row:
+        return encode_value(value.to_dict())
+    if type(value) is list:
+        rows = _as_rows(value)
+        if rows is not None:
+            return encode_rows(*rows)
+    return encode_value(value)
+
+
+def dumps(data):
+    """Serialize a response payload to columnar JSON text."""
+    if not isinstance(data, dict):
+        return _encode_payload_value(data)
+    return '{' + ','.join(encode_basestring_ascii(str(key)) + ':' + _encode_payload_value(value)
+                          for key, value in data.items()) + '}'
+
+
+def iter_columnar_rows(key, rows, columns):
+    # Yield a columnar JSON document {"<key>": {...}} batch by batch
+    rows = iter(rows)
+    batch = [row for _, row in zip(range(BATCH_ROWS), rows)]
+    batches = ColumnBatches(columns, batch)
+    yield '{%s:' % encode_basestring_ascii(str(key)) + batches.header()
+    separator = ''
+    while batch:
+        yield separator + batches.batch(batch)
+        separator = ','
+        batch = [row for _, row in zip(range(BATCH_ROWS), rows)]
+    yield ']}}'
@@ -0,0 +1,218 @@
+"""
+Response compression negotiated from Accept-Encoding.
+
+Bodies of at least COMPRESS_MIN_SIZE bytes are compressed with the best
+coding the client accepts: brotli (br) and zstd when their packages are
+installed, gzip always. Streamed responses are compressed chunk by chunk,
+each chunk flushed so the client can decode rows as they arrive.
+
+Compressing the same large list again for every client is wasted CPU, so
+compressed bodies of GET responses that carry an ETag (the conditional,
+cacheable endpoints, see utils/etag.py) are kept in a byte-bounded LRU keyed
+by (ETag, coding): the ETag changes whenever the body can, so a repeat
+request reuses the stored bytes. A compressed response gets a weak ETag (the
+compressed bytes are not the identity representation); If-None-Match is
+compared weakly, so it still revalidates.
+"""
+import threading
+import zlib
+from collections import OrderedDict
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+
+class _Gzip:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        # Compressed bytes of data, flushed so they can be decoded on their own
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _Brotli:
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class _Zstd:
+    def __init__(self, level):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+# Coding -> (streaming compressor class, default level), in order of
+# preference when the client accepts several equally
+CODINGS = OrderedDict()
+if brotli is not None:
+    CODINGS['br'] = (_Brotli, 5)
+if zstandard is not None:
+    CODINGS['zstd'] = (_Zstd, 3)
+CODINGS['gzip'] = (_Gzip, 6)
+
+
+def negotiate_encoding():
+    # The coding to use for the current request, or None for identity
+    return request.accept_encodings.best_match(CODINGS)
+
+
+def compress(data, coding, level=None):
+    """Compress a whole body with the given coding."""
+    compressor_class, default_level = CODINGS[coding]
+    compressor = compressor_class(default_level if level is None else level)
+    return compressor.compress(data) + compressor.finish()
+
+
+def iter_compressed(chunks, coding, level=None):
+    # Compress an iterator of str/bytes chunks incrementally
+    compressor_class, default_level = CODINGS[coding]
+    compressor = compressor_class(default_level if level is None else level)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class CompressedBodyCache:
+    """
+    LRU of compressed bodies bounded by their total size.
+
+    Args:
+        max_bytes: Total compressed bytes kept before the least recently used
+            body is evicted (0 disables the cache)
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._bodies = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, key):
+        """Return the body stored for key, or None."""
+        with self._lock:
+            body = self._bodies.get(key)
+            if body is None:
+                self._stats['misses'] += 1
+                return None
+            self._bodies.move_to_end(key)
+            self._stats['hits'] += 1
+            return body
+
+    def set(self, key, body):
+        with self._lock:
+            if len(body) > self.max_bytes:
+                return
+            old = self._bodies.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._bodies[key] = body
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, evicted = self._bodies.popitem(last=False)
+                self._size -= len(evicted)
+                self._stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._bodies.clear()
+            self._size = 0
+
+    def stats(self):
+        """Return a snapshot of cache counters."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._bodies)
+            stats['bytes'] = self._size
+            stats['max_bytes'] = self.max_bytes
+        return stats
+
+
+class Compression:
+    """
+    Flask extension compressing responses after each request.
+
+    Configuration keys:
+        COMPRESS_MIN_SIZE: Smallest body, in bytes, that is compressed
+            (streamed bodies are always compressed)
+        COMPRESS_LEVEL: Level for every coding, None for each coding's default
+        COMPRESS_CACHE_BYTES: Size of the compressed body cache
+    """
+
+    def __init__(self, app=None):
+        self.cache = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_MIN_SIZE', 1024)
+        app.config.setdefault('COMPRESS_LEVEL', None)
+        app.config.setdefault('COMPRESS_CACHE_BYTES', 64 * 1024 * 1024)
+
+        self.min_size = int(app.config['COMPRESS_MIN_SIZE'])
+        self.level = app.config['COMPRESS_LEVEL']
+        self.cache = CompressedBodyCache(int(app.config['COMPRESS_CACHE_BYTES']))
+        app.after_request(self.compress_response)
+
+    def compress_response(self, response):
+        # after_request hook: compress the body if the client accepts it
+        if (response.status_code < 200 or response.status_code in (204, 304)
+                or response.direct_passthrough or 'Content-Encoding' in response.headers):
+            return response
+        streamed = response.is_streamed
+        if not streamed and response.calculate_content_length() < self.min_size:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        coding = negotiate_encoding()
+        if coding is None:
+            return response
+
+        etag, weak = response.get_etag()
+        if streamed:
+            response.response = iter_compressed(response.response, coding, self.level)
+            response.headers.pop('Content-Length', None)
+        else:
+            cacheable = etag and not weak and request.method == 'GET' and response.status_code == 200
+            body = self.cache.get((etag, coding)) if cacheable else None
+            if body is None:
+                body = compress(response.get_data(), coding, self.level)
+                if cacheable:
+                    self.cache.set((etag, coding), body)
+            response.set_data(body)
+        response.headers['Content-Encoding'] = coding
+        if etag:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def stats(self):
+        """Return the compressed body cache counters."""
+        return self.cache.stats()
@@ -0,0 +1,357 @@
+"""
+MySQL connection pooling.
+
+The pool hands out MySQLdb connections to requests and keeps them open
+between requests, so a request no longer pays connection setup. PooledMySQL
+is a drop-in replacement for flask_mysqldb.MySQL: model functions keep using
+mysql.connection, which checks a connection out of the pool on first use and
+returns it when the app context is torn down.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import MySQLdb
+import MySQLdb.cursors
+from MySQLdb.constants import CLIENT
+from flask import g
+
+from utils.statements import PreparedConnection, statement_stats
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection becomes free before the checkout timeout."""
+
+
+class ConnectionPool:
+    """
+    Bounded pool of MySQLdb connections.
+
+    Args:
+        connect_kwargs: Keyword arguments passed to MySQLdb.connect
+        min_size: Connections opened at warmup and never reaped
+        max_size: Hard cap on open connections
+        timeout: Seconds a checkout waits for a free connection
+        idle_timeout: Seconds an idle connection above min_size is kept
+        ping_interval: Connections idle longer than this are pinged on checkout
+        statement_cache_size: Prepared statements kept per connection (0 disables
+            them)
+    """
+
+    def __init__(self, connect_kwargs, min_size=2, max_size=10, timeout=5.0,
+                 idle_timeout=300.0, ping_interval=5.0, statement_cache_size=0):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError('Pool sizes must satisfy 0 <= min_size <= max_size, max_size >= 1')
+
+        self.connect_kwargs = dict(connect_kwargs)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+        self.statement_cache_size = statement_cache_size
+
+        # Idle connections as (connection, returned_at); newest on the right
+        self._idle = deque()
+        self._size = 0
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'total_wait_time': 0.0,
+            'max_wait_time': 0.0,
+            'created': 0,
+            'closed': 0,
+            'reaped': 0,
+            'health_check_failures': 0,
+        }
+
+    def _connect(self):
+        conn = MySQLdb.connect(**self.connect_kwargs)
+        if self.statement_cache_size:
+            conn = PreparedConnection(conn, self.statement_cache_size)
+        with self._cond:
+            self._stats['created'] += 1
+        return conn
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._stats['closed'] += 1
+
+    def _reap_idle_locked(self, now):
+        # Take connections idle past idle_timeout out of the pool, oldest
+        # first, down to min_size; the caller closes them after releasing
+        # the lock
+        reaped = []
+        while (self._idle and self._size > self.min_size
+               and now - self._idle[0][1] > self.idle_timeout):
+            conn, _ = self._idle.popleft()
+            self._size -= 1
+            self._stats['reaped'] += 1
+            reaped.append(conn)
+        return reaped
+
+    def warmup(self):
+        """Open connections until the pool holds min_size of them."""
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def checkout(self):
+        """
+        Take a connection from the pool, opening one if under max_size.
+
+        Raises:
+            PoolTimeoutError: If the pool is exhausted for longer than timeout
+        """
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+
+        while True:
+            conn = None
+            returned_at = None
+            create = False
+            reaped = []
+            try:
+                with self._cond:
+                    while True:
+                        now = time.monotonic()
+                        reaped += self._reap_idle_locked(now)
+                        if self._idle:
+                            # LIFO keeps the hottest connections busy and lets
+                            # the cold end age out through reaping
+                            conn, returned_at = self._idle.pop()
+                            break
+                        if self._size < self.max_size:
+                            self._size += 1
+                            create = True
+                            break
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            self._stats['timeouts'] += 1
+                            raise PoolTimeoutError(
+                                f'No database connection available within {self.timeout}s '
+                                f'(pool size {self.max_size})')
+                        waited = True
+                        self._cond.wait(remaining)
+                    self._in_use += 1
+            finally:
+                # Closing talks to the server, so it must not hold up other
+                # checkouts and checkins waiting on the lock
+                for stale in reaped:
+                    self._close(stale)
+
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._in_use -= 1
+                        self._cond.notify()
+                    raise
+            elif time.monotonic() - returned_at > self.ping_interval:
+                # Health check: a connection that sat idle may have been
+                # dropped by the server (wait_timeout) or the network
+                try:
+                    conn.ping()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._in_use -= 1
+                        self._stats['health_check_failures'] += 1
+                        self._cond.notify()
+                    self._close(conn)
+                    continue
+
+            wait_time = time.monotonic() - started
+            with self._cond:
+                self._stats['checkouts'] += 1
+                if waited:
+                    self._stats['waits'] += 1
+                self._stats['total_wait_time'] += wait_time
+                self._stats['max_wait_time'] = max(self._stats['max_wait_time'], wait_time)
+            return conn
+
+    def checkin(self, conn, discard=False):
+        """
+        Return a connection to the pool.
+
+        Any open transaction is rolled back so the next borrower starts clean.
+        A connection that fails the rollback, or is passed with discard=True,
+        is closed instead of being reused.
+        """
+        if not discard:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            if discard:
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+        if discard:
+            self._close(conn)
+
+    def close_all(self):
+        """Close every idle connection (connections in use are left alone)."""
+        with self._cond:
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+        for conn in idle:
+            self._close(conn)
+
+    def stats(self):
+        """Return a snapshot of pool counters."""
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'size': self._size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+            })
+        checkouts = stats['checkouts']
+        stats['avg_wait_time'] = stats['total_wait_time'] / checkouts if checkouts else 0.0
+        return stats
+
+
+class PooledMySQL:
+    """
+    Flask extension exposing a pooled MySQL connection as mysql.connection.
+
+    Configuration keys (all optional except the MYSQL_* credentials):
+        MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DB, MYSQL_CHARSET
+        MYSQL_POOL_MIN_SIZE, MYSQL_POOL_MAX_SIZE, MYSQL_POOL_TIMEOUT,
+        MYSQL_POOL_IDLE_TIMEOUT, MYSQL_POOL_PING_INTERVAL,
+        MYSQL_STATEMENT_CACHE_SIZE (prepared statements per connection, 0 disables)
+    """
+
+    def __init__(self, app=None):
+        self.pool = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MYSQL_HOST', 'localhost')
+        app.config.setdefault('MYSQL_PORT', 3306)
+        app.config.setdefault('MYSQL_USER', None)
+        app.config.setdefault('MYSQL_PASSWORD', None)
+        app.config.setdefault('MYSQL_DB', None)
+        app.config.setdefault('MYSQL_CHARSET', 'utf8')
+        app.config.setdefault('MYSQL_POOL_MIN_SIZE', 2)
+        app.config.setdefault('MYSQL_POOL_MAX_SIZE', 10)
+        app.config.setdefault('MYSQL_POOL_TIMEOUT', 5.0)
+        app.config.setdefault('MYSQL_POOL_IDLE_TIMEOUT', 300.0)
+        app.config.setdefault('MYSQL_POOL_PING_INTERVAL', 5.0)
+        app.config.setdefault('MYSQL_STATEMENT_CACHE_SIZE', 64)
+
+        connect_kwargs = {
+            'host': app.config['MYSQL_HOST'],
+            'port': int(app.config['MYSQL_PORT']),
+            'charset': app.config['MYSQL_CHARSET'],
+            # UPDATE rowcount counts matched rows, so an update that sets a
+            # row to its current values still reports the row as found
+            'client_flag': CLIENT.FOUND_ROWS,
+        }
+        statement_cache_size = int(app.config['MYSQL_STATEMENT_CACHE_SIZE'])
+        if app.config['MYSQL_USER']:
+            connect_kwargs['user'] = app.config['MYSQL_USER']
+        if app.config['MYSQL_PASSWORD']:
+            connect_kwargs['passwd'] = app.config['MYSQL_PASSWORD']
+        if app.config['MYSQL_DB']:
+            connect_kwargs['db'] = app.config['MYSQL_DB']
+
+        self.pool = ConnectionPool(
+            connect_kwargs,
+            min_size=int(app.config['MYSQL_POOL_MIN_SIZE']),
+            max_size=int(app.config['MYSQL_POOL_MAX_SIZE']),
+            timeout=float(app.config['MYSQL_POOL_TIMEOUT']),
+            idle_timeout=float(app.config['MYSQL_POOL_IDLE_TIMEOUT']),
+            ping_interval=float(app.config['MYSQL_POOL_PING_INTERVAL']),
+            statement_cache_size=statement_cache_size,
+        )
+
+        # Pre-warm so the first requests don't pay connection setup. The app
+        # must still start when the database is down; checkouts will retry.
+        try:
+            self.pool.warmup()
+        except Exception as e:
+            logger.warning('MySQL pool warmup failed: %s', e)
+
+    @property
+    def connection(self):
+        """Connection bound to the current app context, checked out lazily."""
+        conn = g.get('_mysql_connection')
+        if conn is None:
+            conn = self.pool.checkout()
+            g._mysql_connection = conn
+        return conn
+
+    def release(self, error=None):
+        """Return the app context's connection (if any) to the pool."""
+        conn = g.pop('_mysql_connection', None)
+        if conn is not None:
+            self.pool.checkin(conn)
+
+    @contextmanager
+    def server_side_cursor(self):
+        """
+        Unbuffered (SSCursor) cursor on a dedicated pooled connection.
+
+        Used by streaming responses, which outlive the request's app context.
+        Rows are read from the socket as they are fetched instead of being
+        buffered client-side. If the caller stops before the result is fully
+        read (e.g. the client disconnected), the connection still has unread
+        rows on the wire, so it is closed rather than returned to the pool.
+        """
+        conn = self.pool.checkout()
+        completed = False
+        try:
+            cursor = conn.cursor(MySQLdb.cursors.SSCursor)
+            yield cursor
+            cursor.close()
+            completed = True
+        finally:
+            self.pool.checkin(conn, discard=not completed)
+
+    def stats(self):
+        """Pool statistics for diagnostics endpoints."""
+        return self.pool.stats()
+
+    def statement_stats(self):
+        """Prepared statement counters for diagnostics endpoints."""
+        stats = statement_stats.stats()
+        stats['cache_size'] = self.pool.statement_cache_size
+        return stats
@@ -0,0 +1,128 @@
+"""
+Precompiled JSON encoders for database rows.
+
+List and detail endpoints used to turn every row tuple into a dict and hand
+the payload to jsonify, which walks each dict again. Handlers now wrap their
+row tuples in Rows / Row, and the encoder of the column list (PILOT_COLUMNS,
+SHIP_COLUMNS, a sparse fieldset, ...) writes them straight to JSON: the
+object template, with its escaped keys, is built once per column tuple and
+each row only fills in its encoded values. Values are encoded the way
+jsonify does it (datetimes as HTTP dates, Decimals as strings, non-ASCII
+escaped); NULLs, including those of an unmatched LEFT JOIN, become null.
+"""
+import datetime
+import decimal
+import json
+import math
+from functools import lru_cache
+from json.encoder import encode_basestring_ascii
+
+from werkzeug.http import http_date
+
+
+class Rows:
+    """Row tuples of a list response, sharing one column list."""
+
+    __slots__ = ('rows', 'columns')
+
+    def __init__(self, rows, columns):
+        self.rows = rows
+        self.columns = tuple(columns)
+
+    def to_dicts(self):
+        return [dict(zip(self.columns, row)) for row in self.rows]
+
+
+class Row:
+    """One row tuple of a detail response."""
+
+    __slots__ = ('values', 'columns')
+
+    def __init__(self, values, columns):
+        self.values = values
+        self.columns = tuple(columns)
+
+    def to_dict(self):
+        return dict(zip(self.columns, self.values))
+
+
+def json_default(value):
+    # Serialize values json.dumps can't handle, the same way Flask's jsonify does
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return http_date(value)
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def _encode_other(value):
+    # Any value without a fast path (nested dicts and lists, subclasses, ...)
+    return json.dumps(value, default=json_default, separators=(',', ':'), sort_keys=True)
+
+
+def _encode_float(value):
+    # NaN and infinities are spelled the way json.dumps spells them
+    return float.__repr__(value) if math.isfinite(value) else _encode_other(value)
+
+
+# Fast paths for the column types MySQLdb returns, keyed by exact type
+_VALUE_ENCODERS = {
+    int: int.__repr__,
+    str: encode_basestring_ascii,
+    type(None): lambda value: 'null',
+    float: _encode_float,
+    bool: lambda value: 'true' if value else 'false',
+    datetime.datetime: lambda value: encode_basestring_ascii(http_date(value)),
+    datetime.date: lambda value: encode_basestring_ascii(http_date(value)),
+    decimal.Decimal: lambda value: encode_basestring_ascii(str(value)),
+}
+
+
+def encode_value(value):
+    # JSON text of one value
+    return _VALUE_ENCODERS.get(type(value), _encode_other)(value)
+
+
+class RowEncoder:
+    """Precompiled JSON object template for rows sharing one column list."""
+
+    def __init__(self, columns):
+        self.columns = tuple(columns)
+        keys = [encode_basestring_ascii(str(column)).replace('%', '%%') for column in self.columns]
+        self.template = '{' + ','.join(key + ':%s' for key in keys) + '}'
+
+    def encode(self, values):
+        # Encode one row's values (in column order) as a JSON object
+        get = _VALUE_ENCODERS.get
+        return self.template % tuple([get(type(value), _encode_other)(value) for value in values])
+
+    def encode_many(self, rows):
+        # Encode row tuples as a JSON array of objects
+        return '[' + ','.join(map(self.encode, rows)) + ']'
+
+
+@lru_cache(maxsize=128)
+def row_encoder(columns):
+    # Shared encoder per column tuple (PILOT_COLUMNS, SHIP_COLUMNS, ...)
+    return RowEncoder(columns)
+
+
+def _encode_payload_value(value):
+    if type(value) is Rows:
+        return row_encoder(value.columns).encode_many(value.rows)
+    if type(value) is Row:
+        return row_encoder(value.columns).encode(value.values)
+    return encode_value(value)
+
+
+def dumps(data):
+    """
+    Serialize a response payload to JSON text.
+
+    Rows and Row values of the top-level dict go through the encoder of
+    their column list; everything else is encoded like jsonify would.
+    """
+    if not isinstance(data, dict):
+        return _encode_payload_value(data)
+    return '{' + ','.join(encode_basestring_ascii(str(key)) + ':' + _encode_payload_value(value)
+                          for key, value in data.items()) + '}'
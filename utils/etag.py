@@ -0,0 +1,85 @@
+"""
+Conditional GET support.
+
+The ETag of a GET response is a hash of the request path, its query
+parameters (filters, pagination), its response format and the change counters of the
+tables the endpoint reads. It is computed before the view runs, so a
+matching If-None-Match is answered with 304 without querying the database
+or serializing a body. It is computed again once the view returns: if a
+write bumped the counters meanwhile, the body may show the tables before or
+after it, so the response goes out without an ETag and is not cached.
+
+The counters only see writes made by this process, so an ETag would stay
+valid forever for a row another worker changed. ETags therefore also carry
+the current ETAG_TTL period: every ETAG_TTL seconds they all change and the
+next request is answered in full, which bounds how long a 304 can hide such
+a write (0 disables this for single-process deployments). Other anonymous requests are answered from the
+response cache (utils/response_cache.py) when it holds their response.
+"""
+import hashlib
+import os
+import time
+from functools import wraps
+
+from flask import Response, make_response, request
+
+from utils.formatters import response_format
+from utils.response_cache import response_cache
+from utils.versions import table_versions
+
+# Seconds an ETag stays valid without a local write (0 = until one)
+ETAG_TTL = float(os.getenv('ETAG_TTL', 60))
+
+
+def compute_etag(tables):
+    # Strong ETag for the current request given the tables it reads
+    args = sorted((name, value) for name, value in request.args.items(multi=True)
+                  if name != 'format')
+    key = repr((
+        table_versions.epoch,
+        request.path,
+        response_format(),
+        args,
+        table_versions.get(*tables),
+        int(time.time() // ETAG_TTL) if ETAG_TTL > 0 else 0,
+    ))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def conditional(*tables):
+    """
+    Decorator adding ETag / If-None-Match handling and response caching to a
+    GET view.
+
+    Args:
+        tables: Names of the tables whose changes can alter the response
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = compute_etag(tables)
+            # Weak comparison: a compressed response carried W/"<etag>"
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+                response.set_etag(etag, weak=not request.if_none_match.contains(etag))
+                response.vary.add('Accept')
+                return response
+
+            key = response_cache.key()
+            response = response_cache.get(key) if key else None
+            if response is None:
+                generation = response_cache.generation()
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                response.vary.add('Accept')
+                if compute_etag(tables) != etag:
+                    # A write landed while the view ran
+                    return response
+                if key:
+                    response_cache.store(key, response, tables, generation)
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,114 @@
+"""
+Related-record expansion (?expand=pilot,weapons.weapon_class).
+
+A list or detail endpoint can embed related records in its rows, so a
+client does not fetch them one request per row. Each endpoint declares its
+relations as a tree of Relation entries. Expansion is batched: the ids a
+relation needs are collected from every row of the page first and loaded
+with one call (one IN (...) query, or a reference snapshot lookup), so the
+number of queries depends on the relations requested, not on the page
+size. A nested path (weapons.weapon_class) expands the records embedded by
+its parent in the same way.
+"""
+from flask import request
+
+
+class Relation:
+    """
+    A related record, or list of records, embedded under the relation's name.
+
+    Args:
+        key: Row field holding the related id (the row's own id for
+            one-to-many relations)
+        load: load(mysql, ids) -> {id: record dict, or list of them}
+        many: Whether the relation is a list (empty when nothing is found)
+        nested: Relation name -> Relation of the embedded records
+    """
+
+    def __init__(self, key, load, many=False, nested=None):
+        self.key = key
+        self.load = load
+        self.many = many
+        self.nested = nested or {}
+
+
+def paths(relations, prefix=''):
+    # Every relation path of a relation tree, parents first
+    for name, relation in relations.items():
+        yield prefix + name
+        yield from paths(relation.nested, f'{prefix}{name}.')
+
+
+def parse_expand(relations):
+    """
+    Read the `expand` query parameter.
+
+    Args:
+        relations: Relation name -> Relation of the endpoint
+
+    Returns:
+        frozenset: Requested paths, including the parents of nested ones
+            (empty when nothing was requested)
+
+    Raises:
+        ValueError: If a requested path is not one of the relations
+    """
+    raw = request.args.get('expand')
+    if not raw:
+        return frozenset()
+
+    valid = list(paths(relations))
+    requested = {path.strip() for path in raw.split(',') if path.strip()}
+    unknown = sorted(requested.difference(valid))
+    if unknown:
+        raise ValueError(f"Unknown expand path(s): {', '.join(unknown)}. "
+                         f"Valid paths: {', '.join(valid)}")
+
+    # weapons.weapon_class needs weapons
+    for path in list(requested):
+        while '.' in path:
+            path = path.rsplit('.', 1)[0]
+            requested.add(path)
+    return frozenset(requested)
+
+
+def required_fields(relations, expand):
+    # Row fields the top-level relations in expand read their ids from, to
+    # be kept in a sparse fieldset
+    return tuple(relation.key for name, relation in relations.items() if name in expand)
+
+
+def expand_rows(mysql, rows, relations, expand, prefix=''):
+    """
+    Embed the requested relations into row dicts, in place.
+
+    Args:
+        mysql: Database handle passed to the loaders
+        rows: Row dicts of one page
+        relations: Relation name -> Relation
+        expand: Paths from parse_expand()
+        prefix: Path of the relation whose records rows are (for nesting)
+
+    Returns:
+        list: rows
+    """
+    for name, relation in relations.items():
+        path = prefix + name
+        if path not in expand:
+            continue
+        ids = list(dict.fromkeys(row[relation.key] for row in rows if row.get(relation.key) is not None))
+        loaded = relation.load(mysql, ids) if ids else {}
+        embedded = []
+        for row in rows:
+            value = loaded.get(row.get(relation.key))
+            if relation.many:
+                # Each row gets its own list, so nested expansion stays per row
+                value = [dict(record) for record in value or ()]
+                embedded.extend(value)
+            elif value is not None:
+                value = dict(value)
+                embedded.append(value)
+            row[name] = value
+        if relation.nested and embedded:
+            expand_rows(mysql, embedded, relation.nested, expand, path + '.')
+    return rows
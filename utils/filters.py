@@ -0,0 +1,421 @@
+"""
+Declarative filtering and sorting for list endpoints.
+
+Each model declares its filterable columns once as a FilterSpec of Field
+entries. The spec reads the matching query arguments (name=..., min_speed=...,
+sort=-speed,name), and turns the result into either a parameterized SQL query
+or, for tables served from the reference snapshot, an in-memory predicate and
+sort key. Making a column filterable is a one-line Field change.
+
+Sorted lists stay keyset-paginated: the sort always ends with the key column,
+so the cursor holds the sort values of the last row and the next page starts
+strictly after them.
+
+'match' fields are text searched (utils/textsearch.py). A list filtered by
+one is ordered by relevance unless sort= says otherwise. In SQL a search
+uses the table's FULLTEXT index for the tokens the index holds and a word
+boundary REGEXP for the rest, so the SQL text also depends on the shape of
+each search term.
+"""
+import threading
+from functools import cmp_to_key
+
+from utils import textsearch
+
+# Operator -> (query parameter pattern, SQL condition pattern)
+OPERATORS = {
+    'eq': ('{}', '{} = %s'),
+    'like': ('{}', '{} LIKE %s'),
+    'match': ('{}', 'MATCH({}) AGAINST(%s IN BOOLEAN MODE)'),
+    'min': ('min_{}', '{} >= %s'),
+    'max': ('max_{}', '{} <= %s'),
+}
+
+# Compiled SQL texts kept per spec (one per distinct filter/sort shape)
+SQL_CACHE_SIZE = 256
+
+# Sort name for the relevance tier of a text search (not a column)
+RELEVANCE = 'relevance'
+
+
+class Field:
+    """
+    A filterable and/or sortable column.
+
+    Args:
+        column: SQL expression for the column (defaults to the field name)
+        type: Value type, int or str
+        ops: Supported operators: 'eq' (name=), 'like' (name=, partial match),
+            'match' (name=, token/prefix text search; in SQL served by the
+            table's FULLTEXT index when it has one), 'min' (min_name=) and
+            'max' (max_name=)
+        sortable: Whether the field may appear in sort=
+        indexed: Whether an index backs the column, so filtering or sorting on
+            it does not scan the table
+        index: Position of the column in a full row, for in-memory evaluation
+    """
+
+    def __init__(self, column=None, type=int, ops=('eq',), sortable=False, indexed=False, index=None):
+        self.column = column
+        self.type = type
+        self.ops = tuple(ops)
+        self.sortable = sortable
+        self.indexed = indexed
+        self.index = index
+
+
+class Query:
+    """Parsed filter criteria and sort order for one request."""
+
+    def __init__(self, spec, criteria, sort):
+        self.spec = spec
+        # ((param, value), ...) in spec order, so equal filters have equal shapes
+        self.criteria = tuple(criteria)
+        # ((field, descending), ...), always ending with the key column
+        self.sort = tuple(sort)
+
+    @property
+    def sort_fields(self):
+        return tuple(name for name, _ in self.sort)
+
+    @property
+    def is_default_sort(self):
+        return self.sort == self.spec.default_sort
+
+    @property
+    def text_search(self):
+        # (field, term) of the first text search criterion, or None
+        for param, value in self.criteria:
+            name, op = self.spec.params[param]
+            if op == 'match':
+                return name, value
+        return None
+
+    @property
+    def columns(self):
+        # Response columns the sort values are read from
+        return tuple(self.text_search[0] if name == RELEVANCE else name for name in self.sort_fields)
+
+    def cursor_types(self):
+        # Value types of a pagination cursor for this sort order
+        return tuple(int if name == RELEVANCE else self.spec.fields[name].type
+                     for name in self.sort_fields)
+
+    def cursor_key(self, columns):
+        # paginate() key function for rows laid out as columns
+        return self.spec._sort_key(self, [columns.index(column) for column in self.columns])
+
+
+class FilterSpec:
+    """
+    Filterable fields of one entity.
+
+    Args:
+        fields: Field name -> Field. Sortable names must be response columns.
+        key: Unique key column, the final tie-breaker of every sort
+        table: Table whose FULLTEXT index 'match' fields are searched with in SQL
+    """
+
+    def __init__(self, fields, key='id', table=None):
+        self.fields = dict(fields)
+        self.key = key
+        self.table = table
+        self.default_sort = ((key, False),)
+        # Query parameter -> (field name, operator)
+        self.params = {}
+        for name, field in self.fields.items():
+            for op in field.ops:
+                self.params[OPERATORS[op][0].format(name)] = (name, op)
+        self._sql_cache = {}
+        self._lock = threading.Lock()
+
+    @property
+    def param_types(self):
+        # Query parameter -> value type
+        return {param: self.fields[name].type for param, (name, _) in self.params.items()}
+
+    def _column(self, name):
+        return self.fields[name].column or name
+
+    def unfiltered(self):
+        # Query matching every row in key order
+        return Query(self, (), self.default_sort)
+
+    def parse(self, args):
+        """
+        Read filter and sort arguments from a query string.
+
+        Empty values are ignored and unrelated arguments (limit, fields, ...)
+        are left alone.
+
+        Raises:
+            ValueError: If a value has the wrong type or sort is invalid
+        """
+        criteria = []
+        for param, (name, _) in self.params.items():
+            raw = args.get(param)
+            if not raw:
+                continue
+            if self.fields[name].type is int:
+                try:
+                    criteria.append((param, int(raw)))
+                except ValueError:
+                    raise ValueError(f'{param} must be a valid integer')
+            else:
+                criteria.append((param, raw))
+        return Query(self, criteria, self.parse_sort(args.get('sort'), criteria))
+
+    def from_criteria(self, criteria):
+        # Query for a criteria dict already checked by validate_filter, e.g. a
+        # bulk update's filter (param_types are what it is checked against)
+        return Query(self, [(param, criteria[param]) for param in self.params if param in criteria],
+                     self.default_sort)
+
+    def parse_sort(self, raw, criteria=()):
+        # Parse sort=-speed,name into ((field, descending), ...) ending with the
+        # key. A text search ranks by relevance unless another sort is given.
+        searching = any(self.params[param][1] == 'match' for param, _ in criteria)
+        if not raw:
+            return ((RELEVANCE, True),) + self.default_sort if searching else self.default_sort
+        sort = []
+        for part in raw.split(','):
+            part = part.strip()
+            if not part:
+                continue
+            descending = part.startswith('-')
+            name = part.lstrip('-')
+            field = self.fields.get(name)
+            if name == RELEVANCE and not searching:
+                raise ValueError('Sorting by relevance needs a text search filter')
+            if name != RELEVANCE and (field is None or not field.sortable):
+                sortable = [n for n, f in self.fields.items() if f.sortable]
+                raise ValueError(f"Cannot sort by {name}. Sortable fields: {', '.join(sortable)}")
+            if name in (n for n, _ in sort):
+                raise ValueError(f'sort lists {name} more than once')
+            sort.append((name, descending))
+            if name == self.key:
+                # The key is unique, so nothing after it affects the order
+                break
+        if not sort:
+            return self.default_sort
+        if sort[-1][0] != self.key:
+            sort.append((self.key, False))
+        return tuple(sort)
+
+    # SQL
+
+    def _condition(self, op, value):
+        # (shape, bound values) of one condition; the shape of a text search
+        # says which SQL it needs: 'prefix' for a term without word tokens,
+        # otherwise (uses FULLTEXT, number of tokens matched with a REGEXP)
+        if op == 'like':
+            return None, [f'%{value}%']
+        if op != 'match':
+            return None, [value]
+        tokens = textsearch.tokenize(value)
+        if not tokens:
+            return 'prefix', [textsearch.like_prefix(value)]
+        fulltext_tokens, pattern_tokens = textsearch.fulltext.split(tokens, self.table)
+        values = [textsearch.boolean_query(fulltext_tokens)] if fulltext_tokens else []
+        values += [textsearch.word_prefix(token) for token in pattern_tokens]
+        return (bool(fulltext_tokens), len(pattern_tokens)), values
+
+    def _condition_sql(self, param, shape):
+        # SQL of one condition of the given shape
+        name, op = self.params[param]
+        column = self._column(name)
+        if shape is None:
+            return OPERATORS[op][1].format(column)
+        if shape == 'prefix':
+            return f'{column} LIKE %s'
+        fulltext, words = shape
+        conditions = [OPERATORS['match'][1].format(column)] if fulltext else []
+        conditions += [textsearch.regex_sql(column)] * words
+        return ' AND '.join(conditions)
+
+    def _sort_column(self, name, params):
+        # SQL expression of a sort field; relevance ranks the first text search
+        if name != RELEVANCE:
+            return self._column(name)
+        field = next(self.params[param][0] for param in params if self.params[param][1] == 'match')
+        return textsearch.relevance_sql(self._column(field))
+
+    def _sort_values(self, name, query):
+        # Values bound by _sort_column(name)
+        if name != RELEVANCE:
+            return []
+        return textsearch.relevance_patterns(query.text_search[1])
+
+    def _compile(self, shape):
+        select, from_clause, params, conditions, sort, has_after, has_limit = shape
+        where = [self._condition_sql(param, condition) for param, condition in zip(params, conditions)]
+        columns = [self._sort_column(name, params) for name, _ in sort]
+        if has_after:
+            # Rows strictly after the cursor in sort order:
+            # (a > x) OR (a = x AND b > y) OR (a = x AND b = y AND id > z)
+            alternatives = []
+            for i, (_, descending) in enumerate(sort):
+                terms = [f'{column} = %s' for column in columns[:i]]
+                terms.append(f"{columns[i]} {'<' if descending else '>'} %s")
+                alternatives.append(' AND '.join(terms))
+            where.append('(' + ' OR '.join(f'({a})' for a in alternatives) + ')'
+                         if len(alternatives) > 1 else alternatives[0])
+        query = f'SELECT {select} FROM {from_clause}'
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        query += ' ORDER BY ' + ', '.join(
+            f"{column}{' DESC' if descending else ''}" for column, (_, descending) in zip(columns, sort))
+        if has_limit:
+            query += ' LIMIT %s'
+        return query
+
+    def sql(self, select, from_clause, query, limit=None, after=None):
+        """
+        Build the SELECT for a filtered, sorted (and optionally paged) list.
+
+        The SQL text depends only on the shape of the request (which filters,
+        which sort, whether paged), so it is compiled once per shape and reused.
+
+        Args:
+            select: SELECT list
+            from_clause: FROM clause (table and joins)
+            query: Query from parse() or from_criteria()
+            limit: Maximum rows, or None
+            after: Cursor tuple (the sort values of the previous row), or None
+
+        Returns:
+            tuple: (sql, values)
+        """
+        params = tuple(param for param, _ in query.criteria)
+        conditions = [self._condition(self.params[param][1], value) for param, value in query.criteria]
+        shape = (select, from_clause, params, tuple(condition for condition, _ in conditions),
+                 query.sort, after is not None, limit is not None)
+        with self._lock:
+            text = self._sql_cache.get(shape)
+        if text is None:
+            text = self._compile(shape)
+            with self._lock:
+                if len(self._sql_cache) >= SQL_CACHE_SIZE:
+                    self._sql_cache.pop(next(iter(self._sql_cache)))
+                self._sql_cache[shape] = text
+
+        values = [value for _, condition_values in conditions for value in condition_values]
+        sort_values = [self._sort_values(name, query) for name in query.sort_fields]
+        if after is not None:
+            for i in range(len(query.sort)):
+                for j in range(i + 1):
+                    values.extend(sort_values[j])
+                    values.append(after[j])
+        for extra in sort_values:
+            values.extend(extra)
+        if limit is not None:
+            values.append(limit)
+        return text, values
+
+    def where(self, query):
+        """
+        WHERE conditions alone, e.g. for a set-based UPDATE.
+
+        Returns:
+            tuple: (list of conditions, values)
+        """
+        conditions = []
+        values = []
+        for param, value in query.criteria:
+            condition, condition_values = self._condition(self.params[param][1], value)
+            conditions.append(self._condition_sql(param, condition))
+            values.extend(condition_values)
+        return conditions, values
+
+    # In memory
+
+    def matcher(self, query, text_indexes=None):
+        """
+        Predicate over full rows equivalent to the SQL conditions.
+
+        String matches are case-insensitive, as under the default collation.
+
+        Args:
+            query: Query from parse() or from_criteria()
+            text_indexes: Field name -> textsearch.InvertedIndex over the rows,
+                used for text searches instead of tokenizing every row
+        """
+        text_indexes = text_indexes or {}
+        key_index = self.fields[self.key].index
+        tests = []
+        for param, value in query.criteria:
+            name, op = self.params[param]
+            index = self.fields[name].index
+            if op == 'match':
+                if name in text_indexes and textsearch.tokenize(value):
+                    ids = text_indexes[name].search(value)
+                    tests.append(lambda row, ids=ids: row[key_index] in ids)
+                else:
+                    tests.append(lambda row, i=index, t=value: textsearch.matches(row[i], t))
+            elif op == 'like':
+                text = value.casefold()
+                tests.append(lambda row, i=index, t=text: row[i] is not None and t in row[i].casefold())
+            elif op == 'eq':
+                if isinstance(value, str):
+                    text = value.casefold()
+                    tests.append(lambda row, i=index, t=text: row[i] is not None and row[i].casefold() == t)
+                else:
+                    tests.append(lambda row, i=index, v=value: row[i] == v)
+            elif op == 'min':
+                tests.append(lambda row, i=index, v=value: row[i] is not None and row[i] >= v)
+            else:
+                tests.append(lambda row, i=index, v=value: row[i] is not None and row[i] <= v)
+        return lambda row: all(test(row) for test in tests)
+
+    def _sort_key(self, query, indexes):
+        # Row -> sort values, reading each sort field at the matching index
+        # (a relevance tier is computed from its text search field)
+        getters = []
+        for name, index in zip(query.sort_fields, indexes):
+            if name == RELEVANCE:
+                term = query.text_search[1]
+                getters.append(lambda row, i=index: textsearch.relevance(row[i], term))
+            else:
+                getters.append(lambda row, i=index: row[i])
+        return lambda row: tuple(getter(row) for getter in getters)
+
+    def _compare(self, query):
+        # cmp function over sort-key tuples honouring each field's direction
+        directions = [descending for _, descending in query.sort]
+
+        def compare(a, b):
+            for x, y, descending in zip(a, b, directions):
+                if isinstance(x, str):
+                    x, y = x.casefold(), y.casefold()
+                if x != y:
+                    result = -1 if x < y else 1
+                    return -result if descending else result
+            return 0
+        return compare
+
+    def select_rows(self, rows, query, limit=None, after=None, text_indexes=None):
+        """
+        Filter, sort and page full rows held in memory.
+
+        Args:
+            rows: Full rows (fields are read by Field.index)
+            query: Query from parse() or from_criteria()
+            limit: Maximum rows, or None
+            after: Cursor tuple, or None
+            text_indexes: See matcher()
+
+        Returns:
+            list: Matching rows in sort order
+        """
+        key = self._sort_key(query, [self.fields[name].index for name in query.columns])
+        compare = self._compare(query)
+        matches = self.matcher(query, text_indexes)
+
+        result = [row for row in rows if matches(row)]
+        if not query.is_default_sort:
+            result.sort(key=lambda row: cmp_to_key(compare)(key(row)))
+        if after is not None:
+            result = [row for row in result if compare(key(row), after) > 0]
+        if limit is not None:
+            result = result[:limit]
+        return result
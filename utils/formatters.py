@@ -1,6 +1,24 @@
-from flask import request, Response, jsonify
-import dicttoxml
-import json
+from flask import request, Response
+from utils import columnar
+from utils.binary_formats import FORMATS as BINARY_FORMATS
+from utils.encoders import dumps
+from utils.xml_writer import to_xml
+
+# Media types the Accept header is matched against -> format name. JSON comes
+# first, so */* and requests without an Accept header get JSON.
+ACCEPTED_TYPES = {
+    'application/json': 'json',
+    'application/xml': 'xml',
+    'text/xml': 'xml',
+    **{mimetype: name for name, (mimetype, _) in BINARY_FORMATS.items()},
+}
+if 'msgpack' in BINARY_FORMATS:
+    # Names clients used before application/msgpack was registered
+    ACCEPTED_TYPES['application/x-msgpack'] = 'msgpack'
+    ACCEPTED_TYPES['application/vnd.msgpack'] = 'msgpack'
+
+# Formats chosen by name only (format=columnar is JSON, see utils/columnar.py)
+FORMAT_NAMES = frozenset(ACCEPTED_TYPES.values()) | {'columnar'}
 
 
 def row_to_dict(row, columns):
@@ -18,31 +36,78 @@ def rows_to_dict_list(rows, columns):
     return [dict(zip(columns, row)) for row in rows]
 
 
+def response_format():
+    """
+    Pick the response format of the current request.
+
+    The format query parameter (json, xml, msgpack, cbor, columnar) wins; otherwise the
+    Accept header is negotiated. Unknown or unsupported formats get JSON.
+
+    Only types the client names outright count: a non-JSON format is chosen
+    when it is among the client's most preferred types and JSON is not. A
+    browser (text/html first, application/xml;q=0.9, */*;q=0.8) gets JSON.
+    """
+    requested = request.args.get('format')
+    if requested:
+        requested = requested.lower()
+        return requested if requested in FORMAT_NAMES else 'json'
+    named = [(mimetype.split(';', 1)[0].strip().lower(), quality)
+             for mimetype, quality in request.accept_mimetypes
+             if '*' not in mimetype and quality > 0]
+    if not named:
+        return 'json'
+    top = max(quality for _, quality in named)
+    preferred = [ACCEPTED_TYPES.get(mimetype) for mimetype, quality in named if quality == top]
+    if 'json' in preferred:
+        return 'json'
+    return next((name for name in preferred if name), 'json')
+
+
 def json_response(data, status_code=200):
-    #Create a JSON response.
+    # Create a JSON response (Rows and Row values are written by their
+    # precompiled encoders, without building a dict per row)
+    
+    return Response(dumps(data) + '\n', mimetype='application/json', status=status_code)
+
+
+def columnar_response(data, status_code=200):
+    # Create a JSON response with row lists laid out as columns
     
-    return jsonify(data), status_code
+    return Response(columnar.dumps(data) + '\n', mimetype='application/json', status=status_code)
 
 
 def xml_response(data, status_code=200):
 
-    # Convert data to XML
-    xml_data = dicttoxml.dicttoxml(data, custom_root='response', attr_type=False)
+    # Convert data to XML (same layout as dicttoxml, written incrementally)
+    xml_data = to_xml(data, root='response')
     
     # Create response with XML content type
     return Response(xml_data, mimetype='application/xml', status=status_code)
 
 
+def binary_response(data, format_type, status_code=200):
+    # Create a MessagePack or CBOR response
+    mimetype, encode = BINARY_FORMATS[format_type]
+    return Response(encode(data), mimetype=mimetype, status=status_code)
+
+
 def format_response(data, status_code=200):
     """
-    Format response based on the 'format' query parameter.
-    Supports both JSON and XML formats.
+    Format response based on the 'format' query parameter or the Accept header.
+    Supports JSON, XML, MessagePack, CBOR and columnar JSON.
     """
-    # Get format parameter from query string (default to 'json')
-    format_type = request.args.get('format', 'json').lower()
+    format_type = response_format()
     
     if format_type == 'xml':
-        return xml_response(data, status_code)
+        response = xml_response(data, status_code)
+    elif format_type == 'columnar':
+        response = columnar_response(data, status_code)
+    elif format_type in BINARY_FORMATS:
+        response = binary_response(data, format_type, status_code)
     else:
         # Default to JSON 
-        return json_response(data, status_code)
+        response = json_response(data, status_code)
+    
+    # The body depends on the Accept header
+    response.vary.add('Accept')
+    return response
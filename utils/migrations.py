@@ -0,0 +1,189 @@
+"""
+Versioned schema migrations.
+
+Migrations are SQL files in migrations/ named <version>_<name>.sql and are
+applied in version order. Applied versions are recorded in the
+schema_migrations table, so running the migrations again only applies
+new files.
+
+MySQL commits DDL implicitly, so a file cannot be rolled back as a whole.
+A version is recorded only after every statement in its file succeeds. When
+a file fails halfway, re-running it skips statements that fail only because
+they were already applied (duplicate index, index already dropped).
+"""
+import logging
+import os
+import re
+
+from models import pilot, ship
+from utils.filters import Query
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+MIGRATION_FILE = re.compile(r'^(\d+)_(\w+)\.sql$')
+
+# Errors meaning a statement's effect is already in place
+ER_DUP_KEYNAME = 1061
+ER_CANT_DROP_FIELD_OR_KEY = 1091
+ALREADY_APPLIED = (ER_DUP_KEYNAME, ER_CANT_DROP_FIELD_OR_KEY)
+
+CREATE_VERSIONS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version int NOT NULL,
+        name varchar(100) NOT NULL,
+        applied_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (version)
+    )
+'''
+
+# Searches run as SQL: (filter spec, SELECT list, FROM clause). Ship and
+# weapon classes are searched in the reference snapshot and need no index.
+SQL_SEARCHES = (
+    (pilot.FILTERS, 'id', 'pilot'),
+    (ship.FILTERS, 's.id', 'ship s'),
+)
+
+# Filter values for EXPLAIN, chosen to match few rows so the plan reflects a
+# selective search rather than a scan of a mostly matching table
+SAMPLE_VALUES = {
+    'eq': {int: 0, str: '~'},
+    'min': {int: 2 ** 31 - 1},
+    'max': {int: -2 ** 31},
+}
+
+
+class MigrationError(Exception):
+    """Raised when a migration file fails; the message names the file."""
+
+
+def discover(path=MIGRATIONS_DIR):
+    """
+    List the migration files in path.
+
+    Returns:
+        list: (version, name, file path) tuples in version order
+
+    Raises:
+        MigrationError: If two files share a version
+    """
+    migrations = {}
+    for filename in os.listdir(path):
+        match = MIGRATION_FILE.match(filename)
+        if not match:
+            continue
+        version = int(match.group(1))
+        if version in migrations:
+            raise MigrationError(f'Duplicate migration version {version}: {filename}')
+        migrations[version] = (version, match.group(2), os.path.join(path, filename))
+    return [migrations[version] for version in sorted(migrations)]
+
+
+def split_statements(sql):
+    # Split a migration file into statements on ';' at the end of a line,
+    # dropping '--' comment lines
+    lines = [line for line in sql.splitlines() if not line.strip().startswith('--')]
+    statements = re.split(r';\s*$', '\n'.join(lines), flags=re.MULTILINE)
+    return [statement.strip() for statement in statements if statement.strip()]
+
+
+def applied_versions(connection):
+    """Return the set of versions recorded in schema_migrations."""
+    cursor = connection.cursor()
+    try:
+        cursor.execute(CREATE_VERSIONS_TABLE)
+        cursor.execute('SELECT version FROM schema_migrations')
+        return {row[0] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+
+def pending(connection, path=MIGRATIONS_DIR):
+    """Return the migrations in path not yet applied, in version order."""
+    applied = applied_versions(connection)
+    return [migration for migration in discover(path) if migration[0] not in applied]
+
+
+def migrate(connection, path=MIGRATIONS_DIR, target=None):
+    """
+    Apply pending migrations up to and including target (all by default).
+
+    Args:
+        connection: MySQLdb connection
+        path: Directory holding the migration files
+        target: Highest version to apply, or None
+
+    Returns:
+        list: (version, name) of the migrations applied
+
+    Raises:
+        MigrationError: If a statement fails; earlier files stay applied
+    """
+    applied = []
+    for version, name, file_path in pending(connection, path):
+        if target is not None and version > target:
+            break
+        with open(file_path, encoding='utf-8') as f:
+            statements = split_statements(f.read())
+
+        cursor = connection.cursor()
+        try:
+            for statement in statements:
+                try:
+                    cursor.execute(statement)
+                except Exception as e:
+                    if e.args and e.args[0] in ALREADY_APPLIED:
+                        logger.info('Migration %s: already applied: %s', version, e.args[1])
+                        continue
+                    raise MigrationError(f'Migration {os.path.basename(file_path)} failed: {e}') from e
+            cursor.execute('INSERT INTO schema_migrations (version, name) VALUES (%s, %s)',
+                           (version, name))
+            connection.commit()
+        finally:
+            cursor.close()
+        logger.info('Applied migration %s', os.path.basename(file_path))
+        applied.append((version, name))
+    return applied
+
+
+def _index_checks():
+    # (description, filter spec, SELECT, FROM, Query) for every indexed filter and sort
+    for spec, select, from_clause in SQL_SEARCHES:
+        for param, (name, op) in spec.params.items():
+            field = spec.fields[name]
+            if field.indexed and op in SAMPLE_VALUES:
+                query = Query(spec, [(param, SAMPLE_VALUES[op][field.type])], spec.default_sort)
+                yield f'{from_clause}: {param}=', spec, select, from_clause, query
+        for name, field in spec.fields.items():
+            if field.indexed and field.sortable and name != spec.key:
+                query = Query(spec, (), spec.parse_sort(name))
+                yield f'{from_clause}: sort={name}', spec, select, from_clause, query
+
+
+def check_indexes(connection, limit=10):
+    """
+    EXPLAIN the page query of every filter and sort marked indexed.
+
+    'like' filters are partial matches (LIKE '%text%') that no B-tree index
+    can seek, so only their sort order is checked. Run this against a
+    realistically sized database: for a table of a few rows a full scan is
+    cheapest and the optimizer picks one whatever indexes exist.
+
+    Returns:
+        list: (description, sql, access type, key) for each query whose plan
+            scans the whole table without an index; empty when all pass
+    """
+    failures = []
+    cursor = connection.cursor()
+    try:
+        for description, spec, select, from_clause, query in _index_checks():
+            sql, values = spec.sql(select, from_clause, query, limit)
+            cursor.execute('EXPLAIN ' + sql, values)
+            columns = [column[0] for column in cursor.description]
+            plan = dict(zip(columns, cursor.fetchone()))
+            if plan.get('key') is None or plan.get('type') == 'ALL':
+                failures.append((description, sql, plan.get('type'), plan.get('key')))
+    finally:
+        cursor.close()
+    return failures
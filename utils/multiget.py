@@ -0,0 +1,88 @@
+"""
+Multi-get query parameters.
+
+`ids=1,2,3` (or `keys=1-2-3,1-2-4` for composite keys) fetches several
+records in one request and one query instead of one request per record.
+"""
+from flask import current_app, request
+
+MAX_IDS = 100
+
+
+def _max_ids():
+    return current_app.config.get('API_MAX_IDS', MAX_IDS)
+
+
+def parse_ids(param='ids'):
+    """
+    Read a comma-separated list of integer ids from the query string.
+
+    Returns:
+        list: Unique ids in request order, or None when the parameter is absent
+
+    Raises:
+        ValueError: If an id is not a positive integer or too many are given
+    """
+    raw = request.args.get(param)
+    if raw is None:
+        return None
+
+    ids = []
+    seen = set()
+    for part in raw.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            value = int(part)
+        except ValueError:
+            raise ValueError(f'{param} must be a comma-separated list of integers')
+        if value < 1:
+            raise ValueError(f'{param} must be a comma-separated list of positive integers')
+        if value not in seen:
+            seen.add(value)
+            ids.append(value)
+            if len(ids) > _max_ids():
+                raise ValueError(f'At most {_max_ids()} {param} can be requested at once')
+
+    if not ids:
+        raise ValueError(f'{param} must contain at least one id')
+    return ids
+
+
+def parse_keys(key_size, param='keys'):
+    """
+    Read a comma-separated list of composite keys written as a-b-c.
+
+    Returns:
+        list: Unique key tuples in request order, or None when the parameter is absent
+
+    Raises:
+        ValueError: If a key is malformed or too many are given
+    """
+    raw = request.args.get(param)
+    if raw is None:
+        return None
+
+    message = f'{param} must be a comma-separated list of ' + '-'.join(['id'] * key_size) + ' keys'
+    keys = []
+    seen = set()
+    for part in raw.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            key = tuple(int(value) for value in part.split('-'))
+        except ValueError:
+            raise ValueError(message)
+        if len(key) != key_size or any(value < 1 for value in key):
+            raise ValueError(message)
+        if key not in seen:
+            seen.add(key)
+            keys.append(key)
+            if len(keys) > _max_ids():
+                raise ValueError(f'At most {_max_ids()} {param} can be requested at once')
+
+    if not keys:
+        raise ValueError(f'{param} must contain at least one key')
+    return keys
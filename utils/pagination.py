@@ -0,0 +1,95 @@
+"""
+Keyset (cursor) pagination helpers.
+
+List endpoints return at most `limit` rows ordered by their key and a `next`
+link carrying an opaque `after` cursor. The cursor encodes the key of the last
+row on the page, so the next page is a `WHERE key > cursor` range scan on the
+primary key instead of an OFFSET that re-reads every skipped row.
+"""
+import base64
+import json
+from urllib.parse import urlencode
+
+from flask import current_app, request
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(key):
+    # Encode a row key (tuple of values) as an opaque URL-safe token
+    raw = json.dumps(list(key), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, key_size=1, types=None):
+    # Decode a cursor token back into a key tuple, raising ValueError if invalid.
+    # types gives the expected type of each value (all int by default).
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError, UnicodeError):
+        raise ValueError('Invalid pagination cursor')
+
+    types = types or (int,) * key_size
+    if (not isinstance(key, list) or len(key) != len(types)
+            or not all(isinstance(value, type_) and not isinstance(value, bool)
+                       for value, type_ in zip(key, types))):
+        raise ValueError('Invalid pagination cursor')
+    return tuple(key)
+
+
+def parse_page_args(key_size=1, types=None):
+    """
+    Read `limit` and `after` from the query string.
+
+    Args:
+        key_size: Number of values in a cursor
+        types: Type of each cursor value, e.g. Query.cursor_types() of a
+            sorted list (all int by default)
+
+    Returns:
+        tuple: (limit, after) where after is None or a key tuple
+
+    Raises:
+        ValueError: If limit or after are invalid
+    """
+    default_size = current_app.config.get('API_DEFAULT_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+    max_size = current_app.config.get('API_MAX_PAGE_SIZE', MAX_PAGE_SIZE)
+
+    limit = default_size
+    if request.args.get('limit'):
+        try:
+            limit = int(request.args.get('limit'))
+        except ValueError:
+            raise ValueError('limit must be a valid integer')
+        if limit < 1 or limit > max_size:
+            raise ValueError(f'limit must be between 1 and {max_size}')
+
+    after = None
+    if request.args.get('after'):
+        after = decode_cursor(request.args.get('after'), key_size, types)
+
+    return limit, after
+
+
+def paginate(rows, limit, key_func):
+    """
+    Trim a result fetched with limit + 1 rows to one page.
+
+    Returns:
+        tuple: (page_rows, next_cursor) where next_cursor is None on the last page
+    """
+    if len(rows) <= limit:
+        return list(rows), None
+    page = list(rows[:limit])
+    return page, encode_cursor(key_func(page[-1]))
+
+
+def next_page_link(cursor):
+    # Build the URL of the next page, keeping every other query parameter
+    if cursor is None:
+        return None
+    args = [(key, value) for key, value in request.args.items(multi=True) if key != 'after']
+    args.append(('after', cursor))
+    return f'{request.path}?{urlencode(args)}'
@@ -0,0 +1,92 @@
+"""
+Full-response cache for anonymous GETs.
+
+The conditional GET endpoints (utils/etag.py) are deterministic given their
+path, query string, response format and the contents of the tables they
+declare. Their 200 responses are stored as final bytes, keyed on the path,
+the sorted query parameters and the negotiated format, and tagged with those
+tables; a hit is answered without running the view, so without touching the
+database or serializing anything. Every table_versions.bump() after a model
+write drops exactly the responses tagged with the bumped tables. Requests
+carrying an Authorization header, streamed responses and bodies larger than
+RESPONSE_CACHE_MAX_BODY are never cached; the TTL bounds how long writes
+made by other processes go unnoticed.
+"""
+import os
+
+from flask import Response, request
+
+from utils.cache import MISSING, EntityCache
+from utils.formatters import response_format
+from utils.versions import table_versions
+
+# Headers recomputed for every response rather than replayed from the cache
+_DROPPED_HEADERS = frozenset(('etag', 'set-cookie'))
+
+
+class ResponseCache:
+    """
+    Tagged LRU/TTL cache of serialized responses.
+
+    Args:
+        max_size: Maximum number of responses kept
+        ttl: Seconds a response is served from the cache
+        max_body: Largest body, in bytes, that is cached
+    """
+
+    def __init__(self, max_size=1000, ttl=60.0, max_body=1024 * 1024):
+        self._cache = EntityCache(max_size=max_size, ttl=ttl)
+        self.max_body = max_body
+
+    def key(self):
+        # Cache key of the current request, or None when it must not be cached
+        if request.method != 'GET' or 'Authorization' in request.headers:
+            return None
+        args = tuple(sorted((name, value) for name, value in request.args.items(multi=True)
+                            if name != 'format'))
+        return ('response', request.path, response_format(), args)
+
+    def get(self, key):
+        """Return a fresh Response for key, or None on a miss."""
+        entry = self._cache.get(key)
+        if entry is MISSING:
+            return None
+        body, status, headers = entry
+        return Response(body, status=status, headers=headers)
+
+    def generation(self):
+        """Token to pass to store() (see EntityCache.generation)."""
+        return self._cache.generation()
+
+    def store(self, key, response, tables, generation):
+        """Store a 200 response built from tables, unless a write raced it."""
+        if response.status_code != 200 or response.is_streamed:
+            return
+        body = response.get_data()
+        if len(body) > self.max_body:
+            return
+        headers = [(name, value) for name, value in response.headers
+                   if name.lower() not in _DROPPED_HEADERS]
+        self._cache.set(key, (body, response.status_code, headers), tags=tables, generation=generation)
+
+    def invalidate(self, *tables):
+        """Drop every response built from any of tables."""
+        self._cache.invalidate_tag(*tables)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        """Return a snapshot of cache counters."""
+        stats = self._cache.stats()
+        stats['max_body'] = self.max_body
+        return stats
+
+
+# Shared cache used by the conditional GET endpoints
+response_cache = ResponseCache(
+    max_size=int(os.getenv('RESPONSE_CACHE_SIZE', 1000)),
+    ttl=float(os.getenv('RESPONSE_CACHE_TTL', 60)),
+    max_body=int(os.getenv('RESPONSE_CACHE_MAX_BODY', 1024 * 1024)),
+)
+table_versions.subscribe(response_cache.invalidate)
@@ -0,0 +1,321 @@
+"""
+Server-side prepared statement cache.
+
+The models run a small set of statement shapes over and over (get-by-id
+SELECTs, the ship/pilot join, the UPDATE ... SET variants). A
+PreparedConnection wraps a pooled MySQLdb connection and, once a shape has
+run PREPARE_THRESHOLD times in the process, PREPAREs it on that connection;
+later executions send only `SET @p0 = ..., ...` and `EXECUTE sN USING @p0, ...`,
+so the server skips parsing and planning the statement.
+
+MySQLdb has no binary-protocol prepared statements, so this uses SQL-level
+PREPARE/EXECUTE. Each step is its own execute() call: connections are never
+opened with CLIENT.MULTI_STATEMENTS, which would let any query run stacked
+statements. Handles are per connection and bounded (LRU, the evicted
+statement is DEALLOCATEd) so max_prepared_stmt_count on the server is never
+approached.
+
+Statement shapes are normalized SQL text (whitespace outside quoted
+literals collapsed), so the same query written on several lines in
+different models shares one entry.
+Statements with many parameters (multi-row INSERTs, long IN lists) are
+executed as plain text: their shapes rarely repeat and their SET would cost
+more than the parse it saves.
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+
+# Executions of a shape, process-wide, before it is prepared on a connection
+PREPARE_THRESHOLD = 2
+
+# Statements with more parameters than this are never prepared
+MAX_PREPARED_PARAMS = 32
+
+# Statement kinds worth preparing
+PREPARABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE')
+
+# "Unknown prepared statement handler": the server dropped our handles
+ER_UNKNOWN_STMT_HANDLER = 1243
+
+# Errors meaning the statement itself cannot be prepared (unsupported by the
+# prepared statement protocol, or not parseable once rewritten); any other
+# PREPARE failure is passed on and the shape is tried again later
+UNPREPARABLE_ERRORS = (
+    1295,  # ER_UNSUPPORTED_PS
+    1064,  # ER_PARSE_ERROR
+)
+
+# The driver's format sequences (%s, %%), and quoted strings and identifiers,
+# whose whitespace is literal
+_FORMAT = re.compile(r'%([%s])')
+_QUOTED = re.compile(r"('(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|`(?:[^`]|``)*`)", re.S)
+
+
+def normalize(sql):
+    # Statement shape: the SQL text with whitespace runs outside quoted
+    # strings and identifiers collapsed
+    parts = _QUOTED.split(sql)
+    return ''.join(part if i % 2 else re.sub(r'\s+', ' ', part) for i, part in enumerate(parts)).strip()
+
+
+def server_text(shape, has_args):
+    """
+    The statement in PREPARE syntax, or None if it cannot be rewritten.
+
+    Without args the driver sends the text as it is. With args it formats
+    the whole text, so %s placeholders become ? and %% escapes become %,
+    read left to right as the driver does. A %s inside a quoted literal
+    would be formatted into the literal and has no ? equivalent.
+    """
+    if not has_args:
+        return shape
+    parts = _QUOTED.split(shape)
+    if any(match.group(1) == 's' for part in parts[1::2] for match in _FORMAT.finditer(part)):
+        return None
+    return ''.join(_FORMAT.sub(lambda match: '%' if match.group(1) == '%' else '?', part)
+                   for part in parts)
+
+
+class StatementStats:
+    """
+    Process-wide execution counters per statement shape.
+
+    Args:
+        max_size: Shapes tracked before the least recently run is dropped
+    """
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        # shape -> {'executions', 'prepared_executions', 'prepares'}
+        self._shapes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, shape, prepared=False, prepares=0):
+        """Count one execution of shape; returns the shape's execution count."""
+        with self._lock:
+            entry = self._shapes.get(shape)
+            if entry is None:
+                entry = self._shapes[shape] = {'executions': 0, 'prepared_executions': 0, 'prepares': 0}
+                if len(self._shapes) > self.max_size:
+                    self._shapes.popitem(last=False)
+            else:
+                self._shapes.move_to_end(shape)
+            entry['executions'] += 1
+            entry['prepares'] += prepares
+            if prepared:
+                entry['prepared_executions'] += 1
+            return entry['executions']
+
+    def executions(self, shape):
+        with self._lock:
+            entry = self._shapes.get(shape)
+            return entry['executions'] if entry else 0
+
+    def clear(self):
+        with self._lock:
+            self._shapes.clear()
+
+    def stats(self, top=20):
+        """
+        Return totals and the most executed statements.
+
+        parse_savings counts executions that ran a prepared handle, less the
+        PREPAREs that parsed the statement: each is one full parse the server
+        did not do.
+        """
+        with self._lock:
+            shapes = [(shape, dict(entry)) for shape, entry in self._shapes.items()]
+        for _, entry in shapes:
+            entry['parse_savings'] = max(entry['prepared_executions'] - entry['prepares'], 0)
+        shapes.sort(key=lambda item: item[1]['executions'], reverse=True)
+        return {
+            'statements': len(shapes),
+            'executions': sum(entry['executions'] for _, entry in shapes),
+            'prepared_executions': sum(entry['prepared_executions'] for _, entry in shapes),
+            'prepares': sum(entry['prepares'] for _, entry in shapes),
+            'parse_savings': sum(entry['parse_savings'] for _, entry in shapes),
+            'top': [dict(entry, sql=shape) for shape, entry in shapes[:top]],
+        }
+
+
+class StatementCache:
+    """
+    Prepared statement handles of one connection.
+
+    Args:
+        max_size: Handles kept before the least recently used is deallocated
+    """
+
+    def __init__(self, max_size=64):
+        self.max_size = max_size
+        # shape -> (handle name, parameter count)
+        self._handles = OrderedDict()
+        # Shapes the server refused to prepare
+        self._unpreparable = set()
+        self._next_id = 0
+        self._stats = {
+            'hits': 0,
+            'prepares': 0,
+            'evictions': 0,
+            'prepare_failures': 0,
+        }
+
+    def get(self, shape):
+        handle = self._handles.get(shape)
+        if handle is not None:
+            self._handles.move_to_end(shape)
+            self._stats['hits'] += 1
+        return handle
+
+    def add(self, shape, param_count):
+        """
+        Register a new handle for shape.
+
+        Returns:
+            tuple: ((name, param_count), evicted handle name or None)
+        """
+        self._next_id += 1
+        handle = (f's{self._next_id}', param_count)
+        self._handles[shape] = handle
+        self._stats['prepares'] += 1
+        evicted = None
+        if len(self._handles) > self.max_size:
+            _, (evicted, _) = self._handles.popitem(last=False)
+            self._stats['evictions'] += 1
+        return handle, evicted
+
+    def discard(self, shape):
+        self._handles.pop(shape, None)
+
+    def mark_unpreparable(self, shape):
+        self._unpreparable.add(shape)
+        self._stats['prepare_failures'] += 1
+
+    def is_unpreparable(self, shape):
+        return shape in self._unpreparable
+
+    def clear(self):
+        self._handles.clear()
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats['size'] = len(self._handles)
+        stats['max_size'] = self.max_size
+        return stats
+
+
+class PreparedCursor:
+    """Cursor whose execute() runs hot statements through prepared handles."""
+
+    def __init__(self, connection, cursor):
+        self._connection = connection
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        # fetchone, fetchall, rowcount, lastrowid, ... come from the real cursor
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def _run(self, statements):
+        # Execute (sql, args) pairs one at a time, leaving the cursor on the
+        # last one's result for the caller to fetch
+        for sql, args in statements:
+            self._cursor.execute(sql, args)
+
+    def execute(self, query, args=None):
+        shape = normalize(query)
+        if isinstance(args, dict):
+            # Named %(name)s parameters have no positional order to bind
+            statement_stats.record(shape)
+            return self._cursor.execute(query, args)
+        params = list(args) if args else []
+        cache = self._connection.statement_cache
+        if (not shape.startswith(PREPARABLE) or len(params) > MAX_PREPARED_PARAMS
+                or cache.is_unpreparable(shape)):
+            statement_stats.record(shape)
+            return self._cursor.execute(query, args)
+
+        handle = cache.get(shape)
+        prepares = 0
+        if handle is None:
+            if statement_stats.executions(shape) + 1 < PREPARE_THRESHOLD:
+                statement_stats.record(shape)
+                return self._cursor.execute(query, args)
+            handle = self._prepare(shape, len(params), args is not None)
+            if handle is None:
+                statement_stats.record(shape)
+                return self._cursor.execute(query, args)
+            prepares = 1
+
+        name, _ = handle
+        variables = ', '.join(f'@p{i}' for i in range(len(params)))
+        try:
+            if params:
+                self._run([(f"SET {', '.join(f'@p{i} = %s' for i in range(len(params)))}", params),
+                           (f'EXECUTE {name} USING {variables}', None)])
+            else:
+                self._run([(f'EXECUTE {name}', None)])
+        except Exception as e:
+            if not e.args or e.args[0] != ER_UNKNOWN_STMT_HANDLER:
+                raise
+            # The server forgot every handle (e.g. the session was reset);
+            # run this one as text and prepare again on the next execution
+            cache.clear()
+            statement_stats.record(shape)
+            return self._cursor.execute(query, args)
+        statement_stats.record(shape, prepared=True, prepares=prepares)
+        return self._cursor.rowcount
+
+    def _prepare(self, shape, param_count, has_args):
+        # PREPARE shape on this connection, deallocating the LRU handle if
+        # the cache is full; returns the handle, or None if the statement
+        # cannot be prepared. Other errors (a lost connection, a lock wait
+        # timeout) propagate and leave the shape to be prepared next time.
+        cache = self._connection.statement_cache
+        text = server_text(shape, has_args)
+        if text is None:
+            cache.mark_unpreparable(shape)
+            return None
+        handle, evicted = cache.add(shape, param_count)
+        statements = [(f'PREPARE {handle[0]} FROM %s', (text,))]
+        if evicted is not None:
+            statements.insert(0, (f'DEALLOCATE PREPARE {evicted}', None))
+        try:
+            self._run(statements)
+        except Exception as e:
+            cache.discard(shape)
+            if e.args and e.args[0] in UNPREPARABLE_ERRORS:
+                cache.mark_unpreparable(shape)
+                return None
+            raise
+        return handle
+
+
+class PreparedConnection:
+    """
+    MySQLdb connection wrapper whose default cursors use a StatementCache.
+
+    Everything else (commit, rollback, ping, close, ...) is passed through.
+    Cursors of another class, e.g. the SSCursor used for streaming, are
+    returned unwrapped.
+    """
+
+    def __init__(self, connection, cache_size=64):
+        self._connection = connection
+        self.statement_cache = StatementCache(cache_size)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def cursor(self, cursorclass=None):
+        if cursorclass is not None:
+            return self._connection.cursor(cursorclass)
+        return PreparedCursor(self, self._connection.cursor())
+
+
+# Execution counters shared by every pooled connection
+statement_stats = StatementStats(max_size=int(os.getenv('STATEMENT_STATS_SIZE', 1000)))
@@ -0,0 +1,168 @@
+"""
+Grouped summary statistics for list endpoints.
+
+A StatsSpec names the numeric columns of an entity that can be summarized
+and the columns its rows can be grouped by. It reuses the entity's
+FilterSpec, so a statistics request honours the same filters as the list
+endpoint. Every group gets the row count and, per metric, the sum, min,
+max, mean and population standard deviation.
+
+Tables in MySQL are summarized with one aggregated query (GROUP BY);
+tables held in memory are summarized in one pass over their rows, with
+Welford's running variance.
+"""
+import math
+
+# Aggregates per metric, in SELECT order after COUNT(*)
+SQL_AGGREGATES = ('SUM({})', 'MIN({})', 'MAX({})', 'AVG({})', 'STDDEV_POP({})')
+
+
+class _Accumulator:
+    # Running count, sum, min, max, mean and variance of one metric
+
+    __slots__ = ('count', 'total', 'low', 'high', 'mean', 'm2')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.low = None
+        self.high = None
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        if value is None:
+            return
+        self.count += 1
+        self.total += value
+        if self.low is None or value < self.low:
+            self.low = value
+        if self.high is None or value > self.high:
+            self.high = value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def summary(self):
+        if not self.count:
+            return _summary(None, None, None, None, None)
+        return _summary(self.total, self.low, self.high, self.mean, math.sqrt(self.m2 / self.count))
+
+
+def _summary(total, low, high, mean, stddev):
+    # JSON-ready metric summary (MySQL returns SUM and AVG as Decimal)
+    return {
+        'sum': int(total) if total is not None else None,
+        'min': low,
+        'max': high,
+        'mean': float(mean) if mean is not None else None,
+        'stddev': float(stddev) if stddev is not None else None,
+    }
+
+
+class StatsSpec:
+    """
+    Summarizable metrics and grouping columns of one entity.
+
+    Args:
+        filters: The entity's FilterSpec; metric and group names are its fields
+        metrics: Numeric fields to summarize
+        group_by: Fields that may be passed as group_by=
+    """
+
+    def __init__(self, filters, metrics, group_by=()):
+        self.filters = filters
+        self.metrics = tuple(metrics)
+        self.group_by = tuple(group_by)
+
+    def parse_group(self, args):
+        """
+        Read group_by= from a query string (None when absent).
+
+        Raises:
+            ValueError: If the column cannot be grouped by
+        """
+        group = args.get('group_by')
+        if not group:
+            return None
+        if group not in self.group_by:
+            allowed = ', '.join(self.group_by) or 'none'
+            raise ValueError(f'group_by must be one of: {allowed}')
+        return group
+
+    def sql(self, from_clause, query, group=None):
+        """
+        Aggregate query for a filter Query, one result row per group.
+
+        Returns:
+            tuple: (SQL text, values)
+        """
+        columns = [self.filters.fields[name].column or name for name in self.metrics]
+        group_column = self.filters.fields[group].column or group if group else 'NULL'
+        select = [group_column, 'COUNT(*)']
+        for column in columns:
+            select.extend(aggregate.format(column) for aggregate in SQL_AGGREGATES)
+        text = f"SELECT {', '.join(select)} FROM {from_clause}"
+        conditions, values = self.filters.where(query)
+        if conditions:
+            text += f" WHERE {' AND '.join(conditions)}"
+        if group:
+            text += f' GROUP BY {group_column} ORDER BY {group_column}'
+        return text, values
+
+    def from_sql_rows(self, rows, group=None):
+        """Format the rows of sql() as groups()."""
+        width = len(SQL_AGGREGATES)
+        result = []
+        for row in rows:
+            metrics = {name: _summary(*row[2 + i * width:2 + (i + 1) * width])
+                       for i, name in enumerate(self.metrics)}
+            result.append(self._group(group, row[0], row[1], metrics))
+        return result
+
+    def aggregate(self, rows, query, group=None, text_indexes=None):
+        """
+        Summarize full rows held in memory in one pass.
+
+        Args:
+            rows: Full rows (fields are read by Field.index)
+            query: Filter Query
+            group: Field to group by, or None for a single group
+            text_indexes: See FilterSpec.matcher()
+
+        Returns:
+            list: Groups as from_sql_rows() formats them, ordered by group value
+        """
+        fields = self.filters.fields
+        matches = self.filters.matcher(query, text_indexes)
+        group_index = fields[group].index if group else None
+        metric_indexes = [fields[name].index for name in self.metrics]
+
+        groups = {}
+        for row in rows:
+            if not matches(row):
+                continue
+            key = row[group_index] if group else None
+            accumulators = groups.get(key)
+            if accumulators is None:
+                accumulators = groups[key] = [0] + [_Accumulator() for _ in metric_indexes]
+            accumulators[0] += 1
+            for accumulator, index in zip(accumulators[1:], metric_indexes):
+                accumulator.add(row[index])
+
+        if not group and not groups:
+            # An ungrouped summary always has its one group, as in SQL
+            groups[None] = [0] + [_Accumulator() for _ in metric_indexes]
+        result = []
+        # NULL groups first, as MySQL orders them
+        for key in sorted(groups, key=lambda k: (k is not None, k)):
+            count, accumulators = groups[key][0], groups[key][1:]
+            metrics = {name: accumulator.summary() for name, accumulator in zip(self.metrics, accumulators)}
+            result.append(self._group(group, key, count, metrics))
+        return result
+
+    def _group(self, group, key, count, metrics):
+        entry = {group: key} if group else {}
+        entry['count'] = count
+        entry.update(metrics)
+        return entry
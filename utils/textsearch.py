@@ -0,0 +1,236 @@
+"""
+Token and prefix text search.
+
+A search term is split into word tokens, and a value matches when every
+token is the prefix of one of its words: 'star de' matches 'Star Destroyer'
+and 'Death Star'. Tables searched in SQL use a FULLTEXT index queried in
+boolean mode ('+star* +rebel*'); tables held in memory use an InvertedIndex
+with the same semantics.
+
+A FULLTEXT index does not hold words shorter than innodb_ft_min_token_size
+or stopwords, so tokens it cannot find ('de', 'x', 'the') are matched with
+a case-insensitive REGEXP anchored at a word boundary instead, as is every
+token when the table has no FULLTEXT index (migration 0003 not applied).
+Words are runs of \w characters on both sides, so 'wing' finds 'X-Wing' in
+SQL as it does in memory. A term without any word token ('--') matches
+values starting with it, in SQL and in memory.
+
+Matches are ranked by a relevance tier that both SQL and Python can
+compute from the value alone, so relevance-ordered lists keep stable
+keyset cursors. Both compare case-insensitively with the same patterns
+rather than with the column's collation, which would also ignore accents:
+
+    3  the value equals the term
+    2  the value starts with the term
+    1  every token prefixes a word
+"""
+import logging
+import re
+import time
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+
+EXACT, PREFIX, WORDS = 3, 2, 1
+
+# InnoDB defaults of innodb_ft_min_token_size and its built-in stopword list
+MIN_TOKEN_SIZE = 3
+STOPWORDS = frozenset((
+    'a', 'about', 'an', 'are', 'as', 'at', 'be', 'by', 'com', 'de', 'en', 'for',
+    'from', 'how', 'i', 'in', 'is', 'it', 'la', 'of', 'on', 'or', 'that', 'the',
+    'this', 'to', 'was', 'what', 'when', 'where', 'who', 'will', 'with', 'und', 'www',
+))
+
+# Seconds between attempts to read the server's FULLTEXT settings after a failure
+SETTINGS_RETRY_INTERVAL = 30
+
+
+def tokenize(text):
+    # Case-folded word tokens of text
+    return TOKEN.findall(text.casefold()) if text else []
+
+
+def boolean_query(tokens):
+    # FULLTEXT boolean-mode query requiring every token as a word prefix
+    return ' '.join(f'+{token}*' for token in tokens)
+
+
+def like_prefix(term):
+    # LIKE pattern for values starting with term
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped + '%'
+
+
+def regex_escape(text):
+    # text as a literal in a MySQL (ICU) regular expression
+    return re.sub(r'([\\^$.|?*+()\[\]{}])', r'\\\1', text)
+
+
+def regex_sql(column):
+    # Case-insensitive REGEXP condition on column; takes one pattern
+    return f"REGEXP_LIKE({column}, %s, 'i')"
+
+
+def word_prefix(token):
+    # REGEXP pattern for a value having a word (a \w run, as tokenize splits
+    # it) that starts with token
+    return r'\b' + regex_escape(token)
+
+
+def relevance_sql(column):
+    # SQL relevance tier of column for a term; takes relevance_patterns(term)
+    return f'CASE WHEN {regex_sql(column)} THEN {EXACT} WHEN {regex_sql(column)} THEN {PREFIX} ELSE {WORDS} END'
+
+
+def relevance_patterns(term):
+    # REGEXP patterns of the exact and prefix tiers of term
+    escaped = regex_escape(term)
+    return [f'^{escaped}$', f'^{escaped}']
+
+
+def relevance(value, term):
+    # Relevance tier of a matching value, as relevance_sql computes it
+    if value is None:
+        return WORDS
+    value, term = value.casefold(), term.casefold()
+    if value == term:
+        return EXACT
+    if value.startswith(term):
+        return PREFIX
+    return WORDS
+
+
+def matches(value, term):
+    # True if every token of term prefixes a word of value
+    tokens = tokenize(term)
+    if not tokens:
+        return bool(term) and value is not None and value.casefold().startswith(term.casefold())
+    words = tokenize(value)
+    return all(any(word.startswith(token) for word in words) for token in tokens)
+
+
+class InvertedIndex:
+    """
+    Word -> row ids index over one text column.
+
+    Words are kept sorted, so the ids for a prefix are collected from one
+    contiguous run found by binary search.
+
+    Args:
+        rows: Iterable of (row id, text)
+    """
+
+    def __init__(self, rows):
+        postings = {}
+        for row_id, text in rows:
+            for word in set(tokenize(text)):
+                postings.setdefault(word, set()).add(row_id)
+        self._words = sorted(postings)
+        self._postings = postings
+
+    def prefix(self, token):
+        # Ids of rows having a word that starts with token
+        ids = set()
+        i = bisect_left(self._words, token)
+        while i < len(self._words) and self._words[i].startswith(token):
+            ids |= self._postings[self._words[i]]
+            i += 1
+        return ids
+
+    def search(self, term):
+        """Ids of rows in which every token of term prefixes a word."""
+        tokens = tokenize(term)
+        if not tokens:
+            return set()
+        # Most selective (longest) tokens first, so the intersection shrinks fast
+        tokens.sort(key=len, reverse=True)
+        ids = self.prefix(tokens[0])
+        for token in tokens[1:]:
+            if not ids:
+                break
+            ids &= self.prefix(token)
+        return ids
+
+
+class FulltextSettings:
+    """
+    Which tables have a FULLTEXT index and which tokens it holds.
+
+    Until load() succeeds the InnoDB defaults are assumed, with every table
+    indexed.
+    """
+
+    def __init__(self):
+        self.min_token_size = MIN_TOKEN_SIZE
+        self.stopwords = STOPWORDS
+        # Tables with a FULLTEXT index, or None before a load
+        self.tables = None
+        self._failed_at = None
+
+    def indexed(self, table):
+        # True if table's searched column is expected to have a FULLTEXT index
+        return self.tables is None or table in self.tables
+
+    def searchable(self, token):
+        # True if a FULLTEXT index holds words starting with token
+        return len(token) >= self.min_token_size and token not in self.stopwords
+
+    def split(self, tokens, table):
+        """
+        Split tokens into those searched with the FULLTEXT index of table and
+        those matched with a word_prefix() pattern.
+
+        Returns:
+            tuple: (FULLTEXT tokens, pattern tokens)
+        """
+        if not self.indexed(table):
+            return [], list(tokens)
+        return ([token for token in tokens if self.searchable(token)],
+                [token for token in tokens if not self.searchable(token)])
+
+    def load(self, mysql):
+        """Read the FULLTEXT indexes and token settings of the server."""
+        cursor = mysql.connection.cursor()
+        try:
+            cursor.execute("SELECT @@innodb_ft_min_token_size, @@innodb_ft_enable_stopword, "
+                           "@@innodb_ft_server_stopword_table")
+            min_token_size, stopwords_enabled, stopword_table = cursor.fetchone()
+            stopwords = frozenset()
+            if stopwords_enabled and stopword_table:
+                # Named as db/table; its single column is called value
+                cursor.execute('SELECT value FROM `{}`.`{}`'.format(*stopword_table.split('/', 1)))
+                stopwords = frozenset(row[0].casefold() for row in cursor.fetchall())
+            elif stopwords_enabled:
+                stopwords = STOPWORDS
+            cursor.execute("SELECT DISTINCT TABLE_NAME FROM information_schema.STATISTICS "
+                           "WHERE TABLE_SCHEMA = DATABASE() AND INDEX_TYPE = 'FULLTEXT'")
+            tables = frozenset(row[0] for row in cursor.fetchall())
+        finally:
+            cursor.close()
+        self.min_token_size = int(min_token_size)
+        self.stopwords = stopwords
+        self.tables = tables
+        self._failed_at = None
+
+    def ensure_loaded(self, mysql):
+        """
+        Load the settings if no load has succeeded yet.
+
+        A failed load is logged and retried at most every
+        SETTINGS_RETRY_INTERVAL seconds; the defaults apply meanwhile.
+        """
+        if self.tables is not None:
+            return
+        if self._failed_at is not None and time.monotonic() - self._failed_at < SETTINGS_RETRY_INTERVAL:
+            return
+        try:
+            self.load(mysql)
+        except Exception as e:
+            self._failed_at = time.monotonic()
+            logger.warning('FULLTEXT settings not loaded: %s', e)
+
+
+# Settings of the server the SQL text searches run against
+fulltext = FulltextSettings()
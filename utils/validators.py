@@ -194,3 +194,124 @@ def validate_weapon_class_data(data, is_update=False):
             return False, "Field 'range' cannot be negative"
     
     return True, None
+
+
+def validate_ship_weapon_data(data):
+
+    # Validate ship weapon assignment data for create operations.
+
+    # Required fields for creation
+    required_fields = ['ship_id', 'ship_class_id', 'weapon_class_id', 'name']
+    for field in required_fields:
+        if field not in data:
+            return False, f"Missing required field: {field}"
+    
+    # Validate the composite key fields
+    for field in ['ship_id', 'ship_class_id', 'weapon_class_id']:
+        if not isinstance(data[field], int) or data[field] < 1:
+            return False, f"Field {field} must be a positive integer"
+    
+    # Validate name
+    if not isinstance(data['name'], str) or len(data['name'].strip()) == 0:
+        return False, "Field name must be a non-empty string"
+    
+    return True, None
+
+
+def validate_bulk_data(items, validate_item, max_items):
+
+    # Validate a bulk create payload: a JSON array of items, each checked
+    # with validate_item. Returns (is_valid, error_message, item_errors)
+    # where item_errors lists {'index', 'message'} for every invalid item.
+
+    if not isinstance(items, list):
+        return False, 'Request body must be a JSON array', []
+    if len(items) == 0:
+        return False, 'Request body must contain at least one item', []
+    if len(items) > max_items:
+        return False, f'At most {max_items} items can be created at once', []
+    
+    item_errors = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            item_errors.append({'index': index, 'message': 'Item must be a JSON object'})
+            continue
+        is_valid, error_message = validate_item(item)
+        if not is_valid:
+            item_errors.append({'index': index, 'message': error_message})
+    
+    if item_errors:
+        return False, f'{len(item_errors)} of {len(items)} items are invalid', item_errors
+    return True, None, []
+
+
+def validate_changes(changes, validate_item, fields):
+
+    # Validate the change set of a bulk update: a non-empty object setting at
+    # least one of fields, checked with validate_item as a partial update.
+
+    if not isinstance(changes, dict):
+        return False, "Field 'changes' must be a JSON object"
+    if not any(field in changes for field in fields):
+        return False, f"Field 'changes' must set at least one of: {', '.join(fields)}"
+    return validate_item(changes, is_update=True)
+
+
+def validate_filter(criteria, filters):
+
+    # Validate the filter of a bulk update against the criteria a model
+    # accepts (name -> type). An empty filter would match every row, so at
+    # least one criterion is required.
+
+    if not isinstance(criteria, dict) or not criteria:
+        return False, "Field 'filter' must be a non-empty JSON object"
+    for name, value in criteria.items():
+        if name not in filters:
+            return False, f"Unknown filter: {name}. Valid filters: {', '.join(filters)}"
+        if filters[name] is str:
+            if not isinstance(value, str) or len(value.strip()) == 0:
+                return False, f"Filter '{name}' must be a non-empty string"
+        elif not isinstance(value, int) or isinstance(value, bool):
+            return False, f"Filter '{name}' must be an integer"
+    return True, None
+
+
+def validate_bulk_update_data(data, validate_item, fields, filters, max_items):
+
+    # Validate a bulk update payload, either a JSON array of
+    # {'id': ..., 'changes': {...}} items or a single
+    # {'filter': {...}, 'changes': {...}} object. Returns
+    # (is_valid, error_message, item_errors) like validate_bulk_data.
+
+    if isinstance(data, dict):
+        is_valid, error_message = validate_filter(data.get('filter'), filters)
+        if is_valid:
+            is_valid, error_message = validate_changes(data.get('changes'), validate_item, fields)
+        return is_valid, error_message, []
+    
+    if not isinstance(data, list):
+        return False, 'Request body must be a JSON array or a filter object', []
+    if len(data) == 0:
+        return False, 'Request body must contain at least one item', []
+    if len(data) > max_items:
+        return False, f'At most {max_items} items can be updated at once', []
+    
+    item_errors = []
+    seen = set()
+    for index, item in enumerate(data):
+        if not isinstance(item, dict):
+            error_message = 'Item must be a JSON object'
+        elif not isinstance(item.get('id'), int) or isinstance(item['id'], bool) or item['id'] < 1:
+            error_message = "Field 'id' must be a positive integer"
+        elif item['id'] in seen:
+            error_message = f"Duplicate id {item['id']}"
+        else:
+            seen.add(item['id'])
+            is_valid, error_message = validate_changes(item.get('changes'), validate_item, fields)
+            if is_valid:
+                continue
+        item_errors.append({'index': index, 'message': error_message})
+    
+    if item_errors:
+        return False, f'{len(item_errors)} of {len(data)} items are invalid', item_errors
+    return True, None, []
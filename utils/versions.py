@@ -0,0 +1,50 @@
+"""
+Per-table change counters.
+
+Model write functions bump the counter of every table they modify after the
+commit, and last: once the entity cache, autocomplete and reference snapshot
+hold the write, so a response built under the new counters (and cached or
+tagged with them) never carries data from before it. Read endpoints combine the counters of the tables they read into an
+ETag, so an unchanged counter set means an unchanged response.
+
+Listeners registered with subscribe() are told which tables changed (the
+response cache drops the responses built from them).
+
+Counters live in the process. Each process starts from a random epoch, so
+ETags issued by different processes (or before a restart) never match.
+Writes made by other processes are never counted; ETAG_TTL (utils/etag.py)
+bounds how long their ETags stay valid.
+"""
+import threading
+import uuid
+
+
+class TableVersions:
+    """Thread-safe map of table name -> change counter."""
+
+    def __init__(self):
+        self.epoch = uuid.uuid4().hex
+        self._versions = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, listener):
+        """Call listener(*tables) after every bump."""
+        self._listeners.append(listener)
+
+    def bump(self, *tables):
+        """Record a committed change to each of tables."""
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+        for listener in self._listeners:
+            listener(*tables)
+
+    def get(self, *tables):
+        """Return the current counters of tables, in the order given."""
+        with self._lock:
+            return tuple(self._versions.get(table, 0) for table in tables)
+
+
+# Shared counters bumped by the model write functions
+table_versions = TableVersions()
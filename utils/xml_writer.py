@@ -0,0 +1,200 @@
+"""
+Incremental XML serializer for API responses.
+
+Produces the same element layout as dicttoxml.dicttoxml(data,
+custom_root='response', attr_type=False) but yields the document in chunks
+and precompiles the tags of each row shape (the entity column lists) once
+instead of validating every key of every row.
+"""
+import numbers
+import re
+from functools import lru_cache
+
+from utils.encoders import Row, Rows
+
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" ?>'
+
+# Rows serialized per yielded chunk
+CHUNK_ROWS = 500
+
+_XML_NAME = re.compile(r'^[^\W\d][\w.\-]*$')
+
+
+def escape_xml(text):
+    # Escape the five XML special characters (same entities as dicttoxml)
+    return (text.replace('&', '&amp;')
+                .replace('"', '&quot;')
+                .replace("'", '&apos;')
+                .replace('<', '&lt;')
+                .replace('>', '&gt;'))
+
+
+@lru_cache(maxsize=1024)
+def element_tags(key):
+    """
+    Return the (open, close) tags for a dict key.
+
+    Keys that are not valid XML names are fixed up the way dicttoxml does:
+    numeric keys get an 'n' prefix, spaces become underscores, and anything
+    else becomes <key name="...">.
+    """
+    name = escape_xml(str(key))
+    if _XML_NAME.match(name):
+        return f'<{name}>', f'</{name}>'
+    if name.isdigit():
+        return f'<n{name}>', f'</n{name}>'
+    try:
+        number = float(name)
+        return f'<n{number}>', f'</n{number}>'
+    except ValueError:
+        pass
+    if _XML_NAME.match(name.replace(' ', '_')):
+        name = name.replace(' ', '_')
+        return f'<{name}>', f'</{name}>'
+    return f'<key name="{name}">', '</key>'
+
+
+def _text(value):
+    # Text content of a scalar element
+    if value is None:
+        return ''
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    if isinstance(value, str):
+        return escape_xml(value)
+    if isinstance(value, numbers.Number):
+        return str(value)
+    if hasattr(value, 'isoformat'):
+        return escape_xml(value.isoformat())
+    raise TypeError(f'Unsupported data type: {value!r} ({type(value).__name__})')
+
+
+# Fast paths for the scalar types that make up nearly every row value
+_SCALAR_TEXT = {
+    int: str,
+    float: str,
+    str: escape_xml,
+    type(None): lambda value: '',
+    bool: lambda value: 'true' if value else 'false',
+}
+
+
+class RowTemplate:
+    """Precompiled tags for rows sharing one column list."""
+
+    def __init__(self, columns):
+        self.columns = tuple(columns)
+        self.tags = [element_tags(column) for column in self.columns]
+
+    def render(self, values):
+        # Render one row's values (in column order) as the inside of an <item>
+        parts = []
+        append = parts.append
+        for (open_tag, close_tag), value in zip(self.tags, values):
+            convert = _SCALAR_TEXT.get(type(value))
+            if convert is not None:
+                append(open_tag + convert(value) + close_tag)
+            else:
+                append(open_tag + _render_value(value) + close_tag)
+        return ''.join(parts)
+
+
+@lru_cache(maxsize=128)
+def row_template(columns):
+    # Shared template per column tuple (PILOT_COLUMNS, SHIP_COLUMNS, ...)
+    return RowTemplate(columns)
+
+
+def _render_value(value):
+    # Inner XML of a value of any supported type
+    if isinstance(value, dict):
+        return ''.join(_render_dict(value))
+    if isinstance(value, (list, tuple, set)):
+        return ''.join(_iter_list(value))
+    return _text(value)
+
+
+def _render_dict(obj):
+    for key, value in obj.items():
+        open_tag, close_tag = element_tags(key)
+        yield open_tag + _render_value(value) + close_tag
+
+
+def _iter_list(items):
+    # Yield list items; runs of same-shaped dicts go through a row template
+    template = None
+    chunk = []
+    for item in items:
+        if type(item) is dict:
+            keys = tuple(item)
+            if template is None or template.columns != keys:
+                template = row_template(keys)
+            chunk.append('<item>' + template.render(item.values()) + '</item>')
+        elif isinstance(item, (list, tuple, set)):
+            # dicttoxml leaves a stray space in nested list items
+            chunk.append('<item >' + ''.join(_iter_list(item)) + '</item>')
+        elif type(item) is bool:
+            # Inside lists dicttoxml renders booleans as Python does
+            chunk.append('<item>' + str(item) + '</item>')
+        else:
+            chunk.append('<item>' + _text(item) + '</item>')
+        if len(chunk) >= CHUNK_ROWS:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def iter_xml(data, root='response'):
+    """
+    Yield an XML document for a response payload chunk by chunk.
+
+    Lists of rows are emitted CHUNK_ROWS items at a time, so large lists
+    never exist as a single string.
+    """
+    yield XML_DECLARATION + f'<{root}>'
+    for key, value in data.items():
+        open_tag, close_tag = element_tags(key)
+        if type(value) is Rows:
+            yield open_tag
+            yield from _iter_rows(value.rows, value.columns)
+            yield close_tag
+        elif type(value) is Row:
+            yield open_tag + row_template(value.columns).render(value.values) + close_tag
+        elif isinstance(value, dict):
+            yield open_tag + ''.join(_render_dict(value)) + close_tag
+        elif isinstance(value, (list, tuple, set)):
+            yield open_tag
+            yield from _iter_list(value)
+            yield close_tag
+        else:
+            yield open_tag + _text(value) + close_tag
+    yield f'</{root}>'
+
+
+def _iter_rows(rows, columns):
+    # Yield <item> elements for row tuples, CHUNK_ROWS at a time
+    template = row_template(tuple(columns))
+    chunk = []
+    for row in rows:
+        chunk.append('<item>' + template.render(row) + '</item>')
+        if len(chunk) >= CHUNK_ROWS:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def iter_xml_rows(key, rows, columns, root='response'):
+    # Yield an XML document <root><key><item>row</item>...</key></root> from row tuples
+    open_tag, close_tag = element_tags(key)
+    yield XML_DECLARATION + f'<{root}>' + open_tag
+    yield from _iter_rows(rows, columns)
+    yield close_tag + f'</{root}>'
+
+
+def to_xml(data, root='response'):
+    # Serialize a whole payload to UTF-8 XML bytes
+    return ''.join(iter_xml(data, root)).encode('utf-8')